@@ -2,9 +2,11 @@
 Conexión a la base de datos.
 Soporta PostgreSQL (producción) y SQLite (desarrollo local).
 """
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 import os
+from contextlib import contextmanager
+from contextvars import ContextVar
 from pathlib import Path
 
 # Crear directorio si no existe
@@ -12,6 +14,19 @@ BASE_DIR = Path(__file__).parent.parent
 DB_DIR = BASE_DIR / "database"
 DB_DIR.mkdir(exist_ok=True)
 
+# Ajustes del pool (PostgreSQL) y caché de SQL compilado de SQLAlchemy
+POOL_SIZE = int(os.getenv("FLUJO_CAJA_DB_POOL_SIZE", "5"))
+POOL_MAX_OVERFLOW = int(os.getenv("FLUJO_CAJA_DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = int(os.getenv("FLUJO_CAJA_DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("FLUJO_CAJA_DB_POOL_RECYCLE", "300"))
+CACHE_SQL = int(os.getenv("FLUJO_CAJA_DB_CACHE_SQL", "500"))
+
+# PRAGMAs de SQLite aplicados a cada conexión nueva ("" = no tocar el valor por defecto)
+SQLITE_JOURNAL_MODE = os.getenv("FLUJO_CAJA_SQLITE_JOURNAL", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("FLUJO_CAJA_SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_MB = int(os.getenv("FLUJO_CAJA_SQLITE_MMAP_MB", "64"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("FLUJO_CAJA_SQLITE_BUSY_MS", "5000"))
+
 # Determinar qué base de datos usar
 # Prioridad: Variable de entorno DATABASE_URL > PostgreSQL local > SQLite
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -27,8 +42,14 @@ if DATABASE_URL:
     engine = create_engine(
         DATABASE_URL,
         pool_pre_ping=True,  # Verificar conexiones antes de usarlas
-        pool_recycle=300,     # Reciclar conexiones cada 5 minutos
-        echo=False
+        pool_recycle=POOL_RECYCLE,  # Reciclar conexiones (por defecto cada 5 minutos)
+        query_cache_size=CACHE_SQL,
+        echo=False,
+        **(
+            {}
+            if DATABASE_URL.startswith("sqlite")
+            else {"pool_size": POOL_SIZE, "max_overflow": POOL_MAX_OVERFLOW, "pool_timeout": POOL_TIMEOUT}
+        ),
     )
     # print("Conectado a PostgreSQL (produccion)")
 else:
@@ -39,26 +60,80 @@ else:
     engine = create_engine(
         DATABASE_URL,
         connect_args={"check_same_thread": False},  # Necesario para SQLite con Streamlit
+        query_cache_size=CACHE_SQL,
         echo=False
     )
     # print("Conectado a SQLite (desarrollo local)")
 
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _pragmas_sqlite(dbapi_conn, _registro):
+        """WAL permite leer mientras otra conexión escribe; NORMAL evita un fsync por commit."""
+        cursor = dbapi_conn.cursor()
+        try:
+            if SQLITE_JOURNAL_MODE:
+                cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+            if SQLITE_SYNCHRONOUS:
+                cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+            if SQLITE_MMAP_MB:
+                cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_MB * 1024 * 1024}")
+            if SQLITE_BUSY_TIMEOUT_MS:
+                cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        finally:
+            cursor.close()
+
 # Crear sesión
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Base para los modelos
 Base = declarative_base()
 
+# Conexión compartida por la unidad de trabajo activa (una por rerun de Streamlit)
+_conexion_actual: ContextVar = ContextVar("_conexion_actual", default=None)
+
+
+@contextmanager
+def unidad_de_trabajo():
+    """
+    Reutiliza una sola conexión para todas las sesiones abiertas dentro del bloque
+    (p. ej. un rerun completo de la pestaña Proyección). Las funciones CRUD no cambian:
+    get_db() entrega sesiones ligadas a esa conexión, y cada commit/close de una sesión
+    sigue cerrando su propia transacción. Si otra sesión tiene una transacción abierta en
+    la conexión, get_db() entrega una sesión normal del pool (una sesión que se uniera a esa
+    transacción no confirmaría sus cambios). Los bloques anidados usan la conexión externa.
+
+    Ejemplo:
+        with unidad_de_trabajo():
+            render_proyeccion(usuario)
+    """
+    if _conexion_actual.get() is not None:
+        yield _conexion_actual.get()
+        return
+    with engine.connect() as conexion:
+        token = _conexion_actual.set(conexion)
+        try:
+            yield conexion
+        finally:
+            _conexion_actual.reset(token)
+
+
 def get_db():
     """
     Obtiene una sesión de base de datos.
+    Dentro de unidad_de_trabajo() la sesión usa la conexión compartida del bloque,
+    salvo que esa conexión ya esté dentro de una transacción de otra sesión.
     Úsalo así:
     
     db = next(get_db())
     # hacer operaciones
     db.close()
     """
-    db = SessionLocal()
+    conexion = _conexion_actual.get()
+    if conexion is not None and not conexion.in_transaction():
+        db = SessionLocal(bind=conexion)
+    else:
+        db = SessionLocal()
     try:
         yield db
     finally:
@@ -66,11 +141,14 @@ def get_db():
 
 def init_db():
     """
-    Crea todas las tablas en la base de datos.
+    Crea todas las tablas en la base de datos y aplica las migraciones pendientes
+    (ver database/migraciones.py).
     Solo necesitas llamar esto UNA VEZ al inicio.
     """
     import database.models  # noqa: F401 — registra modelos en Base.metadata
+    from database.migraciones import migrar_esquema
     Base.metadata.create_all(bind=engine)
+    migrar_esquema()
     if os.getenv("DATABASE_URL"):
         print("Tablas creadas en PostgreSQL")
     else:
@@ -3,16 +3,20 @@ Funciones simples para usar la base de datos.
 No necesitas saber SQL - solo llamar estas funciones.
 """
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, func
+from sqlalchemy import and_, or_, func, insert, select
 from database.models import (
     Usuario, Clasificador, Transaccion, ArchivoCargado, 
-    MapeoColumnas, Alerta, TipoTransaccion, ArchivoProyeccion
+    MapeoColumnas, Alerta, TipoTransaccion, ArchivoProyeccion, ResumenArchivo, Job
 )
 from database.connection import get_db
 import bcrypt
+import io
 import json
+import pandas as pd
 from datetime import datetime, date
-from typing import Optional, List, Tuple
+from decimal import Decimal
+from typing import Optional, List, Tuple, Dict
+from modulo_saldos import calcular_saldo_cartola
 
 # ============================================
 # FUNCIONES DE USUARIOS
@@ -87,6 +91,28 @@ def obtener_usuario_por_email(email: str) -> Optional[Usuario]:
 # FUNCIONES DE CLASIFICADORES
 # ============================================
 
+def huella_clasificadores(usuario_id: int) -> Tuple[int, int, Optional[datetime]]:
+    """
+    Huella barata del conjunto de clasificadores: (max id activo, cantidad activa, última edición).
+    La consultan las cachés de reglas compiladas en cada uso, así ven cambios de otros procesos.
+    
+    Ejemplo:
+        max_id, cantidad, actualizado = huella_clasificadores(usuario_id=1)
+    """
+    db = next(get_db())
+    try:
+        max_id, cantidad, actualizado = db.query(
+            func.max(Clasificador.id), func.count(Clasificador.id), func.max(Clasificador.updated_at)
+        ).filter(
+            and_(
+                Clasificador.usuario_id == usuario_id,
+                Clasificador.activo == True
+            )
+        ).one()
+        return (int(max_id or 0), int(cantidad or 0), actualizado)
+    finally:
+        db.close()
+
 def crear_clasificador(
     usuario_id: int,
     nombre: str,
@@ -196,27 +222,174 @@ def guardar_transacciones(transacciones: List[dict], usuario_id: int, archivo_id
     """
     db = next(get_db())
     try:
-        count = 0
-        for trans in transacciones:
-            transaccion = Transaccion(
+        filas = [
+            {
+                "usuario_id": usuario_id,
+                "archivo_id": archivo_id,
+                "fecha": trans.get("fecha"),
+                "descripcion": trans.get("descripcion"),
+                "abono": trans.get("abono", 0),
+                "cargo": trans.get("cargo", 0),
+                "saldo": trans.get("saldo"),
+                "clasificacion": trans.get("clasificacion"),
+                "comentario": trans.get("comentario")
+            }
+            for trans in transacciones
+        ]
+        count = _insertar_transacciones(db, filas)
+        if archivo_id is not None:
+            _refrescar_resumen_archivo(db, archivo_id)
+        db.commit()
+        return count
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+# Columnas del DataFrame de cartola (Tab1) → columnas de la tabla transacciones
+COLUMNAS_DF_TRANSACCIONES = {
+    "fecha": "FECHA",
+    "descripcion": "DESCRIPCION",
+    "abono": "ABONOS (CLP)",
+    "cargo": "CARGOS (CLP)",
+    "saldo": "SALDO (CLP)",
+    "clasificacion": "CLASIFICACION",
+    "comentario": "COMENTARIO",
+}
+
+_COLUMNAS_INSERT = (
+    "usuario_id", "archivo_id", "fecha", "descripcion", "abono",
+    "cargo", "saldo", "clasificacion", "comentario",
+)
+
+# Filas por sentencia en el camino executemany (SQLite y otros motores)
+_LOTE_INSERT = 5000
+
+def guardar_transacciones_dataframe(
+    df: pd.DataFrame,
+    usuario_id: int,
+    nombre_archivo: Optional[str] = None,
+    banco: Optional[str] = None,
+    archivo_id: Optional[int] = None,
+    hash_contenido: Optional[str] = None
+) -> Tuple[int, int]:
+    """
+    Guarda una cartola completa (DataFrame con FECHA, DESCRIPCION, ABONOS (CLP), ...) en bloque.
+    Si no se entrega archivo_id, registra el archivo en la misma transacción.
+    En PostgreSQL (psycopg2) usa COPY FROM STDIN; en el resto, inserts por lotes (executemany).
+    Todo en una sola transacción: si algo falla no queda ni el archivo ni parte de las filas.
+    hash_contenido (SHA-256 del archivo subido) queda en el archivo registrado para
+    detectar re-subidas de la misma cartola.
+    Retorna (cantidad_insertada, archivo_id).
+    
+    Ejemplo:
+        total, archivo_id = guardar_transacciones_dataframe(
+            df, usuario_id=1, nombre_archivo="cartola_noviembre_2025.xlsx"
+        )
+    """
+    db = next(get_db())
+    try:
+        if archivo_id is None:
+            archivo = ArchivoCargado(
                 usuario_id=usuario_id,
-                archivo_id=archivo_id,
-                fecha=trans.get("fecha"),
-                descripcion=trans.get("descripcion"),
-                abono=trans.get("abono", 0),
-                cargo=trans.get("cargo", 0),
-                saldo=trans.get("saldo"),
-                clasificacion=trans.get("clasificacion"),
-                comentario=trans.get("comentario")
+                nombre_archivo=nombre_archivo or "cartola_importada.xlsx",
+                banco=banco,
+                total_registros=len(df),
+                estado="procesado",
+                hash_contenido=hash_contenido
             )
-            db.add(transaccion)
-            count += 1
+            db.add(archivo)
+            db.flush()
+            archivo_id = archivo.id
         
+        filas = _filas_transacciones_desde_df(df, usuario_id, archivo_id)
+        count = _insertar_transacciones(db, filas)
+        _refrescar_resumen_archivo(db, archivo_id)
         db.commit()
-        return count
+        return count, archivo_id
+    except Exception:
+        db.rollback()
+        raise
     finally:
         db.close()
 
+def _filas_transacciones_desde_df(df: pd.DataFrame, usuario_id: int, archivo_id: Optional[int]) -> List[dict]:
+    """Convierte las columnas de la cartola a filas para insert (por columna, sin iterrows)."""
+    n = len(df)
+    
+    def _col(clave: str) -> pd.Series:
+        nombre = COLUMNAS_DF_TRANSACCIONES[clave]
+        if nombre in df.columns:
+            return df[nombre]
+        return pd.Series([None] * n, index=df.index, dtype=object)
+    
+    def _texto(clave: str, default: str) -> List[str]:
+        serie = _col(clave).astype(object)
+        return serie.where(serie.notna(), default).astype(str).tolist()
+    
+    def _monto(clave: str) -> pd.Series:
+        return pd.to_numeric(_col(clave), errors="coerce")
+    
+    # Fechas inválidas: mismo criterio que el guardado fila a fila (fecha actual)
+    fechas = pd.to_datetime(_col("fecha"), errors="coerce")
+    fechas = fechas.fillna(pd.Timestamp(datetime.now()))
+    saldo = _monto("saldo").astype(object)
+    columnas = {
+        "usuario_id": [usuario_id] * n,
+        "archivo_id": [archivo_id] * n,
+        "fecha": list(fechas.dt.to_pydatetime()),
+        "descripcion": _texto("descripcion", ""),
+        "abono": _monto("abono").fillna(0).astype(float).tolist(),
+        "cargo": _monto("cargo").fillna(0).astype(float).tolist(),
+        "saldo": saldo.where(saldo.notna(), None).tolist(),
+        "clasificacion": _texto("clasificacion", "NO CLASIFICADO"),
+        "comentario": _texto("comentario", ""),
+    }
+    return [dict(zip(_COLUMNAS_INSERT, valores)) for valores in zip(*(columnas[c] for c in _COLUMNAS_INSERT))]
+
+def _insertar_transacciones(db: Session, filas: List[dict]) -> int:
+    """Inserta filas de transacciones dentro de la transacción abierta de `db`."""
+    if not filas:
+        return 0
+    dialecto = db.get_bind().dialect
+    if dialecto.name == "postgresql" and dialecto.driver == "psycopg2":
+        _copy_transacciones_postgres(db, filas)
+    else:
+        tabla = Transaccion.__table__
+        for inicio in range(0, len(filas), _LOTE_INSERT):
+            db.execute(insert(tabla), filas[inicio:inicio + _LOTE_INSERT])
+    return len(filas)
+
+def _valor_copy(valor) -> str:
+    """Formato texto de COPY: NULL como \\N y escapes de barra, tab y saltos de línea."""
+    if valor is None:
+        return "\\N"
+    if isinstance(valor, datetime):
+        return valor.isoformat(sep=" ")
+    if isinstance(valor, str):
+        return (
+            valor.replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r")
+        )
+    return str(valor)
+
+def _copy_transacciones_postgres(db: Session, filas: List[dict]) -> None:
+    """COPY transacciones FROM STDIN usando la conexión psycopg2 de la sesión (misma transacción)."""
+    buffer = io.StringIO()
+    for fila in filas:
+        buffer.write("\t".join(_valor_copy(fila[c]) for c in _COLUMNAS_INSERT))
+        buffer.write("\n")
+    buffer.seek(0)
+    conexion_dbapi = db.connection().connection
+    with conexion_dbapi.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY transacciones ({', '.join(_COLUMNAS_INSERT)}) FROM STDIN",
+            buffer
+        )
+
 def obtener_transacciones(
     usuario_id: int,
     fecha_desde: Optional[datetime] = None,
@@ -261,11 +434,104 @@ def obtener_transacciones(
         db.close()
 
 
+def obtener_transacciones_dataframe(
+    usuario_id: int,
+    archivo_id: Optional[int] = None,
+    tamano_lote: int = 5000
+) -> pd.DataFrame:
+    """
+    Lee las transacciones directo a un DataFrame con las columnas de la cartola
+    (FECHA, DESCRIPCION, ABONOS (CLP), CARGOS (CLP), SALDO (CLP), CLASIFICACION, COMENTARIO).
+    Usa un SELECT de Core solo con esas columnas (sin objetos ORM) y lee por lotes (yield_per).
+    Tipos: FECHA datetime64, montos float64, CLASIFICACION category.
+    Mismo orden que obtener_transacciones: por id si hay archivo_id, si no por fecha.
+    
+    Ejemplo:
+        df = obtener_transacciones_dataframe(usuario_id=1, archivo_id=5)
+    """
+    tabla = Transaccion.__table__
+    columnas_df = list(COLUMNAS_DF_TRANSACCIONES.values())
+    stmt = select(*(tabla.c[c] for c in COLUMNAS_DF_TRANSACCIONES)).where(tabla.c.usuario_id == usuario_id)
+    if archivo_id:
+        stmt = stmt.where(tabla.c.archivo_id == archivo_id).order_by(tabla.c.id.asc())
+    else:
+        stmt = stmt.order_by(tabla.c.fecha.asc())
+    
+    db = next(get_db())
+    try:
+        resultado = db.execute(stmt.execution_options(yield_per=tamano_lote))
+        trozos = [
+            pd.DataFrame.from_records(lote, columns=columnas_df, coerce_float=True)
+            for lote in resultado.partitions()
+        ]
+    finally:
+        db.close()
+    
+    if not trozos:
+        return pd.DataFrame(columns=columnas_df)
+    df = pd.concat(trozos, ignore_index=True) if len(trozos) > 1 else trozos[0]
+    
+    df["FECHA"] = pd.to_datetime(df["FECHA"], errors="coerce")
+    for col in ("ABONOS (CLP)", "CARGOS (CLP)", "SALDO (CLP)"):
+        df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+    df["ABONOS (CLP)"] = df["ABONOS (CLP)"].fillna(0.0)
+    df["CARGOS (CLP)"] = df["CARGOS (CLP)"].fillna(0.0)
+    df["DESCRIPCION"] = df["DESCRIPCION"].fillna("")
+    df["COMENTARIO"] = df["COMENTARIO"].fillna("")
+    clasificacion = df["CLASIFICACION"].fillna("")
+    df["CLASIFICACION"] = clasificacion.where(clasificacion != "", "NO CLASIFICADO").astype("category")
+    return df
+
+
+def obtener_movimientos_saldo_dataframe(
+    usuario_id: Optional[int],
+    archivo_id: Optional[int] = None
+) -> pd.DataFrame:
+    """
+    Columnas mínimas para el saldo cartola (ID, FECHA, ABONOS (CLP), CARGOS (CLP), SALDO (CLP)),
+    ordenadas por id. Con usuario_id=None no filtra por usuario (solo por archivo).
+    SALDO queda NaN cuando el banco no lo informó en esa línea.
+    
+    Ejemplo:
+        df = obtener_movimientos_saldo_dataframe(usuario_id=1, archivo_id=5)
+    """
+    tabla = Transaccion.__table__
+    columnas_df = ["ID", "FECHA", "ABONOS (CLP)", "CARGOS (CLP)", "SALDO (CLP)"]
+    stmt = select(tabla.c.id, tabla.c.fecha, tabla.c.abono, tabla.c.cargo, tabla.c.saldo)
+    if usuario_id is not None:
+        stmt = stmt.where(tabla.c.usuario_id == usuario_id)
+    if archivo_id is not None:
+        stmt = stmt.where(tabla.c.archivo_id == archivo_id)
+    stmt = stmt.order_by(tabla.c.id.asc())
+    
+    db = next(get_db())
+    try:
+        filas = db.execute(stmt).all()
+    finally:
+        db.close()
+    
+    df = pd.DataFrame.from_records(filas, columns=columnas_df, coerce_float=True)
+    df["FECHA"] = pd.to_datetime(df["FECHA"], errors="coerce")
+    for col in ("ABONOS (CLP)", "CARGOS (CLP)", "SALDO (CLP)"):
+        df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+    return df
+
+
 def obtener_rango_fechas_transacciones(
     usuario_id: int,
     archivo_id: Optional[int] = None,
 ) -> Tuple[Optional[date], Optional[date]]:
-    """Fecha mínima y máxima de movimientos para cuadrar comparativo proyectado/ejecutado."""
+    """
+    Fecha mínima y máxima de movimientos para cuadrar comparativo proyectado/ejecutado.
+    Con archivo_id se lee del resumen materializado (resumen_archivos).
+    """
+    if archivo_id is not None:
+        resumen = obtener_resumen_archivo(archivo_id)
+        if resumen is not None and resumen.usuario_id == usuario_id:
+            return (
+                resumen.fecha_min.date() if resumen.fecha_min else None,
+                resumen.fecha_max.date() if resumen.fecha_max else None,
+            )
     db = next(get_db())
     try:
         q = db.query(
@@ -315,7 +581,8 @@ def registrar_archivo(
     usuario_id: int,
     nombre_archivo: str,
     banco: Optional[str] = None,
-    total_registros: int = 0
+    total_registros: int = 0,
+    hash_contenido: Optional[str] = None
 ) -> ArchivoCargado:
     """
     Registra un archivo cargado.
@@ -335,7 +602,8 @@ def registrar_archivo(
             nombre_archivo=nombre_archivo,
             banco=banco,
             total_registros=total_registros,
-            estado="procesado"
+            estado="procesado",
+            hash_contenido=hash_contenido
         )
         db.add(archivo)
         db.commit()
@@ -354,6 +622,142 @@ def obtener_archivos(usuario_id: int) -> List[ArchivoCargado]:
     finally:
         db.close()
 
+def obtener_archivo_por_hash(usuario_id: int, hash_contenido: str) -> Optional[ArchivoCargado]:
+    """
+    Busca una cartola ya guardada por el usuario con el mismo contenido (SHA-256).
+    
+    Ejemplo:
+        existente = obtener_archivo_por_hash(usuario_id=1, hash_contenido=sha256_hex)
+        if existente:
+            print(f"Ya guardada como {existente.nombre_archivo}")
+    """
+    if not hash_contenido:
+        return None
+    db = next(get_db())
+    try:
+        return db.query(ArchivoCargado).filter(
+            and_(
+                ArchivoCargado.usuario_id == usuario_id,
+                ArchivoCargado.hash_contenido == hash_contenido
+            )
+        ).order_by(ArchivoCargado.id.desc()).first()
+    finally:
+        db.close()
+
+# ============================================
+# FUNCIONES DE RESUMEN POR ARCHIVO
+# ============================================
+
+def _dec2(valor) -> Optional[Decimal]:
+    if valor is None or pd.isna(valor):
+        return None
+    return Decimal(str(round(float(valor), 2)))
+
+def _a_datetime(valor) -> Optional[datetime]:
+    if valor is None or pd.isna(valor):
+        return None
+    return pd.Timestamp(valor).to_pydatetime()
+
+def _refrescar_resumen_archivo(db: Session, archivo_id: int) -> Optional[ResumenArchivo]:
+    """
+    Recalcula el resumen de un archivo dentro de la sesión entregada (sin commit):
+    una sola lectura de columnas mínimas, saldo con el motor de modulo_saldos y totales con groupby.
+    """
+    tabla = Transaccion.__table__
+    filas = db.execute(
+        select(
+            tabla.c.id, tabla.c.usuario_id, tabla.c.fecha, tabla.c.abono,
+            tabla.c.cargo, tabla.c.saldo, tabla.c.clasificacion
+        ).where(tabla.c.archivo_id == archivo_id)
+    ).all()
+    resumen = db.get(ResumenArchivo, archivo_id)
+    if not filas:
+        if resumen is not None:
+            db.delete(resumen)
+        return None
+    
+    mov = pd.DataFrame.from_records(
+        filas, columns=["id", "usuario_id", "fecha", "abono", "cargo", "saldo", "clasificacion"],
+        coerce_float=True
+    )
+    mov["fecha"] = pd.to_datetime(mov["fecha"], errors="coerce")
+    for col in ("abono", "cargo", "saldo"):
+        mov[col] = pd.to_numeric(mov[col], errors="coerce").astype("float64")
+    mov["abono"] = mov["abono"].fillna(0.0)
+    mov["cargo"] = mov["cargo"].fillna(0.0)
+    clasificacion = mov["clasificacion"].fillna("")
+    mov["clasificacion"] = clasificacion.where(clasificacion != "", "NO CLASIFICADO")
+    
+    saldo = calcular_saldo_cartola(mov["fecha"], mov["abono"], mov["cargo"], mov["saldo"], orden=mov["id"])
+    por_clase = mov.groupby("clasificacion", sort=True).agg(
+        abonos=("abono", "sum"), cargos=("cargo", "sum"), cantidad=("id", "size")
+    )
+    totales = {
+        str(clase): {"abonos": round(float(f.abonos), 2), "cargos": round(float(f.cargos), 2), "cantidad": int(f.cantidad)}
+        for clase, f in por_clase.iterrows()
+    }
+    
+    if resumen is None:
+        resumen = ResumenArchivo(archivo_id=archivo_id)
+        db.add(resumen)
+    resumen.usuario_id = int(mov["usuario_id"].iloc[0])
+    resumen.saldo_cierre = _dec2(saldo.saldo_cierre)
+    resumen.fecha_saldo = _a_datetime(saldo.fecha_cierre)
+    resumen.hay_saldo_real = saldo.hay_saldo_real
+    resumen.fecha_min = _a_datetime(mov["fecha"].min())
+    resumen.fecha_max = _a_datetime(mov["fecha"].max())
+    resumen.total_abonos = _dec2(mov["abono"].sum())
+    resumen.total_cargos = _dec2(mov["cargo"].sum())
+    resumen.total_registros = len(mov)
+    resumen.totales_clasificacion = json.dumps(totales, ensure_ascii=False)
+    return resumen
+
+def refrescar_resumen_archivo(archivo_id: int) -> Optional[ResumenArchivo]:
+    """
+    Recalcula y guarda el resumen de un archivo. Llamar después de persistir
+    cambios en sus transacciones (por ejemplo, una reclasificación).
+    
+    Ejemplo:
+        resumen = refrescar_resumen_archivo(archivo_id=5)
+    """
+    db = next(get_db())
+    try:
+        resumen = _refrescar_resumen_archivo(db, archivo_id)
+        db.commit()
+        if resumen is not None:
+            db.refresh(resumen)
+        return resumen
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def obtener_resumen_archivo(archivo_id: int, calcular_si_falta: bool = True) -> Optional[ResumenArchivo]:
+    """
+    Resumen materializado de un archivo (saldo de cierre, rango de fechas, totales).
+    Archivos guardados antes de existir la tabla se calculan y guardan en la primera consulta.
+    
+    Ejemplo:
+        resumen = obtener_resumen_archivo(archivo_id=5)
+        if resumen:
+            print(resumen.saldo_cierre, resumen.fecha_max)
+    """
+    db = next(get_db())
+    try:
+        resumen = db.get(ResumenArchivo, archivo_id)
+    finally:
+        db.close()
+    if resumen is None and calcular_si_falta:
+        resumen = refrescar_resumen_archivo(archivo_id)
+    return resumen
+
+def totales_por_clasificacion(resumen: ResumenArchivo) -> Dict[str, dict]:
+    """Decodifica resumen.totales_clasificacion ({clasificacion: {abonos, cargos, cantidad}})."""
+    if resumen is None or not resumen.totales_clasificacion:
+        return {}
+    return json.loads(resumen.totales_clasificacion)
+
 # ============================================
 # FUNCIONES DE MAPEO DE COLUMNAS
 # ============================================
@@ -591,3 +995,135 @@ def eliminar_archivo_proyeccion(archivo_id: int, usuario_id: int) -> bool:
     finally:
         db.close()
 
+
+# ============================================
+# FUNCIONES DE TRABAJOS EN SEGUNDO PLANO
+# ============================================
+
+ESTADOS_JOB_ACTIVOS = ("pendiente", "en_curso")
+
+
+def crear_job(
+    usuario_id: int,
+    tipo: str,
+    descripcion: Optional[str] = None,
+    huella: Optional[str] = None,
+    proceso: Optional[str] = None
+) -> Job:
+    """Registra un trabajo en estado 'pendiente' (lo ejecuta modulo_jobs en el proceso indicado)."""
+    db = next(get_db())
+    try:
+        job = Job(
+            usuario_id=usuario_id,
+            tipo=tipo,
+            descripcion=descripcion,
+            estado="pendiente",
+            progreso=0.0,
+            huella=huella,
+            proceso=proceso,
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        return job
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def actualizar_job(job_id: int, **campos) -> None:
+    """
+    Actualiza estado/progreso/mensaje/resultado de un trabajo (los valores None se ignoran).
+    
+    Ejemplo:
+        actualizar_job(7, progreso=0.5, mensaje="5.000 facturas guardadas")
+    """
+    valores = {k: v for k, v in campos.items() if v is not None and hasattr(Job, k)}
+    if not valores:
+        return
+    db = next(get_db())
+    try:
+        db.query(Job).filter(Job.id == job_id).update(valores, synchronize_session=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def obtener_job(job_id: int, usuario_id: Optional[int] = None) -> Optional[Job]:
+    db = next(get_db())
+    try:
+        query = db.query(Job).filter(Job.id == job_id)
+        if usuario_id is not None:
+            query = query.filter(Job.usuario_id == usuario_id)
+        return query.first()
+    finally:
+        db.close()
+
+
+def listar_jobs_activos(usuario_id: int) -> List[Job]:
+    """Trabajos pendientes o en curso del usuario, más antiguos primero."""
+    db = next(get_db())
+    try:
+        return (
+            db.query(Job)
+            .filter(Job.usuario_id == usuario_id, Job.estado.in_(ESTADOS_JOB_ACTIVOS))
+            .order_by(Job.id.asc())
+            .all()
+        )
+    finally:
+        db.close()
+
+
+def listar_procesos_jobs_activos() -> List[Tuple[Optional[str], Optional[datetime]]]:
+    """(proceso, creado_en más antiguo) de cada proceso con trabajos pendientes o en curso."""
+    db = next(get_db())
+    try:
+        return [
+            (proceso, creado)
+            for proceso, creado in db.query(Job.proceso, func.min(Job.creado_en))
+            .filter(Job.estado.in_(ESTADOS_JOB_ACTIVOS))
+            .group_by(Job.proceso)
+            .all()
+        ]
+    finally:
+        db.close()
+
+
+def marcar_jobs_interrumpidos(procesos: List[Optional[str]]) -> int:
+    """
+    Marca como 'error' los trabajos activos de esos procesos, que ya no existen
+    (la cola vive en memoria: tras un reinicio nadie los va a terminar).
+    None representa los trabajos sin proceso registrado.
+    """
+    if not procesos:
+        return 0
+    nombres = [p for p in procesos if p is not None]
+    condicion = Job.proceso.in_(nombres) if nombres else None
+    if None in procesos:
+        condicion = Job.proceso.is_(None) if condicion is None else or_(condicion, Job.proceso.is_(None))
+    db = next(get_db())
+    try:
+        n = (
+            db.query(Job)
+            .filter(Job.estado.in_(ESTADOS_JOB_ACTIVOS), condicion)
+            .update(
+                {
+                    "estado": "error",
+                    "error": "Interrumpido: la aplicación se reinició antes de terminar.",
+                    "terminado_en": datetime.now(),
+                },
+                synchronize_session=False,
+            )
+        )
+        db.commit()
+        return n
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
@@ -4,18 +4,26 @@ CRUD para tablas del módulo de proyección de caja (Tab 2).
 from __future__ import annotations
 
 import calendar
+import io
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from dataclasses import dataclass
 from datetime import date
-from decimal import Decimal
-from typing import Any, Dict, List, Optional, Sequence, Union
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 
-from sqlalchemy import desc, func
-from sqlalchemy.exc import OperationalError
+import numpy as np
+import pandas as pd
+from sqlalchemy import desc, func, insert, select
+from sqlalchemy.engine import Connection
 
-from database.connection import get_db, engine
+from database.connection import SessionLocal, get_db
 from database.models import (
     CategoriaFinanciera,
     Clasificador,
     ProyeccionCarga,
+    ProyeccionCargaActual,
     ProyeccionCreditoBancario,
     ProyeccionEgresoParametrico,
     ProyeccionFactura,
@@ -31,55 +39,6 @@ from database.models import (
 Number = Union[int, float, Decimal, None]
 
 
-def _ensure_mapeo_categorias_table() -> None:
-    """
-    Garantiza existencia de la tabla de mapeo en entornos con BD ya creada.
-    Evita romper la app cuando se agrega esta tabla en una iteración posterior.
-    """
-    ProyeccionMapeoCategoria.__table__.create(bind=engine, checkfirst=True)
-
-
-def _ensure_creditos_bancarios_table() -> None:
-    """Garantiza existencia de tabla de créditos bancarios en BD existentes."""
-    ProyeccionCreditoBancario.__table__.create(bind=engine, checkfirst=True)
-
-
-def _ensure_proyeccion_remuneraciones_columns() -> None:
-    """Columnas nuevas en libro de remuneraciones (BD ya existente)."""
-    ddl = [
-        "ALTER TABLE proyeccion_remuneraciones ADD COLUMN monto_impuesto_unico DECIMAL(15, 0)",
-        "ALTER TABLE proyeccion_remuneraciones ADD COLUMN monto_salud_adicional DECIMAL(15, 0)",
-        "ALTER TABLE proyeccion_remuneraciones ADD COLUMN monto_cesantia DECIMAL(15, 0)",
-    ]
-    with engine.begin() as conn:
-        for q in ddl:
-            try:
-                conn.exec_driver_sql(q)
-            except Exception:
-                pass
-
-
-def _ensure_parametros_usuario_columns() -> None:
-    """
-    Asegura columnas nuevas de parámetros en BD existente (SQLite/Postgres).
-    """
-    ddl = [
-        "ALTER TABLE proyeccion_parametros_usuario ADD COLUMN venta_global_esperada_mes DECIMAL(15, 0)",
-        "ALTER TABLE proyeccion_parametros_usuario ADD COLUMN porcentaje_ventas_contado DECIMAL(5, 4)",
-        "ALTER TABLE proyeccion_parametros_usuario ADD COLUMN compra_global_esperada_mes DECIMAL(15, 0)",
-        "ALTER TABLE proyeccion_parametros_usuario ADD COLUMN porcentaje_compras_contado DECIMAL(5, 4)",
-        "ALTER TABLE proyeccion_parametros_usuario ADD COLUMN porcentaje_morosidad_cxc DECIMAL(5, 4)",
-        "ALTER TABLE proyeccion_parametros_usuario ADD COLUMN porcentaje_recuperabilidad_morosos DECIMAL(5, 4)",
-    ]
-    with engine.begin() as conn:
-        for q in ddl:
-            try:
-                conn.exec_driver_sql(q)
-            except Exception:
-                # Columna ya existe u otro motor no requiere alter.
-                pass
-
-
 # --- Seed maestro categorías (diseño v2 / v3) ---
 SEED_CATEGORIAS_FINANCIERAS: List[Dict[str, Any]] = [
     {"codigo": "CLIENTES", "nombre": "Pago de Clientes", "tipo": "ingreso", "orden_display": 10},
@@ -125,13 +84,14 @@ def _sumar_un_mes_mismo_dia(fecha: date) -> date:
     return date(y, m, min(fecha.day, last))
 
 
-def seed_categorias_financieras() -> int:
+def seed_categorias_financieras(conn: Optional[Connection] = None) -> int:
     """
     Inserta categorías maestras si no existen (idempotente por codigo).
     Si existe pero está inactiva (p. ej. en BD servidor tras pruebas), la reactiva.
+    Con conn (la migración) escribe dentro de su transacción: el commit final es de quien la abrió.
     Retorna cantidad de filas insertadas o reactivadas.
     """
-    db = next(get_db())
+    db = SessionLocal(bind=conn) if conn is not None else next(get_db())
     inserted = 0
     reactivated = 0
     try:
@@ -155,6 +115,8 @@ def seed_categorias_financieras() -> int:
             )
             inserted += 1
         db.commit()
+        if inserted or reactivated:
+            _invalidar_categorias()
         return inserted + reactivated
     except Exception:
         db.rollback()
@@ -219,6 +181,7 @@ def crear_categoria_financiera(
         db.add(c)
         db.commit()
         db.refresh(c)
+        _invalidar_categorias()
         return c
     except Exception:
         db.rollback()
@@ -238,6 +201,7 @@ def actualizar_categoria_financiera(categoria_id: int, **campos) -> Optional[Cat
                 setattr(c, k, v)
         db.commit()
         db.refresh(c)
+        _invalidar_categorias()
         return c
     except Exception:
         db.rollback()
@@ -254,6 +218,7 @@ def desactivar_categoria_financiera(categoria_id: int) -> bool:
             return False
         c.activo = False
         db.commit()
+        _invalidar_categorias()
         return True
     except Exception:
         db.rollback()
@@ -262,6 +227,87 @@ def desactivar_categoria_financiera(categoria_id: int) -> bool:
         db.close()
 
 
+# --- Registro de categorías en memoria ---
+# El maestro de categorías casi no cambia: se lee una vez por proceso y se vuelve a leer solo
+# cuando sube la versión (seed / crear / actualizar / desactivar en este proceso).
+_version_categorias = 0
+_registro_cache: Optional["RegistroCategorias"] = None
+_registro_lock = threading.Lock()
+
+
+def _invalidar_categorias() -> None:
+    global _version_categorias
+    _version_categorias += 1
+
+
+@dataclass(frozen=True)
+class RegistroCategorias:
+    """Todas las categorías (registros inmutables) con índices id / codigo y la versión leída."""
+
+    version: int
+    por_id: Dict[int, Any]
+    por_codigo: Dict[str, Any]
+    activas: Tuple[Any, ...]
+
+    def codigo_a_id(self) -> Dict[str, int]:
+        """codigo → id entre activas; con duplicados gana el menor id."""
+        out: Dict[str, int] = {}
+        for c in sorted(self.activas, key=lambda c: c.id or 0):
+            cod = (c.codigo or "").strip()
+            if cod and cod not in out:
+                out[cod] = c.id
+        return out
+
+    def nombre(self, categoria_id: int) -> Optional[str]:
+        c = self.por_id.get(categoria_id)
+        return c.nombre if c else None
+
+    def codigo(self, categoria_id: int) -> Optional[str]:
+        c = self.por_id.get(categoria_id)
+        return c.codigo if c else None
+
+
+def registro_categorias() -> RegistroCategorias:
+    """Registro de categorías del proceso (una consulta por versión)."""
+    global _registro_cache
+    registro = _registro_cache
+    if registro is not None and registro.version == _version_categorias:
+        return registro
+    with _registro_lock:
+        version = _version_categorias
+        if _registro_cache is not None and _registro_cache.version == version:
+            return _registro_cache
+        db = next(get_db())
+        try:
+            filas = [_registro(c) for c in db.query(CategoriaFinanciera).order_by(CategoriaFinanciera.id).all()]
+        finally:
+            db.close()
+        por_codigo: Dict[str, Any] = {}
+        # Igual que obtener_categoria_por_codigo: activa de menor id; si no hay, la de menor id
+        for c in filas:
+            actual = por_codigo.get(c.codigo)
+            if actual is None or (c.activo is True and actual.activo is not True):
+                por_codigo[c.codigo] = c
+        activas = tuple(
+            sorted(
+                (c for c in filas if c.activo is True),
+                key=lambda c: (c.orden_display is None, c.orden_display or 0, c.id),
+            )
+        )
+        _registro_cache = RegistroCategorias(version, {c.id: c for c in filas}, por_codigo, activas)
+        return _registro_cache
+
+
+def categoria_por_id(categoria_id: int) -> Optional[Any]:
+    """Como obtener_categoria_por_id, resuelto desde el registro en memoria."""
+    return registro_categorias().por_id.get(categoria_id)
+
+
+def categoria_por_codigo(codigo: str) -> Optional[Any]:
+    """Como obtener_categoria_por_codigo, resuelto desde el registro en memoria."""
+    return registro_categorias().por_codigo.get(codigo)
+
+
 # --- Proyección cargas ---
 def crear_proyeccion_carga(
     user_id: int,
@@ -282,6 +328,8 @@ def crear_proyeccion_carga(
             notas=notas,
         )
         db.add(c)
+        db.flush()
+        _fijar_carga_actual(db, user_id, tipo, c.id)
         db.commit()
         db.refresh(c)
         return c
@@ -292,6 +340,33 @@ def crear_proyeccion_carga(
         db.close()
 
 
+def _fijar_carga_actual(db, user_id: int, tipo: str, carga_id: Optional[int]) -> None:
+    """Apunta la carga vigente de (usuario, tipo); con carga_id None borra el puntero."""
+    actual = db.get(ProyeccionCargaActual, (user_id, tipo))
+    if carga_id is None:
+        if actual is not None:
+            db.delete(actual)
+    elif actual is None:
+        db.add(ProyeccionCargaActual(user_id=user_id, tipo=tipo, carga_id=carga_id))
+    else:
+        actual.carga_id = carga_id
+
+
+def obtener_carga_actual_id(user_id: int, tipo: str) -> Optional[int]:
+    """
+    Id de la carga vigente (la última subida) de ese tipo, sin recorrer el historial.
+
+    Ejemplo:
+        cxc_id = obtener_carga_actual_id(user_id, "cxc")
+    """
+    db = next(get_db())
+    try:
+        actual = db.get(ProyeccionCargaActual, (user_id, tipo))
+        return actual.carga_id if actual else None
+    finally:
+        db.close()
+
+
 def obtener_proyeccion_carga(carga_id: int) -> Optional[ProyeccionCarga]:
     db = next(get_db())
     try:
@@ -338,6 +413,21 @@ def eliminar_proyeccion_carga(carga_id: int) -> bool:
         c = db.query(ProyeccionCarga).filter(ProyeccionCarga.id == carga_id).first()
         if not c:
             return False
+        actual = db.get(ProyeccionCargaActual, (c.user_id, c.tipo))
+        if actual is not None and actual.carga_id == carga_id:
+            # La vigente pasa a ser la anterior del mismo tipo (único caso que ordena el historial)
+            anterior = (
+                db.query(ProyeccionCarga.id)
+                .filter(
+                    ProyeccionCarga.user_id == c.user_id,
+                    ProyeccionCarga.tipo == c.tipo,
+                    ProyeccionCarga.id != carga_id,
+                )
+                .order_by(desc(ProyeccionCarga.fecha_carga), desc(ProyeccionCarga.id))
+                .first()
+            )
+            _fijar_carga_actual(db, c.user_id, c.tipo, anterior[0] if anterior else None)
+            db.flush()
         db.query(ProyeccionFactura).filter(ProyeccionFactura.carga_id == carga_id).delete()
         db.query(ProyeccionRemuneracion).filter(ProyeccionRemuneracion.carga_id == carga_id).delete()
         db.delete(c)
@@ -526,7 +616,6 @@ def crear_proyeccion_remuneracion(
     monto_impuesto_unico: Number = None,
     dia_pago: Optional[int] = None,
 ) -> ProyeccionRemuneracion:
-    _ensure_proyeccion_remuneraciones_columns()
     db = next(get_db())
     try:
         r = ProyeccionRemuneracion(
@@ -559,7 +648,6 @@ def crear_proyeccion_remuneracion(
 def crear_proyeccion_remuneraciones_bulk(registros: Sequence[Dict[str, Any]]) -> int:
     if not registros:
         return 0
-    _ensure_proyeccion_remuneraciones_columns()
     db = next(get_db())
     try:
         objs = []
@@ -589,7 +677,6 @@ def crear_proyeccion_remuneraciones_bulk(registros: Sequence[Dict[str, Any]]) ->
 
 
 def listar_proyeccion_remuneraciones_carga(carga_id: int) -> List[ProyeccionRemuneracion]:
-    _ensure_proyeccion_remuneraciones_columns()
     db = next(get_db())
     try:
         return db.query(ProyeccionRemuneracion).filter(ProyeccionRemuneracion.carga_id == carga_id).all()
@@ -730,6 +817,7 @@ def actualizar_proyeccion_snapshot(snapshot_id: int, **campos) -> Optional[Proye
                 setattr(s, k, v)
         db.commit()
         db.refresh(s)
+        invalidar_cache_snapshot(snapshot_id)
         return s
     finally:
         db.close()
@@ -743,6 +831,7 @@ def eliminar_proyeccion_snapshot(snapshot_id: int) -> bool:
             return False
         db.delete(s)
         db.commit()
+        invalidar_cache_snapshot(snapshot_id)
         return True
     except Exception:
         db.rollback()
@@ -776,8 +865,12 @@ def crear_proyeccion_linea(
             referencia_id=referencia_id,
         )
         db.add(ln)
+        # El blob ya no refleja todas las líneas: las lecturas vuelven a proyeccion_lineas
+        _verificar_lineas_en_filas(db, snapshot_id)
+        _descartar_blob_lineas(db, snapshot_id)
         db.commit()
         db.refresh(ln)
+        invalidar_cache_snapshot(snapshot_id)
         return ln
     except Exception:
         db.rollback()
@@ -789,16 +882,140 @@ def crear_proyeccion_linea(
 def crear_proyeccion_lineas_bulk(registros: Sequence[Dict[str, Any]]) -> int:
     if not registros:
         return 0
+    filas = []
+    for r in registros:
+        copy = dict(r)
+        copy["monto"] = _dec(copy.get("monto"))
+        filas.append(copy)
     db = next(get_db())
     try:
-        objs = []
+        # INSERT executemany de Core: sin instanciar ni rastrear un objeto ORM por línea
+        db.execute(insert(ProyeccionLinea.__table__), filas)
+        snapshot_ids = {r["snapshot_id"] for r in filas}
+        for sid in snapshot_ids:
+            _verificar_lineas_en_filas(db, sid)
+            _descartar_blob_lineas(db, sid)
+        db.commit()
+        for sid in snapshot_ids:
+            invalidar_cache_snapshot(sid)
+        return len(filas)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+# Las líneas de cada snapshot se guardan siempre como blob columnar en proyeccion_snapshots.lineas_blob.
+# La tabla proyeccion_lineas queda como índice opcional para consultas ad-hoc
+# (FLUJO_CAJA_LINEAS_EN_FILAS=0 la omite y abarata la generación).
+LINEAS_SNAPSHOT_EN_FILAS = os.getenv("FLUJO_CAJA_LINEAS_EN_FILAS", "1") == "1"
+
+_COLUMNAS_BLOB_LINEAS = (
+    "fecha_impacto", "categoria_id", "descripcion", "monto", "tipo_confianza", "origen", "referencia_id",
+)
+LineaSnapshot = namedtuple(
+    "LineaSnapshot",
+    ("id", "snapshot_id") + _COLUMNAS_BLOB_LINEAS,
+)
+
+def _verificar_lineas_en_filas(db: Any, snapshot_id: int) -> None:
+    """
+    Editar por fila solo es posible si proyeccion_lineas tiene todas las líneas. Con
+    LINEAS_SNAPSHOT_EN_FILAS apagado el blob es la única copia: anularlo las perdería.
+    """
+    if LINEAS_SNAPSHOT_EN_FILAS:
+        return
+    t = ProyeccionSnapshot.__table__
+    if db.execute(select(t.c.id).where(t.c.id == snapshot_id, t.c.lineas_blob.is_not(None))).first():
+        raise ValueError(
+            f"Las líneas del snapshot {snapshot_id} solo están en el blob (FLUJO_CAJA_LINEAS_EN_FILAS=0); "
+            "no se pueden editar por fila."
+        )
+
+
+def _descartar_blob_lineas(db: Any, snapshot_id: int) -> None:
+    """Anula el blob cuando las filas cambian: las lecturas vuelven a proyeccion_lineas."""
+    db.execute(
+        ProyeccionSnapshot.__table__.update()
+        .where(ProyeccionSnapshot.__table__.c.id == snapshot_id)
+        .values(lineas_blob=None)
+    )
+
+
+def _monto_entero(v: Number) -> int:
+    # Igual que DECIMAL(15, 0) en PostgreSQL: redondeo a entero alejándose de cero en .5
+    return int((_dec(v) or Decimal(0)).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def serializar_lineas_snapshot(registros: Sequence[Dict[str, Any]]) -> bytes:
+    """Líneas → npz comprimido con un arreglo por columna, ordenadas por fecha_impacto."""
+    orden = sorted(range(len(registros)), key=lambda i: registros[i]["fecha_impacto"])
+    filas = [registros[i] for i in orden]
+    columnas = {
+        "fecha_impacto": np.array([r["fecha_impacto"] for r in filas], dtype="datetime64[D]"),
+        "categoria_id": np.array([int(r["categoria_id"]) for r in filas], dtype=np.int64),
+        "descripcion": np.array([r.get("descripcion") or "" for r in filas], dtype=str),
+        "monto": np.array([_monto_entero(r.get("monto")) for r in filas], dtype=np.int64),
+        "tipo_confianza": np.array([r.get("tipo_confianza") or "" for r in filas], dtype=str),
+        "origen": np.array([r.get("origen") or "" for r in filas], dtype=str),
+        "referencia_id": np.array(
+            [-1 if r.get("referencia_id") is None else int(r["referencia_id"]) for r in filas], dtype=np.int64
+        ),
+    }
+    buf = io.BytesIO()
+    np.savez_compressed(buf, **columnas)
+    return buf.getvalue()
+
+
+def deserializar_lineas_snapshot(blob: bytes) -> pd.DataFrame:
+    """
+    Blob → DataFrame (fecha_impacto datetime64, monto int64, referencia_id Int64).
+    Cada columna envuelve el arreglo leído, sin copiar.
+    """
+    with np.load(io.BytesIO(blob), allow_pickle=False) as datos:
+        arreglos = {c: datos[c] for c in _COLUMNAS_BLOB_LINEAS}
+    df = pd.DataFrame(
+        {
+            "fecha_impacto": arreglos["fecha_impacto"].astype("datetime64[s]"),
+            "categoria_id": arreglos["categoria_id"],
+            "descripcion": arreglos["descripcion"].astype(object),
+            "monto": arreglos["monto"],
+            "tipo_confianza": arreglos["tipo_confianza"].astype(object),
+            "origen": arreglos["origen"].astype(object),
+            "referencia_id": pd.array(arreglos["referencia_id"], dtype="Int64"),
+        },
+        copy=False,
+    )
+    df.loc[df["referencia_id"] < 0, "referencia_id"] = pd.NA
+    return df
+
+
+def guardar_lineas_snapshot(snapshot_id: int, registros: Sequence[Dict[str, Any]]) -> int:
+    """
+    Guarda las líneas de un snapshot: blob columnar en la cabecera y, si
+    LINEAS_SNAPSHOT_EN_FILAS, también filas en proyeccion_lineas. Un solo commit.
+    """
+    blob = serializar_lineas_snapshot(registros)
+    filas = []
+    if LINEAS_SNAPSHOT_EN_FILAS:
         for r in registros:
             copy = dict(r)
+            copy["snapshot_id"] = snapshot_id
             copy["monto"] = _dec(copy.get("monto"))
-            objs.append(ProyeccionLinea(**copy))
-        db.add_all(objs)
+            filas.append(copy)
+    db = next(get_db())
+    try:
+        db.execute(
+            ProyeccionSnapshot.__table__.update()
+            .where(ProyeccionSnapshot.__table__.c.id == snapshot_id)
+            .values(lineas_blob=blob)
+        )
+        if filas:
+            db.execute(insert(ProyeccionLinea.__table__), filas)
         db.commit()
-        return len(objs)
+        invalidar_cache_snapshot(snapshot_id)
+        return len(registros)
     except Exception:
         db.rollback()
         raise
@@ -806,6 +1023,73 @@ def crear_proyeccion_lineas_bulk(registros: Sequence[Dict[str, Any]]) -> int:
         db.close()
 
 
+def _blob_lineas_snapshot(snapshot_id: int) -> Optional[bytes]:
+    db = next(get_db())
+    try:
+        return db.execute(
+            ProyeccionSnapshot.__table__.select()
+            .with_only_columns(ProyeccionSnapshot.__table__.c.lineas_blob)
+            .where(ProyeccionSnapshot.__table__.c.id == snapshot_id)
+        ).scalar()
+    finally:
+        db.close()
+
+
+def obtener_lineas_snapshot_dataframe(snapshot_id: int) -> pd.DataFrame:
+    """
+    Líneas del snapshot como DataFrame columnar. Lee el blob; snapshots anteriores
+    al blob se arman desde proyeccion_lineas.
+    """
+    blob = _blob_lineas_snapshot(snapshot_id)
+    if blob:
+        return deserializar_lineas_snapshot(blob)
+    lineas = listar_proyeccion_lineas_snapshot(snapshot_id)
+    return pd.DataFrame(
+        {
+            "fecha_impacto": pd.to_datetime([ln.fecha_impacto for ln in lineas]),
+            "categoria_id": np.array([ln.categoria_id for ln in lineas], dtype=np.int64),
+            "descripcion": [ln.descripcion or "" for ln in lineas],
+            "monto": np.array([_monto_entero(ln.monto) for ln in lineas], dtype=np.int64),
+            "tipo_confianza": [ln.tipo_confianza or "" for ln in lineas],
+            "origen": [ln.origen or "" for ln in lineas],
+            "referencia_id": pd.array([ln.referencia_id for ln in lineas], dtype="Int64"),
+        }
+    )
+
+
+def listar_lineas_snapshot(snapshot_id: int) -> List[LineaSnapshot]:
+    """
+    Líneas del snapshot como registros inmutables con los mismos atributos que ProyeccionLinea
+    (fecha_impacto date, monto Decimal). Usa el blob si existe; si no, proyeccion_lineas.
+    Las líneas leídas del blob no tienen fila propia: su id es None.
+    """
+    blob = _blob_lineas_snapshot(snapshot_id)
+    if not blob:
+        return [
+            LineaSnapshot(
+                ln.id, ln.snapshot_id, ln.fecha_impacto, ln.categoria_id, ln.descripcion,
+                ln.monto, ln.tipo_confianza, ln.origen, ln.referencia_id,
+            )
+            for ln in listar_proyeccion_lineas_snapshot(snapshot_id)
+        ]
+    with np.load(io.BytesIO(blob), allow_pickle=False) as datos:
+        fechas = datos["fecha_impacto"].tolist()
+        categorias = datos["categoria_id"].tolist()
+        descripciones = datos["descripcion"].tolist()
+        montos = datos["monto"].tolist()
+        confianzas = datos["tipo_confianza"].tolist()
+        origenes = datos["origen"].tolist()
+        referencias = datos["referencia_id"].tolist()
+    return [
+        LineaSnapshot(
+            None, snapshot_id, fechas[i], categorias[i], descripciones[i] or None,
+            Decimal(montos[i]), confianzas[i] or None, origenes[i] or None,
+            None if referencias[i] < 0 else referencias[i],
+        )
+        for i in range(len(fechas))
+    ]
+
+
 def listar_proyeccion_lineas_snapshot(snapshot_id: int) -> List[ProyeccionLinea]:
     db = next(get_db())
     try:
@@ -839,8 +1123,12 @@ def actualizar_proyeccion_linea(linea_id: int, **campos) -> Optional[ProyeccionL
             if k == "monto":
                 v = _dec(v)
             setattr(ln, k, v)
+        # Línea editada: el blob del snapshot queda obsoleto y se lee desde proyeccion_lineas
+        _verificar_lineas_en_filas(db, ln.snapshot_id)
+        _descartar_blob_lineas(db, ln.snapshot_id)
         db.commit()
         db.refresh(ln)
+        invalidar_cache_snapshot(ln.snapshot_id)
         return ln
     finally:
         db.close()
@@ -850,7 +1138,9 @@ def eliminar_lineas_snapshot(snapshot_id: int) -> int:
     db = next(get_db())
     try:
         n = db.query(ProyeccionLinea).filter(ProyeccionLinea.snapshot_id == snapshot_id).delete()
+        _descartar_blob_lineas(db, snapshot_id)
         db.commit()
+        invalidar_cache_snapshot(snapshot_id)
         return n
     except Exception:
         db.rollback()
@@ -859,6 +1149,94 @@ def eliminar_lineas_snapshot(snapshot_id: int) -> int:
         db.close()
 
 
+# --- Caché en proceso de snapshots ---
+# Un snapshot no cambia después de generado: su cabecera, líneas y agregados derivados se guardan
+# por snapshot_id en un LRU del proceso, compartido entre sesiones. Solo lo invalidan las funciones
+# que modifican el snapshot o sus líneas (eliminar/actualizar snapshot, crear/actualizar/eliminar líneas).
+CACHE_SNAPSHOTS_MAX = int(os.getenv("FLUJO_CAJA_CACHE_SNAPSHOTS", "16"))
+CACHE_DERIVADOS_POR_SNAPSHOT = 32
+
+
+@dataclass
+class SnapshotEnCache:
+    snapshot: ProyeccionSnapshot
+    lineas: Tuple[LineaSnapshot, ...]
+    derivados: "OrderedDict[Any, Any]"
+    _dataframe: Optional[pd.DataFrame] = None
+
+    @property
+    def dataframe(self) -> pd.DataFrame:
+        """Líneas como DataFrame (se arma una vez por entrada)."""
+        if self._dataframe is None:
+            self._dataframe = pd.DataFrame.from_records(self.lineas, columns=LineaSnapshot._fields)
+        return self._dataframe
+
+
+class _CacheSnapshots:
+    def __init__(self, max_entradas: int, max_derivados: int):
+        self.max_entradas = max_entradas
+        self.max_derivados = max_derivados
+        self._entradas: "OrderedDict[int, SnapshotEnCache]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, snapshot_id: int) -> Optional[SnapshotEnCache]:
+        with self._lock:
+            entrada = self._entradas.get(snapshot_id)
+            if entrada is not None:
+                self._entradas.move_to_end(snapshot_id)
+                return entrada
+        snap = obtener_proyeccion_snapshot(snapshot_id)
+        if snap is None:
+            return None
+        entrada = SnapshotEnCache(snap, tuple(listar_lineas_snapshot(snapshot_id)), OrderedDict())
+        with self._lock:
+            self._entradas[snapshot_id] = entrada
+            self._entradas.move_to_end(snapshot_id)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+        return entrada
+
+    def derivado(self, snapshot_id: int, clave: Any, calcular: Callable[[], Any]) -> Any:
+        entrada = self.obtener(snapshot_id)
+        if entrada is None:
+            return calcular()
+        with self._lock:
+            if clave in entrada.derivados:
+                entrada.derivados.move_to_end(clave)
+                return entrada.derivados[clave]
+        valor = calcular()
+        with self._lock:
+            entrada.derivados[clave] = valor
+            while len(entrada.derivados) > self.max_derivados:
+                entrada.derivados.popitem(last=False)
+        return valor
+
+    def invalidar(self, snapshot_id: int) -> None:
+        with self._lock:
+            self._entradas.pop(snapshot_id, None)
+
+
+_cache_snapshots = _CacheSnapshots(CACHE_SNAPSHOTS_MAX, CACHE_DERIVADOS_POR_SNAPSHOT)
+
+
+def obtener_snapshot_cacheado(snapshot_id: int) -> Optional[SnapshotEnCache]:
+    """Cabecera + líneas del snapshot desde el LRU del proceso (consulta la BD solo la primera vez)."""
+    return _cache_snapshots.obtener(snapshot_id)
+
+
+def derivado_snapshot(snapshot_id: int, clave: Any, calcular: Callable[[], Any]) -> Any:
+    """
+    Memoiza un agregado derivado de las líneas del snapshot (waterfall, matriz, comparativo).
+    `clave` debe incluir todo lo que altere el resultado (filtros, escenario). El valor se comparte:
+    quien lo use no debe mutarlo.
+    """
+    return _cache_snapshots.derivado(snapshot_id, clave, calcular)
+
+
+def invalidar_cache_snapshot(snapshot_id: int) -> None:
+    _cache_snapshots.invalidar(snapshot_id)
+
+
 # --- Importaciones ---
 def crear_proyeccion_importacion(user_id: int, **campos) -> ProyeccionImportacion:
     db = next(get_db())
@@ -1038,7 +1416,6 @@ def crear_proyeccion_credito_bancario(
     cuotas_pendientes: int,
     activo: bool = True,
 ) -> ProyeccionCreditoBancario:
-    _ensure_creditos_bancarios_table()
     db = next(get_db())
     try:
         c = ProyeccionCreditoBancario(
@@ -1065,7 +1442,6 @@ def crear_proyeccion_credito_bancario(
 def listar_proyeccion_creditos_bancarios(
     user_id: int, *, solo_activos: bool = True
 ) -> List[ProyeccionCreditoBancario]:
-    _ensure_creditos_bancarios_table()
     db = next(get_db())
     try:
         q = db.query(ProyeccionCreditoBancario).filter(ProyeccionCreditoBancario.user_id == user_id)
@@ -1082,7 +1458,6 @@ def listar_proyeccion_creditos_bancarios(
 def actualizar_proyeccion_credito_bancario(
     credito_id: int, user_id: int, **campos
 ) -> Optional[ProyeccionCreditoBancario]:
-    _ensure_creditos_bancarios_table()
     db = next(get_db())
     try:
         c = (
@@ -1108,7 +1483,6 @@ def actualizar_proyeccion_credito_bancario(
 
 
 def eliminar_proyeccion_credito_bancario(credito_id: int, user_id: int) -> bool:
-    _ensure_creditos_bancarios_table()
     db = next(get_db())
     try:
         c = (
@@ -1136,7 +1510,6 @@ def registrar_pago_cuota_credito_bancario(credito_id: int, user_id: int) -> Opti
     - mueve fecha_proximo_pago al mes siguiente,
     - desactiva el crédito cuando llega a 0 cuotas.
     """
-    _ensure_creditos_bancarios_table()
     db = next(get_db())
     try:
         c = (
@@ -1176,7 +1549,6 @@ def registrar_pago_cuota_credito_bancario(credito_id: int, user_id: int) -> Opti
 
 # --- Parámetros usuario ---
 def obtener_proyeccion_parametros_usuario(user_id: int) -> Optional[ProyeccionParametrosUsuario]:
-    _ensure_parametros_usuario_columns()
     db = next(get_db())
     try:
         return db.query(ProyeccionParametrosUsuario).filter(ProyeccionParametrosUsuario.user_id == user_id).first()
@@ -1185,7 +1557,6 @@ def obtener_proyeccion_parametros_usuario(user_id: int) -> Optional[ProyeccionPa
 
 
 def obtener_o_crear_proyeccion_parametros_usuario(user_id: int) -> ProyeccionParametrosUsuario:
-    _ensure_parametros_usuario_columns()
     db = next(get_db())
     try:
         p = db.query(ProyeccionParametrosUsuario).filter(ProyeccionParametrosUsuario.user_id == user_id).first()
@@ -1204,7 +1575,6 @@ def obtener_o_crear_proyeccion_parametros_usuario(user_id: int) -> ProyeccionPar
 
 
 def actualizar_proyeccion_parametros_usuario(user_id: int, **campos) -> ProyeccionParametrosUsuario:
-    _ensure_parametros_usuario_columns()
     db = next(get_db())
     try:
         p = db.query(ProyeccionParametrosUsuario).filter(ProyeccionParametrosUsuario.user_id == user_id).first()
@@ -1284,26 +1654,14 @@ def listar_categorias_tab1_usuario(user_id: int) -> List[str]:
 
 
 def listar_mapeo_conceptos_tab1(user_id: int) -> List[ProyeccionMapeoCategoria]:
-    _ensure_mapeo_categorias_table()
     db = next(get_db())
     try:
-        try:
-            return (
-                db.query(ProyeccionMapeoCategoria)
-                .filter(ProyeccionMapeoCategoria.user_id == user_id)
-                .order_by(ProyeccionMapeoCategoria.concepto_proyeccion.asc())
-                .all()
-            )
-        except OperationalError:
-            # Último resguardo si el motor no alcanzó a crear tabla antes del query.
-            db.rollback()
-            _ensure_mapeo_categorias_table()
-            return (
-                db.query(ProyeccionMapeoCategoria)
-                .filter(ProyeccionMapeoCategoria.user_id == user_id)
-                .order_by(ProyeccionMapeoCategoria.concepto_proyeccion.asc())
-                .all()
-            )
+        return (
+            db.query(ProyeccionMapeoCategoria)
+            .filter(ProyeccionMapeoCategoria.user_id == user_id)
+            .order_by(ProyeccionMapeoCategoria.concepto_proyeccion.asc())
+            .all()
+        )
     finally:
         db.close()
 
@@ -1316,7 +1674,6 @@ def obtener_mapeo_conceptos_tab1_dict(user_id: int) -> Dict[str, str]:
 
 
 def upsert_mapeo_concepto_tab1(user_id: int, concepto_proyeccion: str, categoria_tab1: str) -> ProyeccionMapeoCategoria:
-    _ensure_mapeo_categorias_table()
     db = next(get_db())
     try:
         m = (
@@ -1347,7 +1704,6 @@ def upsert_mapeo_concepto_tab1(user_id: int, concepto_proyeccion: str, categoria
 
 
 def eliminar_mapeo_concepto_tab1(user_id: int, concepto_proyeccion: str) -> bool:
-    _ensure_mapeo_categorias_table()
     db = next(get_db())
     try:
         m = (
@@ -1365,3 +1721,120 @@ def eliminar_mapeo_concepto_tab1(user_id: int, concepto_proyeccion: str) -> bool
         return True
     finally:
         db.close()
+
+
+# --- Insumos del motor de snapshot (una sola sesión) ---
+_TIPOS_REGISTRO: Dict[type, type] = {}
+
+
+def _registro(obj: Any) -> Any:
+    """Copia inmutable (namedtuple con las columnas del modelo) de una fila ORM, sin sesión asociada."""
+    cls = type(obj)
+    tipo = _TIPOS_REGISTRO.get(cls)
+    if tipo is None:
+        tipo = namedtuple(f"{cls.__name__}Registro", [a.key for a in cls.__mapper__.column_attrs])
+        _TIPOS_REGISTRO[cls] = tipo
+    return tipo(*(getattr(obj, k) for k in tipo._fields))
+
+
+@dataclass(frozen=True)
+class SnapshotInputs:
+    """
+    Todo lo que lee el motor de snapshot para un usuario, como registros inmutables:
+    últimas cargas CxC/CxP/remuneraciones, parámetros, egresos, créditos activos,
+    importaciones y categorías activas.
+    """
+
+    user_id: int
+    carga_cxc_id: Optional[int]
+    carga_cxp_id: Optional[int]
+    carga_rem_id: Optional[int]
+    facturas_cxc: Tuple[Any, ...]
+    facturas_cxp: Tuple[Any, ...]
+    remuneraciones: Tuple[Any, ...]
+    parametros: Optional[Any]
+    egresos: Tuple[Any, ...]
+    creditos_activos: Tuple[Any, ...]
+    importaciones: Tuple[Any, ...]
+    categorias: Tuple[Any, ...]
+
+    @property
+    def facturas_ultimas_cargas(self) -> Tuple[Any, ...]:
+        return self.facturas_cxc + self.facturas_cxp
+
+    @property
+    def vencimiento_minimo(self) -> Optional[date]:
+        fechas = [f.fecha_vencimiento for f in self.facturas_ultimas_cargas if f.fecha_vencimiento is not None]
+        return min(fechas) if fechas else None
+
+
+def cargar_insumos_snapshot(user_id: int) -> SnapshotInputs:
+    """
+    Carga los insumos del snapshot en una sola sesión y pocas consultas
+    (en PostgreSQL remoto pesan más los viajes a la BD que el cálculo).
+    """
+    db = next(get_db())
+    try:
+        ultima: Dict[str, int] = dict(
+            db.query(ProyeccionCargaActual.tipo, ProyeccionCargaActual.carga_id)
+            .filter(
+                ProyeccionCargaActual.user_id == user_id,
+                ProyeccionCargaActual.tipo.in_(("cxc", "cxp", "remuneraciones")),
+            )
+            .all()
+        )
+        cxc_id, cxp_id, rem_id = ultima.get("cxc"), ultima.get("cxp"), ultima.get("remuneraciones")
+
+        ids_facturas = [c for c in (cxc_id, cxp_id) if c]
+        facturas = (
+            db.query(ProyeccionFactura)
+            .filter(ProyeccionFactura.carga_id.in_(ids_facturas))
+            .order_by(ProyeccionFactura.fecha_vencimiento, ProyeccionFactura.id)
+            .all()
+            if ids_facturas
+            else []
+        )
+        remuneraciones = (
+            db.query(ProyeccionRemuneracion).filter(ProyeccionRemuneracion.carga_id == rem_id).all()
+            if rem_id
+            else []
+        )
+        parametros = (
+            db.query(ProyeccionParametrosUsuario).filter(ProyeccionParametrosUsuario.user_id == user_id).first()
+        )
+        egresos = db.query(ProyeccionEgresoParametrico).filter(ProyeccionEgresoParametrico.user_id == user_id).all()
+        creditos = (
+            db.query(ProyeccionCreditoBancario)
+            .filter(
+                ProyeccionCreditoBancario.user_id == user_id,
+                ProyeccionCreditoBancario.activo.is_(True),
+            )
+            .order_by(
+                ProyeccionCreditoBancario.fecha_proximo_pago.asc(),
+                ProyeccionCreditoBancario.id.desc(),
+            )
+            .all()
+        )
+        importaciones = (
+            db.query(ProyeccionImportacion)
+            .filter(ProyeccionImportacion.user_id == user_id)
+            .order_by(desc(ProyeccionImportacion.created_at))
+            .all()
+        )
+
+        return SnapshotInputs(
+            user_id=user_id,
+            carga_cxc_id=cxc_id,
+            carga_cxp_id=cxp_id,
+            carga_rem_id=rem_id,
+            facturas_cxc=tuple(_registro(f) for f in facturas if f.carga_id == cxc_id),
+            facturas_cxp=tuple(_registro(f) for f in facturas if f.carga_id == cxp_id),
+            remuneraciones=tuple(_registro(r) for r in remuneraciones),
+            parametros=_registro(parametros) if parametros else None,
+            egresos=tuple(_registro(e) for e in egresos),
+            creditos_activos=tuple(_registro(c) for c in creditos),
+            importaciones=tuple(_registro(i) for i in importaciones),
+            categorias=registro_categorias().activas,
+        )
+    finally:
+        db.close()
@@ -0,0 +1,229 @@
+"""
+Migraciones del esquema, versionadas en la tabla esquema_version.
+Se ejecutan una sola vez (al iniciar la app, en init_db o en init_db_render.py);
+el código que atiende pedidos asume el esquema ya al día y no emite DDL.
+
+Para agregar una migración: añadir una tupla al final de MIGRACIONES con el
+siguiente número de versión. Nunca renumerar ni editar migraciones ya publicadas.
+"""
+import threading
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Table, desc, inspect, select, text
+from sqlalchemy.engine import Connection
+
+from .connection import Base, engine
+from .models import (
+    ArchivoCargado,
+    Clasificador,
+    EsquemaVersion,
+    Job,
+    ProyeccionCarga,
+    ProyeccionCargaActual,
+    ProyeccionLinea,
+    ProyeccionParametrosUsuario,
+    ProyeccionRemuneracion,
+    ProyeccionSnapshot,
+    Transaccion,
+)
+
+
+def _agregar_columnas(conn: Connection, tabla: Table, columnas: Sequence[str]) -> None:
+    """ALTER TABLE ... ADD COLUMN solo para las columnas que aún no existen (tipo según el modelo)."""
+    existentes = {c["name"] for c in inspect(conn).get_columns(tabla.name)}
+    for nombre in columnas:
+        if nombre in existentes:
+            continue
+        tipo = tabla.c[nombre].type.compile(dialect=conn.dialect)
+        conn.exec_driver_sql(f"ALTER TABLE {tabla.name} ADD COLUMN {nombre} {tipo}")
+
+
+def _crear_indices(conn: Connection, tabla: Table, columnas: Sequence[str]) -> None:
+    for idx in tabla.indexes:
+        if any(c.name in columnas for c in idx.columns):
+            idx.create(bind=conn, checkfirst=True)
+
+
+def _crear_indices_por_nombre(conn: Connection, tabla: Table, nombres: Sequence[str]) -> None:
+    for idx in tabla.indexes:
+        if idx.name in nombres:
+            idx.create(bind=conn, checkfirst=True)
+
+
+def _m1_columnas_remuneraciones(conn: Connection) -> None:
+    _agregar_columnas(
+        conn,
+        ProyeccionRemuneracion.__table__,
+        ["monto_impuesto_unico", "monto_salud_adicional", "monto_cesantia"],
+    )
+
+
+def _m2_columnas_parametros_usuario(conn: Connection) -> None:
+    _agregar_columnas(
+        conn,
+        ProyeccionParametrosUsuario.__table__,
+        [
+            "venta_global_esperada_mes",
+            "porcentaje_ventas_contado",
+            "compra_global_esperada_mes",
+            "porcentaje_compras_contado",
+            "porcentaje_morosidad_cxc",
+            "porcentaje_recuperabilidad_morosos",
+        ],
+    )
+
+
+def _m3_hash_archivos_cargados(conn: Connection) -> None:
+    tabla = ArchivoCargado.__table__
+    _agregar_columnas(conn, tabla, ["hash_contenido"])
+    _crear_indices(conn, tabla, ["hash_contenido"])
+
+
+def _m4_blob_lineas_snapshot(conn: Connection) -> None:
+    _agregar_columnas(conn, ProyeccionSnapshot.__table__, ["lineas_blob"])
+
+
+def _m5_seed_categorias_financieras(conn: Connection) -> None:
+    # Import diferido: crud_proyeccion importa módulos de la app que no hacen falta para el DDL
+    from .crud_proyeccion import seed_categorias_financieras
+
+    seed_categorias_financieras(conn)
+
+
+def _m6_indices_transacciones(conn: Connection) -> None:
+    _crear_indices_por_nombre(
+        conn,
+        Transaccion.__table__,
+        [
+            "ix_transacciones_usuario_archivo_id",
+            "ix_transacciones_usuario_fecha",
+            "ix_transacciones_usuario_clasificacion",
+        ],
+    )
+
+
+def _m7_indices_proyeccion_y_carga_actual(conn: Connection) -> None:
+    _crear_indices_por_nombre(conn, ProyeccionCarga.__table__, ["ix_proyeccion_cargas_user_tipo_fecha"])
+    _crear_indices_por_nombre(conn, ProyeccionSnapshot.__table__, ["ix_proyeccion_snapshots_user_version"])
+    _crear_indices_por_nombre(conn, ProyeccionLinea.__table__, ["ix_proyeccion_lineas_snapshot_fecha"])
+
+    # Puntero inicial: la carga más reciente de cada (usuario, tipo) del historial
+    cargas = ProyeccionCarga.__table__
+    actuales = ProyeccionCargaActual.__table__
+    existentes = {(f.user_id, f.tipo) for f in conn.execute(select(actuales.c.user_id, actuales.c.tipo))}
+    filas = conn.execute(
+        select(cargas.c.id, cargas.c.user_id, cargas.c.tipo).order_by(desc(cargas.c.fecha_carga), desc(cargas.c.id))
+    )
+    nuevas = {}
+    for carga_id, user_id, tipo in filas:
+        if (user_id, tipo) not in existentes:
+            nuevas.setdefault((user_id, tipo), carga_id)
+    if nuevas:
+        conn.execute(
+            actuales.insert(),
+            [{"user_id": u, "tipo": t, "carga_id": c} for (u, t), c in nuevas.items()],
+        )
+
+
+def _m8_tabla_jobs(conn: Connection) -> None:
+    Job.__table__.create(bind=conn, checkfirst=True)
+
+
+def _m9_huella_y_proceso_jobs(conn: Connection) -> None:
+    _agregar_columnas(conn, Job.__table__, ["huella", "proceso"])
+
+
+def _m10_clasificadores_updated_at(conn: Connection) -> None:
+    # Filas existentes quedan en NULL: la huella sigue contando id y cantidad
+    _agregar_columnas(conn, Clasificador.__table__, ["updated_at"])
+
+
+# (versión, descripción, paso). Las tablas nuevas las crea create_all antes de los pasos.
+MIGRACIONES: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "Columnas de impuestos en proyeccion_remuneraciones", _m1_columnas_remuneraciones),
+    (2, "Columnas de ventas/compras globales en proyeccion_parametros_usuario", _m2_columnas_parametros_usuario),
+    (3, "archivos_cargados.hash_contenido e índice", _m3_hash_archivos_cargados),
+    (4, "proyeccion_snapshots.lineas_blob", _m4_blob_lineas_snapshot),
+    (5, "Seed de categorías financieras", _m5_seed_categorias_financieras),
+    (6, "Índices compuestos de transacciones por usuario", _m6_indices_transacciones),
+    (7, "Índices de proyección y puntero de carga vigente por tipo", _m7_indices_proyeccion_y_carga_actual),
+    (8, "Tabla jobs (trabajos en segundo plano)", _m8_tabla_jobs),
+    (9, "jobs.huella y jobs.proceso", _m9_huella_y_proceso_jobs),
+    (10, "clasificadores.updated_at", _m10_clasificadores_updated_at),
+]
+
+VERSION_ESQUEMA = MIGRACIONES[-1][0]
+
+_migrado = False
+_lock = threading.Lock()
+
+# Clave del advisory lock de PostgreSQL que serializa migraciones entre procesos
+CLAVE_BLOQUEO_MIGRACION = 0x464C554A4F
+
+
+def _leer_version(conn: Connection) -> int:
+    if not inspect(conn).has_table(EsquemaVersion.__tablename__):
+        return 0
+    tabla = EsquemaVersion.__table__
+    fila = conn.execute(tabla.select().order_by(tabla.c.version.desc()).limit(1)).first()
+    return int(fila.version) if fila else 0
+
+
+def version_actual(conn: Optional[Connection] = None) -> int:
+    """Última versión aplicada (0 si la tabla esquema_version está vacía o no existe)."""
+    if conn is not None:
+        return _leer_version(conn)
+    with engine.connect() as conn:
+        return _leer_version(conn)
+
+
+def _bloquear_migracion(conn: Connection) -> None:
+    """
+    Abre la transacción de conn tomando un bloqueo a nivel de base de datos, que se
+    libera con su commit/rollback: pg_advisory_xact_lock en PostgreSQL y BEGIN IMMEDIATE
+    en SQLite (reserva la escritura del archivo; los demás esperan busy_timeout).
+    """
+    if conn.dialect.name == "sqlite":
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+    elif conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:clave)"), {"clave": CLAVE_BLOQUEO_MIGRACION})
+
+
+def migrar_esquema() -> List[int]:
+    """
+    Crea las tablas faltantes y aplica, en orden, las migraciones pendientes.
+    Idempotente y barata cuando el esquema ya está al día (una consulta); dentro del
+    proceso solo trabaja la primera vez. Entre procesos (varios workers arrancando a la
+    vez) se serializa con un bloqueo de la base de datos y la versión se vuelve a leer
+    dentro de él; todos los pasos pendientes van en esa misma transacción.
+    Retorna las versiones aplicadas en esta llamada.
+
+    Ejemplo:
+        from database.migraciones import migrar_esquema
+        migrar_esquema()
+    """
+    global _migrado
+    if _migrado:
+        return []
+    with _lock:
+        if _migrado:
+            return []
+        aplicadas: List[int] = []
+        if version_actual() < VERSION_ESQUEMA:
+            with engine.connect() as conn:
+                _bloquear_migracion(conn)
+                # Otro proceso pudo migrar mientras se esperaba el bloqueo
+                actual = version_actual(conn)
+                if actual < VERSION_ESQUEMA:
+                    Base.metadata.create_all(bind=conn)
+                    for version, descripcion, paso in MIGRACIONES:
+                        if version <= actual:
+                            continue
+                        paso(conn)
+                        conn.execute(
+                            EsquemaVersion.__table__.insert().values(version=version, descripcion=descripcion)
+                        )
+                        aplicadas.append(version)
+                conn.commit()
+        _migrado = True
+        return aplicadas
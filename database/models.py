@@ -3,8 +3,8 @@ Modelos de base de datos.
 Estos son como "plantillas" para guardar datos.
 No necesitas entender SQL - solo saber que existen estas "cajas" para guardar información.
 """
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Date, Text, DECIMAL, ForeignKey, Enum, LargeBinary
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Date, Text, DECIMAL, Float, ForeignKey, Enum, LargeBinary, Index
+from sqlalchemy.orm import deferred, relationship
 from sqlalchemy.sql import func
 from .connection import Base
 import enum
@@ -51,6 +51,7 @@ class Clasificador(Base):
     excluir = Column(Text, nullable=True)  # JSON array como texto (opcional)
     activo = Column(Boolean, default=True)
     orden = Column(Integer, default=0)  # Orden de evaluación
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
     
     # Relación
     usuario = relationship("Usuario", back_populates="clasificadores")
@@ -89,6 +90,7 @@ class ArchivoCargado(Base):
     banco = Column(String(100))
     total_registros = Column(Integer, default=0)
     estado = Column(String(50), default="procesado")  # 'procesado', 'error', 'pendiente'
+    hash_contenido = Column(String(64), index=True, nullable=True)  # SHA-256 del archivo subido
     
     # Relaciones
     usuario = relationship("Usuario", back_populates="archivos")
@@ -117,6 +119,33 @@ class Transaccion(Base):
     usuario = relationship("Usuario", back_populates="transacciones")
     archivo = relationship("ArchivoCargado", back_populates="transacciones")
 
+    # Índices compuestos para los accesos por usuario (ver database/planes_consulta.py)
+    __table_args__ = (
+        Index("ix_transacciones_usuario_archivo_id", "usuario_id", "archivo_id", "id"),  # cartola en orden original
+        Index("ix_transacciones_usuario_fecha", "usuario_id", "fecha"),  # rangos y orden por fecha
+        Index("ix_transacciones_usuario_clasificacion", "usuario_id", "clasificacion"),  # DISTINCT / sin clasificar
+    )
+
+# ============================================
+# RESUMEN POR ARCHIVO (materializado)
+# ============================================
+class ResumenArchivo(Base):
+    """Saldo de cierre y totales de cada cartola, recalculados al guardar o reclasificar"""
+    __tablename__ = "resumen_archivos"
+    
+    archivo_id = Column(Integer, ForeignKey("archivos_cargados.id"), primary_key=True)
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False, index=True)
+    saldo_cierre = Column(DECIMAL(15, 2), nullable=True)  # Saldo cartola al cierre (propagado)
+    fecha_saldo = Column(DateTime, nullable=True)
+    hay_saldo_real = Column(Boolean, default=False)  # Alguna línea trae el saldo del banco
+    fecha_min = Column(DateTime, nullable=True)
+    fecha_max = Column(DateTime, nullable=True)
+    total_abonos = Column(DECIMAL(15, 2), default=0)
+    total_cargos = Column(DECIMAL(15, 2), default=0)
+    total_registros = Column(Integer, default=0)
+    totales_clasificacion = Column(Text)  # JSON {clasificacion: {abonos, cargos, cantidad}}
+    actualizado = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
 # ============================================
 # TABLA DE ALERTAS
 # ============================================
@@ -193,6 +222,21 @@ class ProyeccionCarga(Base):
     facturas = relationship("ProyeccionFactura", back_populates="carga")
     remuneraciones = relationship("ProyeccionRemuneracion", back_populates="carga")
 
+    __table_args__ = (
+        Index("ix_proyeccion_cargas_user_tipo_fecha", user_id, tipo, fecha_carga.desc()),
+    )
+
+
+class ProyeccionCargaActual(Base):
+    """Carga vigente por usuario y tipo (la última subida), para no ordenar el historial."""
+
+    __tablename__ = "proyeccion_cargas_actuales"
+
+    user_id = Column(Integer, ForeignKey("usuarios.id"), primary_key=True)
+    tipo = Column(String(20), primary_key=True)  # cxc / cxp / remuneraciones
+    carga_id = Column(Integer, ForeignKey("proyeccion_cargas.id"), nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
 
 class ProyeccionFactura(Base):
     """CxC / CxP normalizadas desde Excel (v3 reemplaza facturas_erp sueltas con carga_id)."""
@@ -261,6 +305,8 @@ class ProyeccionSnapshot(Base):
     etiqueta = Column(String(100), nullable=True)
     notas = Column(Text, nullable=True)
     created_at = Column(DateTime, server_default=func.now())
+    # Líneas serializadas en columnas comprimidas (npz); diferida para no leerla al listar snapshots
+    lineas_blob = deferred(Column(LargeBinary, nullable=True))
 
     usuario = relationship("Usuario", foreign_keys=[user_id])
     lineas = relationship(
@@ -269,6 +315,10 @@ class ProyeccionSnapshot(Base):
         cascade="all, delete-orphan",
     )
 
+    __table_args__ = (
+        Index("ix_proyeccion_snapshots_user_version", user_id, version.desc(), created_at.desc()),
+    )
+
 
 class ProyeccionLinea(Base):
     """Detalle de una proyección con tipo_confianza."""
@@ -289,6 +339,10 @@ class ProyeccionLinea(Base):
     snapshot = relationship("ProyeccionSnapshot", back_populates="lineas")
     categoria = relationship("CategoriaFinanciera", back_populates="lineas")
 
+    __table_args__ = (
+        Index("ix_proyeccion_lineas_snapshot_fecha", snapshot_id, fecha_impacto),
+    )
+
 
 class ProyeccionImportacion(Base):
     """Importaciones manuales (formulario)."""
@@ -391,3 +445,44 @@ class ProyeccionMapeoCategoria(Base):
 
     usuario = relationship("Usuario", foreign_keys=[user_id])
 
+
+
+# ============================================
+# TRABAJOS EN SEGUNDO PLANO
+# ============================================
+class Job(Base):
+    """Operación larga (snapshot, carga Excel, guardar cartola) ejecutada fuera del rerun (ver modulo_jobs.py)."""
+
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
+    tipo = Column(String(50), nullable=False)  # snapshot / carga_cxc / carga_cxp / carga_remuneraciones / guardar_cartola
+    descripcion = Column(String(255), nullable=True)
+    estado = Column(String(20), nullable=False, default="pendiente")  # pendiente / en_curso / completado / error
+    progreso = Column(Float, default=0.0)  # 0..1
+    mensaje = Column(String(255), nullable=True)
+    resultado = Column(Text, nullable=True)  # JSON (snapshot_id, carga_id, ...)
+    error = Column(Text, nullable=True)
+    huella = Column(String(64), nullable=True)  # identifica el contenido enviado (p. ej. SHA-256 del archivo)
+    proceso = Column(String(120), nullable=True)  # "host:pid" del proceso que lo ejecuta
+    creado_en = Column(DateTime, server_default=func.now())
+    iniciado_en = Column(DateTime, nullable=True)
+    terminado_en = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_jobs_usuario_estado", "usuario_id", "estado"),
+    )
+
+
+# ============================================
+# VERSIÓN DEL ESQUEMA (migraciones aplicadas)
+# ============================================
+class EsquemaVersion(Base):
+    """Una fila por migración aplicada (ver database/migraciones.py)."""
+
+    __tablename__ = "esquema_version"
+
+    version = Column(Integer, primary_key=True)
+    descripcion = Column(String(255), nullable=False)
+    aplicada_en = Column(DateTime, server_default=func.now())
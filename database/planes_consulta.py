@@ -0,0 +1,159 @@
+"""
+Chequeo de planes de consulta sobre transacciones.
+Ejecuta las funciones CRUD que leen transacciones, captura el SQL que emiten y corre
+EXPLAIN sobre cada sentencia (SQLite: EXPLAIN QUERY PLAN; PostgreSQL: EXPLAIN con
+enable_seqscan apagado, para que una tabla chica no esconda la falta de índice).
+Si alguna recorre la tabla completa, lo informa y termina con código 1. Un recorrido en
+orden de un índice que no filtra por usuario_id también cuenta como completo.
+
+Ejecutar desde el directorio raíz del proyecto (después de init_db / migraciones):
+    python database/planes_consulta.py
+"""
+import re
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from sqlalchemy import event
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from database.connection import engine
+
+TABLA = "transacciones"
+
+# SQLite: todo "SCAN transacciones ..." recorre la tabla entera, aunque sea "USING INDEX" (en orden
+# del índice); solo pasa "SEARCH transacciones ... (usuario_id=?". "SCAN TABLE" en versiones viejas.
+_SCAN_SQLITE = re.compile(rf"^SCAN (TABLE )?{TABLA}\b")
+_SEARCH_SQLITE = re.compile(rf"^SEARCH (TABLE )?{TABLA}\b")
+_SEARCH_USUARIO_SQLITE = re.compile(r"\(usuario_id=\?")
+# PostgreSQL: Seq Scan siempre; Index Scan / Index Only Scan si su Index Cond no usa usuario_id
+_SEQ_SCAN_POSTGRES = re.compile(rf"Seq Scan on {TABLA}\b")
+_INDEX_SCAN_POSTGRES = re.compile(rf"Index (Only )?Scan (Backward )?using \S+ on {TABLA}\b")
+
+
+def _consultas_crud(usuario_id: int) -> Dict[str, Callable[[], object]]:
+    """Funciones CRUD con accesos a transacciones por usuario, con argumentos representativos."""
+    from database import crud
+    from database.crud_proyeccion import listar_categorias_tab1_usuario
+
+    desde, hasta = datetime(2025, 1, 1), datetime(2025, 12, 31)
+    return {
+        "obtener_transacciones(archivo_id)": lambda: crud.obtener_transacciones(usuario_id, archivo_id=1),
+        "obtener_transacciones(fechas)": lambda: crud.obtener_transacciones(
+            usuario_id, fecha_desde=desde, fecha_hasta=hasta
+        ),
+        "obtener_transacciones(clasificacion)": lambda: crud.obtener_transacciones(
+            usuario_id, clasificacion="NO CLASIFICADO"
+        ),
+        "obtener_transacciones_dataframe(archivo_id)": lambda: crud.obtener_transacciones_dataframe(
+            usuario_id, archivo_id=1
+        ),
+        "obtener_transacciones_dataframe": lambda: crud.obtener_transacciones_dataframe(usuario_id),
+        "obtener_movimientos_saldo_dataframe": lambda: crud.obtener_movimientos_saldo_dataframe(
+            usuario_id, archivo_id=1
+        ),
+        "obtener_rango_fechas_transacciones": lambda: crud.obtener_rango_fechas_transacciones(usuario_id),
+        "obtener_transacciones_sin_clasificar": lambda: crud.obtener_transacciones_sin_clasificar(usuario_id),
+        "listar_categorias_tab1_usuario": lambda: listar_categorias_tab1_usuario(usuario_id),
+    }
+
+
+@contextmanager
+def _capturar_selects() -> Iterator[List[Tuple[str, object]]]:
+    """SELECTs sobre transacciones emitidos por el engine mientras dura el bloque."""
+    capturadas: List[Tuple[str, object]] = []
+
+    def _oyente(conn, cursor, statement, parameters, context, executemany):
+        sql = statement.lstrip()
+        if sql[:6].upper() == "SELECT" and re.search(rf"\b{TABLA}\b", sql):
+            capturadas.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", _oyente)
+    try:
+        yield capturadas
+    finally:
+        event.remove(engine, "before_cursor_execute", _oyente)
+
+
+def explicar(statement: str, parameters: object = ()) -> List[str]:
+    """Líneas del plan de una sentencia ya compilada para el dialecto del engine."""
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+            filas = conn.exec_driver_sql("EXPLAIN " + statement, parameters).all()
+            return [str(f[0]) for f in filas]
+        filas = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+        return [str(f[-1]) for f in filas]
+
+
+def _scan_completo_sqlite(lineas_plan: List[str]) -> bool:
+    for linea in lineas_plan:
+        linea = linea.strip()
+        if _SCAN_SQLITE.search(linea):
+            return True
+        if _SEARCH_SQLITE.search(linea) and not _SEARCH_USUARIO_SQLITE.search(linea):
+            return True
+    return False
+
+
+def _scan_completo_postgres(lineas_plan: List[str]) -> bool:
+    for i, linea in enumerate(lineas_plan):
+        if _SEQ_SCAN_POSTGRES.search(linea):
+            return True
+        if not _INDEX_SCAN_POSTGRES.search(linea):
+            continue
+        # Detalles del nodo (Index Cond, Filter, ...) hasta el próximo nodo "->"
+        condiciones = []
+        for detalle in lineas_plan[i + 1:]:
+            if detalle.lstrip().startswith("->") or not detalle[:1].isspace():
+                break
+            condiciones.append(detalle.strip())
+        if not any(c.startswith("Index Cond:") and "usuario_id" in c for c in condiciones):
+            return True
+    return False
+
+
+def es_scan_completo(lineas_plan: List[str]) -> bool:
+    if engine.dialect.name == "postgresql":
+        return _scan_completo_postgres(lineas_plan)
+    return _scan_completo_sqlite(lineas_plan)
+
+
+def revisar_planes(usuario_id: int = 1) -> Dict[str, List[List[str]]]:
+    """
+    Plan de cada SELECT sobre transacciones, por función CRUD.
+    Retorna solo las funciones con algún recorrido completo de la tabla ({} = todo usa índices).
+
+    Ejemplo:
+        problemas = revisar_planes()
+        assert not problemas, problemas
+    """
+    problemas: Dict[str, List[List[str]]] = {}
+    for nombre, llamada in _consultas_crud(usuario_id).items():
+        with _capturar_selects() as capturadas:
+            llamada()
+        for statement, parameters in capturadas:
+            plan = explicar(statement, parameters)
+            if es_scan_completo(plan):
+                problemas.setdefault(nombre, []).append(plan)
+    return problemas
+
+
+if __name__ == "__main__":
+    from database.migraciones import migrar_esquema
+
+    migrar_esquema()
+    problemas = revisar_planes()
+    if not problemas:
+        print(f"OK: ninguna consulta CRUD recorre {TABLA} completa ({engine.dialect.name}).")
+        sys.exit(0)
+    for nombre, planes in problemas.items():
+        print(f"SCAN COMPLETO en {nombre}:")
+        for plan in planes:
+            for linea in plan:
+                print(f"    {linea}")
+    sys.exit(1)
@@ -1,12 +1,10 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-import unicodedata
 import io
 import json
 import os
 import re
-import hashlib
 import tempfile
 from pathlib import Path
 from datetime import datetime
@@ -14,11 +12,28 @@ from datetime import datetime
 # Importar sistema de autenticación y base de datos
 from auth.login import require_login, show_user_info, get_current_user
 from database.crud import (
-    obtener_clasificadores, obtener_transacciones, guardar_transacciones,
-    registrar_archivo, crear_alerta, obtener_alertas, obtener_mapeo_columnas,
-    obtener_archivos
+    obtener_clasificadores, obtener_transacciones, guardar_transacciones, guardar_transacciones_dataframe,
+    obtener_transacciones_dataframe,
+    crear_alerta, obtener_alertas, obtener_mapeo_columnas,
+    obtener_archivos, obtener_archivo_por_hash
 )
+from database.migraciones import migrar_esquema
 from database.models import TipoTransaccion
+from modulo_cartola import (
+    ATTR_COMENTARIO_NORMALIZADO, encontrar_fila_encabezados_grilla,
+    guardar_cartola_cacheada, hash_contenido, leer_cartola, obtener_cartola_cacheada
+)
+from modulo_clasificador import (
+    ATTR_CLASIFICADO_CON, clasificar_dataframe, compilar_clasificadores, normalizar_columna,
+    normalizar_texto, obtener_reglas_usuario
+)
+from modulo_importacion_lote import tarea_importar_cartolas
+from modulo_jobs import enviar_job, render_estado_job
+from modulo_lectura_excel import leer_cabeza_excel
+from modulo_saldos import saldo_cartola_desde_df
+
+# Esquema de BD al día antes de atender pedidos (una vez por proceso; los reruns no repiten DDL)
+migrar_esquema()
 
 # ---------- CONFIGURACIÓN DE PÁGINA ----------
 st.set_page_config(
@@ -283,11 +298,7 @@ if 'archivo_id_cargado_bd' not in st.session_state:
 
 def normalizar(texto):
     """Normaliza el texto eliminando acentos y convirtiendo a mayúsculas."""
-    if pd.isnull(texto):
-        return ""
-    texto = str(texto).upper().strip()
-    texto = unicodedata.normalize("NFD", texto).encode("ascii", "ignore").decode("utf-8")
-    return texto
+    return normalizar_texto(texto)
 
 def listar_configuraciones():
     """Lista todos los archivos de configuración disponibles (JSON y Excel)."""
@@ -676,6 +687,7 @@ def clasificar_mejorado(texto, abono, config_clasificadores):
     if config_clasificadores is None:
             return "NO CLASIFICADO"
 
+    # normalizar es idempotente y memoizado: si ya viene normalizado es un acierto de caché
     texto = normalizar(texto)
     clasificadores = config_clasificadores.get("clasificadores", {})
     clasificacion_default = config_clasificadores.get("clasificacion_default", "NO CLASIFICADO")
@@ -704,76 +716,75 @@ def cargar_datos_desde_bd(archivo_id, usuario_id):
         pd.DataFrame: DataFrame con los datos cargados o None si hay error
     """
     try:
-        # Obtener transacciones del archivo específico
-        transacciones_bd = obtener_transacciones(
-            usuario_id=usuario_id,
-            fecha_desde=None,
-            fecha_hasta=None,
-            archivo_id=archivo_id
-        )
-        
-        if transacciones_bd is None or len(transacciones_bd) == 0:
-            return None
-        
-        # Convertir a DataFrame
-        datos = []
-        for trans in transacciones_bd:
-            saldo_cell = None
-            if trans.saldo is not None:
-                try:
-                    saldo_cell = float(trans.saldo)
-                except (TypeError, ValueError):
-                    saldo_cell = None
-            datos.append({
-                "FECHA": trans.fecha,
-                "DESCRIPCION": trans.descripcion or "",
-                "ABONOS (CLP)": float(trans.abono) if trans.abono else 0,
-                "CARGOS (CLP)": float(trans.cargo) if trans.cargo else 0,
-                "SALDO (CLP)": saldo_cell,
-                "CLASIFICACION": trans.clasificacion or "NO CLASIFICADO",
-                "COMENTARIO": trans.comentario or ""
-            })
-        
-        if len(datos) == 0:
-            return None
-        
-        df = pd.DataFrame(datos)
+        # Lectura columnar (Core + yield_per): ya trae tipos datetime64/float64/category
+        df = obtener_transacciones_dataframe(usuario_id=usuario_id, archivo_id=archivo_id)
         
         if df is None or df.empty:
             return None
         
-        # Asegurar que las columnas necesarias estén presentes
-        if "FECHA" in df.columns:
-            # Guardar el número de filas antes de convertir fechas
-            filas_antes = len(df)
-            df["FECHA"] = pd.to_datetime(df["FECHA"], errors='coerce')
-            # Verificar si se perdieron filas después de convertir fechas
-            filas_despues = len(df)
-            if filas_despues != filas_antes:
-                st.sidebar.warning(f"⚠️ Se perdieron {filas_antes - filas_despues} filas al convertir fechas")
-        else:
-            st.sidebar.warning(f"⚠️ No se encontró la columna FECHA en el DataFrame")
-        
-        if "DESCRIPCION" not in df.columns:
-            df["DESCRIPCION"] = ""
-        if "ABONOS (CLP)" not in df.columns:
-            df["ABONOS (CLP)"] = 0
-        if "CARGOS (CLP)" not in df.columns:
-            df["CARGOS (CLP)"] = 0
-        if "CLASIFICACION" not in df.columns:
-            df["CLASIFICACION"] = "NO CLASIFICADO"
-        if "COMENTARIO" not in df.columns:
-            df["COMENTARIO"] = df["DESCRIPCION"].apply(normalizar) if "DESCRIPCION" in df.columns else ""
-        
-        # Verificación final
-        if df.empty or len(df) == 0:
-            return None
-        
         return df
     except Exception as e:
         st.error(f"❌ Error al cargar datos desde BD: {e}")
         return None
 
+def _tarea_guardar_cartola(df, usuario_id, nombre_archivo, hash_archivo):
+    """Guarda la cartola como trabajo en segundo plano (ver modulo_jobs)."""
+    total_guardadas, archivo_id_guardado = guardar_transacciones_dataframe(
+        df,
+        usuario_id=usuario_id,
+        nombre_archivo=nombre_archivo,
+        hash_contenido=hash_archivo
+    )
+    return {
+        "total": total_guardadas,
+        "archivo_id": archivo_id_guardado,
+        "nombre_archivo": nombre_archivo,
+        "hash": hash_archivo,
+    }
+
+def _al_guardar_cartola(resultado):
+    """Al terminar el guardado: apuntar la sesión al archivo recién guardado."""
+    # La próxima consulta por hash debe ver este archivo recién guardado
+    st.session_state.pop("hash_cartola_consultado", None)
+    
+    # Si mientras se guardaba el usuario subió otra cartola, esa sigue sin guardar:
+    # no tocar su estado, solo avisar
+    if st.session_state.get("archivo_subido_hash") != resultado.get("hash"):
+        st.sidebar.success(f"✅ {resultado['total']} transacciones guardadas ({resultado['nombre_archivo']})")
+        return
+    
+    # Actualizar session_state con el archivo guardado
+    st.session_state.archivo_id_cargado_bd = resultado["archivo_id"]
+    st.session_state.archivo_cargado_bd = resultado["nombre_archivo"]
+    # Limpiar la bandera de archivo nuevo
+    if 'archivo_nuevo_procesado' in st.session_state:
+        del st.session_state.archivo_nuevo_procesado
+    if 'nombre_archivo_nuevo' in st.session_state:
+        del st.session_state.nombre_archivo_nuevo
+    
+    st.sidebar.success(f"✅ {resultado['total']} transacciones guardadas")
+    st.rerun()
+
+def _al_importar_lote(resultado):
+    """Resumen por archivo de la importación múltiple."""
+    archivos = resultado.get("archivos", [])
+    guardados = [a for a in archivos if a["estado"] == "guardado"]
+    st.success(f"✅ {len(guardados)} de {len(archivos)} cartolas guardadas ({sum(a['transacciones'] for a in guardados)} transacciones)")
+    if archivos:
+        st.dataframe(
+            pd.DataFrame(archivos)[["nombre_archivo", "estado", "transacciones", "sin_clasificar", "detalle"]].rename(
+                columns={
+                    "nombre_archivo": "Archivo",
+                    "estado": "Estado",
+                    "transacciones": "Transacciones",
+                    "sin_clasificar": "Sin clasificar",
+                    "detalle": "Detalle",
+                }
+            ),
+            hide_index=True,
+            use_container_width=True,
+        )
+
 def encontrar_fila_encabezados(path):
     """
     Encuentra la fila que contiene los encabezados de las columnas.
@@ -782,102 +793,27 @@ def encontrar_fila_encabezados(path):
     Returns:
         int: Número de fila (0-indexed) donde están los encabezados, o 0 si no se encuentra
     """
-    palabras_clave = [
-        'FECHA', 'DESCRIPCION',
-        'ABONOS', 'INGRESOS', 'ENTRADAS', 'CREDITO', 'ABONO',
-        'DEPOSITOS', 'DEPOSITO', 'DEPOSIT',
-        'CARGOS', 'EGRESOS', 'SALIDAS', 'DEBITO',
-        'SALDO',
-        'CANAL', 'SUCURSAL', 'DOCTO', 'DOCUMENTO', 'GLOSA', 'DETALLE', 'FECHA OPERACION'
-    ]
-    
     try:
-        # Leer las primeras 20 filas para buscar encabezados
-        df_temp = pd.read_excel(path, header=None, nrows=20)
-        
-        for idx in range(len(df_temp)):
-            row = df_temp.iloc[idx]
-            # Convertir toda la fila a string y buscar palabras clave
-            fila_str = ' '.join([str(val).upper() for val in row.values if pd.notna(val) and str(val).strip() != ''])
-            
-            # Contar cuántas palabras clave aparecen en esta fila
-            coincidencias = sum(1 for palabra in palabras_clave if palabra in fila_str)
-            
-            # Si encontramos al menos 2 palabras clave, probablemente es la fila de encabezados
-            if coincidencias >= 2:
-                return idx
-        
-        return 0
+        return encontrar_fila_encabezados_grilla(leer_cabeza_excel(path, filas=20))
     except:
         return 0
 
-def cargar_datos(path, config_clasificadores):
+def _leer_cartola(path):
     """
-    Carga y procesa los datos del archivo Excel.
-    Detecta automáticamente dónde empiezan los datos reales, saltando encabezados.
-    
-    Args:
-        path: Ruta del archivo Excel
-        config_clasificadores: Configuración de clasificadores
+    Lee el archivo Excel y deja la cartola con columnas estándar y COMENTARIO normalizado
+    (todavía sin clasificar). Detecta automáticamente dónde empiezan los datos reales.
+    La lectura vive en modulo_cartola.leer_cartola; aquí solo se muestran sus mensajes.
     
     Returns:
-        pd.DataFrame: DataFrame procesado con clasificaciones
+        pd.DataFrame o None si el archivo no tiene el formato esperado
     """
     try:
-        # Acumular mensajes de debug para mostrarlos en un expander
-        mensajes_debug = []
-        
-        # Buscar la fila de encabezados primero
-        fila_encabezados = encontrar_fila_encabezados(path)
-        
-        # Leer el archivo usando la fila encontrada como encabezados
-        if fila_encabezados > 0:
-            df = pd.read_excel(path, header=fila_encabezados)
-            mensajes_debug.append(("info", f"💡 Se detectaron encabezados en la fila {fila_encabezados + 1}"))
-        else:
-            # Intentar leer sin especificar header
-            df = pd.read_excel(path, header=0)
-        
-        # Limpiar nombres de columnas
-        df.columns = df.columns.str.strip().str.upper()
-        
-        # Si las columnas son UNNAMED, intentar leer de nuevo buscando mejor
-        if any('UNNAMED' in str(col) for col in df.columns):
-            mensajes_debug.append(("warning", "⚠️ Detectadas columnas sin nombre. Buscando encabezados de forma más agresiva..."))
-            # Intentar leer sin header y buscar manualmente
-            df_temp = pd.read_excel(path, header=None, nrows=30)
-            
-            # Buscar fila con encabezados
-            encontrado = False
-            for idx in range(len(df_temp)):
-                row = df_temp.iloc[idx]
-                valores = [str(val).upper().strip() for val in row.values if pd.notna(val) and str(val).strip() != '']
-                fila_str = ' '.join(valores)
-                
-                # Verificar si esta fila tiene las palabras clave
-                tiene_fecha = any('FECHA' in v for v in valores)
-                tiene_descripcion = any('DESCRIPCION' in v or 'GLOSA' in v or 'DETALLE' in v for v in valores)
-                tiene_abonos = any('ABONO' in v or 'CREDITO' in v for v in valores)
-                tiene_cargos = any('CARGO' in v or 'DEBITO' in v for v in valores)
-                
-                if (tiene_fecha or tiene_descripcion) and (tiene_abonos or tiene_cargos):
-                    # Esta es la fila de encabezados
-                    df = pd.read_excel(path, header=idx)
-                    df.columns = df.columns.str.strip().str.upper()
-                    mensajes_debug.append(("success", f"✅ Encabezados encontrados en la fila {idx + 1}"))
-                    encontrado = True
-                    break
-            
-            if not encontrado:
-                mensajes_debug.append(("warning", "⚠️ No se pudieron detectar los encabezados automáticamente"))
-                # Guardar df_temp para mostrarlo en el expander si es necesario
-                if 'df_temp' in locals():
-                    mensajes_debug.append(("dataframe", df_temp.head(10)))
+        lectura = leer_cartola(path)
         
         # Mostrar mensajes de debug en un expander (colapsado por defecto)
-        if mensajes_debug:
+        if lectura.mensajes:
             with st.expander("🔧 Información de carga de datos", expanded=False):
-                for tipo, mensaje in mensajes_debug:
+                for tipo, mensaje in lectura.mensajes:
                     if tipo == "info":
                         st.info(mensaje)
                     elif tipo == "warning":
@@ -888,98 +824,15 @@ def cargar_datos(path, config_clasificadores):
                         st.write("Primeras 10 filas del archivo:")
                         st.dataframe(mensaje)
         
-        # Limpiar filas vacías al inicio y final
-        df = df.dropna(how='all').reset_index(drop=True)
-        
-
-        # Normalizar nombres de columnas
-        if "DESCRIPCIÓN" in df.columns:
-            df.rename(columns={"DESCRIPCIÓN": "DESCRIPCION"}, inplace=True)
-        
-        # Buscar columnas similares (flexibilidad en nombres)
-        mapeo_columnas = {}
-        columnas_upper = [col.upper() for col in df.columns]
-        
-        # Buscar FECHA
-        if "FECHA" not in df.columns:
-            for col in df.columns:
-                if "FECHA" in col.upper() or "DATE" in col.upper():
-                    mapeo_columnas[col] = "FECHA"
-                    break
-        
-        # Buscar DESCRIPCION
-        if "DESCRIPCION" not in df.columns:
-            for col in df.columns:
-                if "DESCRIPCION" in col.upper() or "DESCRIP" in col.upper() or "DETALLE" in col.upper() or "GLOSA" in col.upper():
-                    mapeo_columnas[col] = "DESCRIPCION"
-                    break
-        
-        # Buscar ABONOS
-        if "ABONOS (CLP)" not in df.columns:
-            for col in df.columns:
-                col_upper = str(col).upper()
-                if "ABONO" in col.upper() and "CLP" in col.upper():
-                    mapeo_columnas[col] = "ABONOS (CLP)"
-                    break
-                elif (
-                    ("ABONO" in col_upper)
-                    or ("DEPOSITO" in col_upper)
-                    or ("DEPOSITOS" in col_upper)
-                    or ("INGRESO" in col_upper)
-                    or ("ENTRADA" in col_upper)
-                    or ("CREDITO" in col_upper)
-                ):
-                    # Evitar columnas que claramente representan egresos/cargos.
-                    if any(k in col_upper for k in ["DEBITO", "EGRESO", "EGRESOS", "CARGO", "CARGOS", "SALIDA", "SALIDAS"]):
-                        continue
-                    mapeo_columnas[col] = "ABONOS (CLP)"
-                    break
-        
-        # Buscar CARGOS (muchos bancos cambian encabezados: CARGOS/DEBITO/EGRESOS)
-        if "CARGOS (CLP)" not in df.columns:
-            for col in df.columns:
-                col_upper = col.upper()
-                # Incluye variantes con y sin "(CLP)"
-                if ("CARGO" in col_upper or "DEBITO" in col_upper or "DÉBITO" in col_upper) and "CLP" in col_upper:
-                    mapeo_columnas[col] = "CARGOS (CLP)"
-                    break
-                if ("CARGOS" in col_upper or "EGRESO" in col_upper or "EGRESOS" in col_upper) and ("CLP" in col_upper or True):
-                    mapeo_columnas[col] = "CARGOS (CLP)"
-                    break
-                if ("DEBITO" in col_upper or "DÉBITO" in col_upper) and ("CLP" in col_upper):
-                    mapeo_columnas[col] = "CARGOS (CLP)"
-                    break
-
-        # SALDO cartola (encabezado típico "SALDO" sin "(CLP)")
-        if "SALDO (CLP)" not in df.columns:
-            for col in df.columns:
-                col_upper = str(col).upper().strip()
-                if col_upper == "SALDO" or (
-                    "SALDO" in col_upper
-                    and "ABONO" not in col_upper
-                    and "CARGO" not in col_upper
-                    and "INICIO" not in col_upper
-                    and "FINAL" not in col_upper
-                ):
-                    mapeo_columnas[col] = "SALDO (CLP)"
-                    break
-
-        # Aplicar mapeo
-        if mapeo_columnas:
-            df.rename(columns=mapeo_columnas, inplace=True)
-
-        # Validar columnas requeridas
-        columnas_requeridas = ["DESCRIPCION", "FECHA", "ABONOS (CLP)"]
-        columnas_faltantes = [col for col in columnas_requeridas if col not in df.columns]
-        
-        if columnas_faltantes:
+        if not lectura.ok:
+            df = lectura.df
             # Aviso amigable para el cliente: formato no corresponde a "Cartola Histórica"
             st.warning(
                 "⚠️ Este archivo no parece tener el formato esperado (Cartola Histórica). "
                 "Vuelve a descargar/subir la 'Cartola Histórica' del banco (no 'Movimientos del mes')."
             )
             st.info(f"💡 Columnas encontradas en el archivo: {', '.join(df.columns.tolist()[:15])}")
-            st.caption(f"Detalles técnicos (faltan columnas mínimas): {', '.join(columnas_faltantes)}")
+            st.caption(f"Detalles técnicos (faltan columnas mínimas): {', '.join(lectura.faltantes)}")
             
             # Mostrar primeras filas para ayudar a entender la estructura
             with st.expander("🔍 Ver primeras filas del archivo (para depuración)"):
@@ -988,24 +841,38 @@ def cargar_datos(path, config_clasificadores):
             st.info("💡 Si tu archivo tiene un formato diferente, puedes configurar el mapeo de columnas en la sección de configuración.")
             
             return None
+        return lectura.df
+    except Exception as e:
+        st.error(f"❌ Error al procesar el archivo: {e}")
+        return None
 
-        # Procesar datos
-        df["DESCRIPCION"] = df["DESCRIPCION"].astype(str)
-        df["COMENTARIO"] = df["DESCRIPCION"].apply(normalizar)
-        df["FECHA"] = pd.to_datetime(df["FECHA"], dayfirst=True, errors='coerce')
-
-        # Si no se pudo identificar CARGOS, crearla para que métricas/gráficos no fallen
-        if "CARGOS (CLP)" not in df.columns:
-            df["CARGOS (CLP)"] = 0
+def cargar_datos(path, config_clasificadores, hash_archivo=None):
+    """
+    Carga y procesa los datos del archivo Excel.
+    Detecta automáticamente dónde empiezan los datos reales, saltando encabezados.
+    Si se entrega hash_archivo (SHA-256 del contenido), reutiliza la cartola ya parseada.
+    
+    Args:
+        path: Ruta del archivo Excel
+        config_clasificadores: Configuración de clasificadores
+        hash_archivo: Hash del contenido subido (opcional)
+    
+    Returns:
+        pd.DataFrame: DataFrame procesado con clasificaciones
+    """
+    df = obtener_cartola_cacheada(hash_archivo) if hash_archivo else None
+    if df is None:
+        df = _leer_cartola(path)
+        if df is None:
+            return None
+        if hash_archivo:
+            guardar_cartola_cacheada(hash_archivo, df)
+    df.attrs[ATTR_COMENTARIO_NORMALIZADO] = True
 
-        # Clasificar transacciones
-        df["CLASIFICACION"] = df.apply(
-            lambda row: clasificar_mejorado(row["COMENTARIO"], row["ABONOS (CLP)"], config_clasificadores), 
-            axis=1
-        )
-        
-        # Eliminar columnas sin nombre
-        df = df.loc[:, ~df.columns.str.contains("^UNNAMED")]
+    try:
+        # Clasificar transacciones (clasificador compilado, una pasada por columna)
+        clasificador = compilar_clasificadores(config_clasificadores)
+        clasificar_dataframe(df, clasificador, normalizado=True)
         return df
     except Exception as e:
         st.error(f"❌ Error al procesar el archivo: {e}")
@@ -1037,7 +904,8 @@ st.sidebar.markdown("### 📁 Carga de Datos")
 usuario_actual = get_current_user()
 config_clasificadores = None
 
-if usuario_actual:
+def _construir_config_usuario():
+    """Lee config base + clasificadores de BD y los fusiona (solo en fallo de caché)."""
     # Cargar base por defecto (si existe)
     config_base_default = None
     configs_disponibles = listar_configuraciones()
@@ -1049,17 +917,27 @@ if usuario_actual:
     if clasificadores_bd:
         config_bd_usuario = convertir_clasificadores_bd_a_dict(clasificadores_bd)
         # IMPORTANTE: fusionar BD + base para no perder reglas históricas.
-        config_clasificadores = fusionar_configs_clasificadores(config_base_default, config_bd_usuario)
+        return fusionar_configs_clasificadores(config_base_default, config_bd_usuario), len(clasificadores_bd)
+    # Si no tiene clasificadores en BD, intentar cargar desde archivos (compatibilidad)
+    return config_base_default, 0
+
+if usuario_actual:
+    # Reglas compiladas en caché de proceso: solo se releen BD/disco si cambia la huella
+    reglas_usuario = obtener_reglas_usuario(
+        usuario_actual.id,
+        Path(__file__).parent / CONFIG_CLASIFICADORES,
+        _construir_config_usuario,
+    )
+    config_clasificadores = reglas_usuario.config
+    if reglas_usuario.cantidad_bd:
         st.sidebar.markdown(
             f'<div style="background-color: #d4edda; color: #155724; padding: 0.75rem; border-radius: 6px; margin: 0.5rem 0;">'
-            f'✅ <strong>{len(clasificadores_bd)} clasificadores</strong> cargados desde BD'
+            f'✅ <strong>{reglas_usuario.cantidad_bd} clasificadores</strong> cargados desde BD'
             f'</div>',
             unsafe_allow_html=True
         )
     else:
-        # Si no tiene clasificadores en BD, intentar cargar desde archivos (compatibilidad)
         st.sidebar.info("💡 No tienes clasificadores configurados. Usando configuración por defecto.")
-        config_clasificadores = config_base_default
 else:
     st.sidebar.warning("⚠️ No se pudo obtener información del usuario")
 
@@ -1138,8 +1016,37 @@ archivo_subido = st.sidebar.file_uploader(
 )
 
 archivo = None
+hash_archivo_subido = None
 df = None
 
+if archivo_subido:
+    # Identificar la cartola por contenido (SHA-256): misma cartola => mismo hash aunque cambie el nombre
+    hash_archivo_subido = hash_contenido(archivo_subido.getvalue())
+    if st.session_state.get("hash_cartola_desde_bd") == hash_archivo_subido:
+        # El usuario eligió usar la copia ya guardada en BD de este mismo archivo
+        archivo_subido = None
+    elif usuario_actual:
+        if st.session_state.get("hash_cartola_consultado") != hash_archivo_subido:
+            existente = obtener_archivo_por_hash(usuario_actual.id, hash_archivo_subido)
+            st.session_state.hash_cartola_consultado = hash_archivo_subido
+            st.session_state.cartola_existente_bd = (
+                (existente.id, existente.nombre_archivo) if existente else None
+            )
+        cartola_existente = st.session_state.get("cartola_existente_bd")
+        if cartola_existente:
+            st.sidebar.info(f"ℹ️ Esta cartola ya está guardada en BD como '{cartola_existente[1]}'.")
+            if st.sidebar.button("📂 Usar la cartola guardada en BD", use_container_width=True):
+                st.session_state.hash_cartola_desde_bd = hash_archivo_subido
+                st.session_state.archivo_id_cargado_bd = cartola_existente[0]
+                st.session_state.archivo_cargado_bd = cartola_existente[1]
+                if 'archivo_nuevo_procesado' in st.session_state:
+                    del st.session_state.archivo_nuevo_procesado
+                if 'nombre_archivo_nuevo' in st.session_state:
+                    del st.session_state.nombre_archivo_nuevo
+                st.rerun()
+else:
+    st.session_state.pop("hash_cartola_desde_bd", None)
+
 # PRIORIDAD 1: Si se sube un archivo nuevo, tiene máxima prioridad
 # Limpiar cualquier referencia a BD antes de procesar el archivo nuevo
 if archivo_subido:
@@ -1151,10 +1058,21 @@ if archivo_subido:
         if 'df_cargado_bd' in st.session_state:
             del st.session_state.df_cargado_bd
         
-        # Guardar archivo temporalmente
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_file:
-            tmp_file.write(archivo_subido.getvalue())
-            archivo = tmp_file.name
+        # Guardar archivo temporalmente (una vez por contenido; los reruns reutilizan el mismo archivo)
+        ruta_previa = st.session_state.get("archivo_subido_ruta")
+        if (
+            st.session_state.get("archivo_subido_hash") == hash_archivo_subido
+            and ruta_previa and os.path.exists(ruta_previa)
+        ):
+            archivo = ruta_previa
+        else:
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_file:
+                tmp_file.write(archivo_subido.getvalue())
+                archivo = tmp_file.name
+            if ruta_previa and os.path.exists(ruta_previa):
+                os.unlink(ruta_previa)
+            st.session_state.archivo_subido_hash = hash_archivo_subido
+            st.session_state.archivo_subido_ruta = archivo
         
         # Marcar que se procesó un archivo nuevo (para mostrar el botón de guardar)
         st.session_state.archivo_nuevo_procesado = True
@@ -1186,6 +1104,33 @@ if df is None and 'archivo_id_cargado_bd' in st.session_state and st.session_sta
 if df is None:
     st.sidebar.info("💡 Sube un archivo Excel o carga una cartola guardada desde la base de datos")
 
+# ---------- IMPORTACIÓN MÚLTIPLE DE CARTOLAS ----------
+# Varias cuentas de una vez (o un ZIP): se leen y clasifican en procesos paralelos y se
+# guardan directo en BD, en segundo plano; el resumen por archivo aparece al terminar.
+if usuario_actual and config_clasificadores is not None:
+    with st.sidebar.expander("📦 Importar varias cartolas", expanded=False):
+        archivos_lote = st.file_uploader(
+            "Cartolas (Excel) o un ZIP",
+            type=["xlsx", "xls", "zip"],
+            accept_multiple_files=True,
+            key="archivos_lote",
+        )
+        if archivos_lote and st.button("💾 Importar y guardar todas", use_container_width=True):
+            try:
+                st.session_state.job_importacion_lote = enviar_job(
+                    usuario_actual.id,
+                    "importacion_lote",
+                    tarea_importar_cartolas,
+                    usuario_actual.id,
+                    [(a.name, a.getvalue()) for a in archivos_lote],
+                    compilar_clasificadores(config_clasificadores),
+                    descripcion=f"{len(archivos_lote)} archivos",
+                    huella=hash_contenido("".join(sorted(hash_contenido(a.getvalue()) for a in archivos_lote)).encode()),
+                )
+            except Exception as e:
+                st.error(f"❌ Error al importar: {e}")
+        render_estado_job("job_importacion_lote", usuario_actual.id, "📦 Importando cartolas", _al_importar_lote)
+
 # ---------- IMPORTAR CLASIFICADORES DESDE ARCHIVO ----------
 st.sidebar.markdown("---")
 st.sidebar.subheader("⚙️ Configuración de Clasificadores")
@@ -1276,7 +1221,7 @@ if config_clasificadores is not None and usuario_actual:
     if archivo_subido and archivo:
         # Procesar el archivo subido (tiene prioridad)
         try:
-            df = cargar_datos(archivo, config_clasificadores)
+            df = cargar_datos(archivo, config_clasificadores, hash_archivo=hash_archivo_subido)
         except Exception as e:
             st.error(f"❌ Error al procesar el archivo: {e}")
             st.exception(e)
@@ -1309,17 +1254,22 @@ if config_clasificadores is not None and usuario_actual:
             )
             if force_reclasificar or "CLASIFICACION" not in df.columns:
                 # Procesar datos si no están clasificados
-                if "DESCRIPCION" in df.columns:
+                # Si COMENTARIO ya viene normalizado desde cargar_datos no se recalcula
+                if "DESCRIPCION" in df.columns and not df.attrs.get(ATTR_COMENTARIO_NORMALIZADO):
                     df["DESCRIPCION"] = df["DESCRIPCION"].astype(str)
-                    df["COMENTARIO"] = df["DESCRIPCION"].apply(normalizar)
+                    df["COMENTARIO"] = normalizar_columna(df["DESCRIPCION"])
+                    df.attrs[ATTR_COMENTARIO_NORMALIZADO] = True
+                    df.attrs.pop(ATTR_CLASIFICADO_CON, None)
                 if "FECHA" in df.columns:
                     df["FECHA"] = pd.to_datetime(df["FECHA"], dayfirst=True, errors='coerce')
                 
                 # Clasificar transacciones
                 if "COMENTARIO" in df.columns and "ABONOS (CLP)" in df.columns:
-                    df["CLASIFICACION"] = df.apply(
-                        lambda row: clasificar_mejorado(row["COMENTARIO"], row["ABONOS (CLP)"], config_clasificadores), 
-                        axis=1
+                    # Si ya se clasificó con estas reglas (cargar_datos) no se repite la pasada
+                    clasificador = compilar_clasificadores(config_clasificadores)
+                    clasificar_dataframe(
+                        df, clasificador,
+                        normalizado=bool(df.attrs.get(ATTR_COMENTARIO_NORMALIZADO)),
                     )
                 
                 # Consumir el flag: ya estamos usando el clasificador actualizado
@@ -1338,47 +1288,26 @@ if config_clasificadores is not None and usuario_actual:
             if archivo_nuevo or not viene_de_bd_guardar:
                 if st.sidebar.button("💾 Guardar en Base de Datos", use_container_width=True):
                     try:
-                        # Registrar archivo
+                        # Registrar archivo + transacciones en bloque (una sola transacción),
+                        # en segundo plano para no bloquear la UI con cartolas grandes
                         nombre_archivo = st.session_state.get('nombre_archivo_nuevo', 'cartola_importada.xlsx')
-                        archivo_registrado = registrar_archivo(
-                            usuario_id=usuario_actual.id,
-                            nombre_archivo=nombre_archivo,
-                            total_registros=len(df)
-                        )
-                        
-                        # Preparar transacciones para guardar
-                        transacciones_para_guardar = []
-                        for _, row in df.iterrows():
-                            transacciones_para_guardar.append({
-                                "fecha": row["FECHA"] if pd.notna(row["FECHA"]) else datetime.now(),
-                                "descripcion": str(row["DESCRIPCION"]) if pd.notna(row["DESCRIPCION"]) else "",
-                                "abono": float(row["ABONOS (CLP)"]) if pd.notna(row["ABONOS (CLP)"]) else 0,
-                                "cargo": float(row["CARGOS (CLP)"]) if "CARGOS (CLP)" in row and pd.notna(row["CARGOS (CLP)"]) else 0,
-                                "saldo": float(row["SALDO (CLP)"]) if "SALDO (CLP)" in row and pd.notna(row["SALDO (CLP)"]) else None,
-                                "clasificacion": str(row["CLASIFICACION"]) if pd.notna(row["CLASIFICACION"]) else "NO CLASIFICADO",
-                                "comentario": str(row["COMENTARIO"]) if "COMENTARIO" in row and pd.notna(row["COMENTARIO"]) else ""
-                            })
-                        
-                        # Guardar transacciones
-                        total_guardadas = guardar_transacciones(
-                            transacciones_para_guardar,
-                            usuario_id=usuario_actual.id,
-                            archivo_id=archivo_registrado.id
+                        st.session_state.job_guardar_cartola = enviar_job(
+                            usuario_actual.id,
+                            "guardar_cartola",
+                            _tarea_guardar_cartola,
+                            df.copy(),
+                            usuario_actual.id,
+                            nombre_archivo,
+                            hash_archivo_subido,
+                            descripcion=nombre_archivo,
+                            huella=hash_archivo_subido,
                         )
-                        
-                        # Actualizar session_state con el archivo guardado
-                        st.session_state.archivo_id_cargado_bd = archivo_registrado.id
-                        st.session_state.archivo_cargado_bd = archivo_registrado.nombre_archivo
-                        # Limpiar la bandera de archivo nuevo
-                        if 'archivo_nuevo_procesado' in st.session_state:
-                            del st.session_state.archivo_nuevo_procesado
-                        if 'nombre_archivo_nuevo' in st.session_state:
-                            del st.session_state.nombre_archivo_nuevo
-                        
-                        st.sidebar.success(f"✅ {total_guardadas} transacciones guardadas")
-                        st.rerun()
                     except Exception as e:
                         st.sidebar.error(f"❌ Error al guardar: {e}")
+            with st.sidebar:
+                render_estado_job(
+                    "job_guardar_cartola", usuario_actual.id, "💾 Guardando en Base de Datos", _al_guardar_cartola
+                )
             
             # Verificar transacciones sin clasificar EN EL DATASET ACTUAL (no en BD)
             # Esto se ejecuta siempre, independientemente de si viene de BD o no
@@ -1600,14 +1529,14 @@ if config_clasificadores is not None and usuario_actual:
                                 # Mantener reclasificación activa en esta vista para que un rerun
                                 # (ej: descargar JSON) no vuelva a mostrar CLASIFICACION antigua desde BD.
                                 st.session_state.reclasificar_en_vista = True
-                                # Reclasificar toda la cartola en pantalla
-                                df["CLASIFICACION"] = df.apply(
-                                    lambda row: clasificar_mejorado(
-                                        row.get("COMENTARIO", ""),
-                                        float(row.get("ABONOS (CLP)", 0) or 0),
-                                        st.session_state.config_clasificadores
-                                    ),
-                                    axis=1
+                                # Reclasificar la cartola en pantalla: solo las filas afectadas por las
+                                # reglas aprendidas (diferencia contra el clasificador que la produjo)
+                                if "COMENTARIO" not in df.columns:
+                                    df["COMENTARIO"] = ""
+                                clasificador = compilar_clasificadores(st.session_state.config_clasificadores)
+                                clasificar_dataframe(
+                                    df, clasificador,
+                                    normalizado=bool(df.attrs.get(ATTR_COMENTARIO_NORMALIZADO)),
                                 )
                                 # Mantener el flag para el siguiente rerun:
                                 # cuando el dataset viene desde BD, se recarga con CLASIFICACION antigua
@@ -1803,49 +1732,20 @@ if config_clasificadores is not None and usuario_actual:
             saldo_inicial = st.sidebar.number_input("Saldo inicial del periodo", value=0, key="saldo_inicial_input")
             saldo_calculado = saldo_inicial + total_abonos - total_cargos
 
-            # Saldo cartola al cierre: recorrer todos los movimientos en orden cronológico real.
-            # Misma fecha: muchas cartolas listan del más nuevo al más viejo (arriba el último movimiento
-            # del día). Ordenar por FECHA asc. y _ord_orig desc. para procesar ese día de temprano→tarde.
-            # Luego, si falta saldo en la última línea, se propaga: saldo + abonos − cargos.
+            # Saldo cartola al cierre (motor compartido con Tab 2, ver modulo_saldos): orden cronológico
+            # real (FECHA asc., orden original desc. dentro del día) y propagación saldo + abonos − cargos.
             saldo_cartola = None
             diferencia = None
             fecha_saldo_cartola = None
             
             if "SALDO (CLP)" in df.columns and "FECHA" in df.columns:
-                dfc = df.copy()
-                if not pd.api.types.is_datetime64_any_dtype(dfc["FECHA"]):
-                    dfc["FECHA"] = pd.to_datetime(dfc["FECHA"], errors="coerce")
-                dfc = dfc[dfc["FECHA"].notna()]
-                if not dfc.empty:
-                    _saldos_col = pd.to_numeric(dfc["SALDO (CLP)"], errors="coerce")
-                    # Si ninguna fila trae saldo del banco (típico en BD), el recorrido solo suma
-                    # abonos−cargos y coincide con el flujo neto sin el saldo inicial del sidebar → error en web.
-                    hay_saldo_real_en_extracto = bool(_saldos_col.notna().any())
-                    dfc["_ord_orig"] = dfc.index
-                    dfc = dfc.sort_values(
-                        by=["FECHA", "_ord_orig"],
-                        ascending=[True, False],
-                        na_position="last",
-                    )
-                    running = None
-                    last_fecha = None
-                    for _, row in dfc.iterrows():
-                        ab = pd.to_numeric(row.get("ABONOS (CLP)"), errors="coerce")
-                        cg = pd.to_numeric(row.get("CARGOS (CLP)"), errors="coerce")
-                        ab = float(ab) if pd.notna(ab) else 0.0
-                        cg = float(cg) if pd.notna(cg) else 0.0
-                        s = pd.to_numeric(row.get("SALDO (CLP)"), errors="coerce")
-                        last_fecha = row["FECHA"]
-                        if pd.notna(s):
-                            running = float(s)
-                        elif running is not None:
-                            running = running + ab - cg
-                        else:
-                            running = ab - cg
-                    if running is not None and hay_saldo_real_en_extracto:
-                        saldo_cartola = float(running)
-                        fecha_saldo_cartola = last_fecha
-                        diferencia = saldo_calculado - saldo_cartola
+                resultado_saldo = saldo_cartola_desde_df(df)
+                # Si ninguna fila trae saldo del banco (típico en BD), el recorrido solo suma
+                # abonos−cargos y coincide con el flujo neto sin el saldo inicial del sidebar → error en web.
+                if resultado_saldo.saldo_cierre is not None and resultado_saldo.hay_saldo_real:
+                    saldo_cartola = resultado_saldo.saldo_cierre
+                    fecha_saldo_cartola = resultado_saldo.fecha_cierre
+                    diferencia = saldo_calculado - saldo_cartola
 
             col4, col5 = st.columns(2)
             col4.metric("📌 Saldo Final Calculado", f"${saldo_calculado:,.0f}")
@@ -1874,7 +1774,10 @@ if config_clasificadores is not None and usuario_actual:
             st.dataframe(df_filtrado, use_container_width=True)
 
             # ---------- GRÁFICOS ----------
-            resumen_torta = df_filtrado.groupby("CLASIFICACION")[["ABONOS (CLP)", "CARGOS (CLP)"]].sum().reset_index()
+            # observed=True: CLASIFICACION es categórica; sin él aparecerían las categorías filtradas con 0
+            resumen_torta = (
+                df_filtrado.groupby("CLASIFICACION", observed=True)[["ABONOS (CLP)", "CARGOS (CLP)"]].sum().reset_index()
+            )
             if not resumen_torta.empty:
                 st.subheader("📊 Distribución de abonos por clasificación")
                 fig_torta = px.pie(resumen_torta, names="CLASIFICACION", values="ABONOS (CLP)", title="Abonos por categoría")
@@ -1915,4 +1818,7 @@ else:
 tab1, tab2 = st.tabs(["📊 Flujo Histórico", "🔮 Proyección de Caja"])
 with tab2:
     from proyeccion_caja import render_proyeccion
-    render_proyeccion(usuario_actual)
\ No newline at end of file
+    from database.connection import unidad_de_trabajo
+    # Una conexión para todo el rerun de la pestaña (las funciones CRUD la toman vía get_db)
+    with unidad_de_trabajo():
+        render_proyeccion(usuario_actual)
\ No newline at end of file
@@ -8,6 +8,7 @@ Objetivos:
 1. Verificar que DATABASE_URL está configurada.
 2. Crear todas las tablas definidas en Base (incluye 'usuarios').
 3. Ejecutar, si existe, la lógica de seed (init_db) para crear usuario admin, etc.
+   init_db aplica además las migraciones pendientes (database/migraciones.py).
 """
 
 import os
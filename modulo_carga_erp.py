@@ -4,7 +4,6 @@ Sin APIs externas: sube archivo → normaliza → persiste en proyeccion_cargas
 """
 from __future__ import annotations
 
-import io
 import re
 import unicodedata
 from dataclasses import dataclass, field
@@ -15,7 +14,23 @@ from typing import Any, BinaryIO, Dict, List, Mapping, Optional, Sequence, Union
 
 import pandas as pd
 
+try:
+    from pandas.tseries.api import guess_datetime_format
+except ImportError:  # pandas < 2.2
+    from pandas._libs.tslibs.parsing import guess_datetime_format
+
 from database import crud_proyeccion as crud_p
+from modulo_cartola import hash_contenido
+from modulo_jobs import reportar_progreso
+from modulo_lectura_excel import iterar_lotes_excel, leer_excel_por_lotes
+from modulo_uploads import (
+    ParsedUpload,
+    es_upload_grande,
+    fuente_a_bytes,
+    guardar_upload_cacheado,
+    obtener_upload_cacheado,
+    verificar_opciones_parsed,
+)
 
 # Claves lógicas internas → posibles títulos de columna en Excel (minusc_norm)
 # Extensible: añadir sinónimos por ERP.
@@ -171,6 +186,89 @@ def _to_decimal(val: Any) -> Optional[Decimal]:
             return None
 
 
+def _columna(df: pd.DataFrame, col: Optional[str]) -> Optional[pd.Series]:
+    if not col or col not in df.columns:
+        return None
+    serie = df[col]
+    # Encabezados repetidos tras normalizar: se usa la primera columna
+    return serie.iloc[:, 0] if isinstance(serie, pd.DataFrame) else serie
+
+
+def _formato_fechas_texto(textos: pd.Series) -> Optional[str]:
+    """Formato (strftime) inferido del primer texto no vacío de la columna (día primero, como en Chile)."""
+    primero = next((t for t in textos if t.strip()), None)
+    if primero is None:
+        return None
+    return guess_datetime_format(primero.strip(), dayfirst=True)
+
+
+def _fechas_columna(serie: Optional[pd.Series], n: int) -> List[Optional[date]]:
+    """
+    Equivalente vectorizado de ``_to_date`` para una columna completa: los textos se parsean
+    con una sola llamada a ``pd.to_datetime`` (formato inferido del primero) y el resto de
+    valores (datetime, Timestamp, números) con otra. Lo que no calza se resuelve como antes,
+    una vez por valor distinto.
+    """
+    if serie is None:
+        return [None] * n
+    if pd.api.types.is_datetime64_any_dtype(serie.dtype):
+        ts = serie
+    else:
+        valores = serie.astype(object)
+        es_texto = valores.map(lambda v: isinstance(v, str)).astype(bool)
+        ts = pd.Series(pd.NaT, index=valores.index, dtype="datetime64[ns]")
+        otros = ~es_texto & valores.notna()
+        if otros.any():
+            ts[otros] = pd.to_datetime(valores[otros], errors="coerce")
+        if es_texto.any():
+            textos = valores[es_texto]
+            formato = _formato_fechas_texto(textos)
+            if formato:
+                ts[es_texto] = pd.to_datetime(textos, format=formato, errors="coerce")
+        pendientes = ts.isna() & valores.notna()
+        if pendientes.any():
+            resueltos = {v: _to_date(v) for v in pd.unique(valores[pendientes])}
+            ts[pendientes] = pd.to_datetime(valores[pendientes].map(resueltos), errors="coerce")
+    return [d if pd.notna(d) else None for d in ts.dt.date]
+
+
+def _decimales_columna(serie: Optional[pd.Series], n: int) -> List[Optional[Decimal]]:
+    """
+    Equivalente vectorizado de ``_to_decimal``: la limpieza del texto (1.234,56 → 1234.56)
+    se hace sobre la columna completa; por celda solo queda el constructor de Decimal.
+    """
+    if serie is None:
+        return [None] * n
+    nulos = serie.isna().to_numpy()
+    if pd.api.types.is_numeric_dtype(serie.dtype) and not pd.api.types.is_bool_dtype(serie.dtype):
+        return [None if nulo else Decimal(str(v)) for v, nulo in zip(serie.tolist(), nulos)]
+
+    texto = serie.astype(str).str.strip()
+    con_ambos = texto.str.contains(",", regex=False) & texto.str.contains(".", regex=False)
+    texto = texto.where(~con_ambos, texto.str.replace(".", "", regex=False)).str.replace(",", ".", regex=False)
+    out: List[Optional[Decimal]] = []
+    for original, t, nulo in zip(serie.tolist(), texto.tolist(), nulos):
+        if nulo or t == "":
+            out.append(None)
+        elif isinstance(original, Decimal):
+            out.append(original)
+        else:
+            try:
+                out.append(Decimal(t))
+            except InvalidOperation:
+                out.append(_to_decimal(original))
+    return out
+
+
+def _textos_columna(serie: Optional[pd.Series], n: int, largo: int) -> List[Optional[str]]:
+    """``str(valor).strip()[:largo]`` por columna; None donde la celda está vacía (NaN)."""
+    if serie is None:
+        return [None] * n
+    nulos = serie.isna().to_numpy()
+    texto = serie.astype(str).str.strip().str[:largo]
+    return [None if nulo else t for t, nulo in zip(texto.tolist(), nulos)]
+
+
 def dataframe_a_registros_factura(
     df: pd.DataFrame,
     mapeo: Mapping[str, str],
@@ -181,6 +279,9 @@ def dataframe_a_registros_factura(
     """
     Convierte filas del DataFrame en dicts listos para crud_p.crear_proyeccion_facturas_bulk
     (incluye tipo, tipo_confianza, fechas y montos; sin carga_id ni user_id).
+
+    Trabaja por columnas: cada columna de fechas se parsea con un solo ``pd.to_datetime``
+    y los montos con normalización de texto vectorizada; luego se arman los dicts en una pasada.
     """
     advertencias: List[str] = []
     req = ["fecha_vencimiento", "razon_social", "monto_total", "saldo"]
@@ -188,74 +289,49 @@ def dataframe_a_registros_factura(
     if faltan:
         raise ValueError(f"Faltan columnas requeridas en el mapeo: {faltan}. Mapeo actual: {list(mapeo.keys())}")
 
+    n = len(df)
+    vctos = _fechas_columna(_columna(df, mapeo["fecha_vencimiento"]), n)
+    razones = _textos_columna(_columna(df, mapeo["razon_social"]), n, 200)
+    totales = _decimales_columna(_columna(df, mapeo["monto_total"]), n)
+    saldos = [s if s is not None else t for s, t in zip(_decimales_columna(_columna(df, mapeo["saldo"]), n), totales)]
+
+    # Columnas opcionales: (clave, valores); solo se agregan al registro si hay valor
+    opcionales = []
+    for clave, conversor in (
+        ("fecha_emision", lambda s: _fechas_columna(s, n)),
+        ("rut_contraparte", lambda s: _textos_columna(s, n, 20)),
+        ("folio", lambda s: _textos_columna(s, n, 50)),
+        ("monto_neto", lambda s: _decimales_columna(s, n)),
+        ("monto_iva", lambda s: _decimales_columna(s, n)),
+        ("condicion_venta", lambda s: _textos_columna(s, n, 50)),
+        ("estado", lambda s: _textos_columna(s, n, 50)),
+    ):
+        if mapeo.get(clave):
+            opcionales.append((clave, conversor(_columna(df, mapeo[clave]))))
+
     out: List[Dict[str, Any]] = []
-    col_vcto = mapeo["fecha_vencimiento"]
-    col_razon = mapeo["razon_social"]
-    col_total = mapeo["monto_total"]
-    col_saldo = mapeo["saldo"]
-    col_emision = mapeo.get("fecha_emision")
-    col_rut = mapeo.get("rut_contraparte")
-    col_folio = mapeo.get("folio")
-    col_neto = mapeo.get("monto_neto")
-    col_iva = mapeo.get("monto_iva")
-    col_cond = mapeo.get("condicion_venta")
-    col_estado = mapeo.get("estado")
-
-    for idx, row in df.iterrows():
-        fev = _to_date(row.get(col_vcto))
-        if not fev:
+    for pos, idx in enumerate(df.index):
+        if vctos[pos] is None:
             advertencias.append(f"Fila {idx}: sin fecha_vencimiento válida, omitida.")
             continue
-        razon = row.get(col_razon)
-        if razon is None or (isinstance(razon, float) and pd.isna(razon)):
+        if razones[pos] is None:
             advertencias.append(f"Fila {idx}: sin razón social, omitida.")
             continue
-        razon_s = str(razon).strip()[:200]
-        m_total = _to_decimal(row.get(col_total))
-        saldo = _to_decimal(row.get(col_saldo))
-        if saldo is None and m_total is not None:
-            saldo = m_total
-        if saldo is None:
+        if saldos[pos] is None:
             advertencias.append(f"Fila {idx}: sin saldo ni total válido, omitida.")
             continue
 
         reg: Dict[str, Any] = {
             "tipo": tipo_factura,
-            "razon_social": razon_s,
-            "fecha_vencimiento": fev,
-            "monto_total": m_total,
-            "saldo": saldo,
+            "razon_social": razones[pos],
+            "fecha_vencimiento": vctos[pos],
+            "monto_total": totales[pos],
+            "saldo": saldos[pos],
             "tipo_confianza": tipo_confianza,
         }
-        if col_emision:
-            fei = _to_date(row.get(col_emision))
-            if fei:
-                reg["fecha_emision"] = fei
-        if col_rut:
-            rut = row.get(col_rut)
-            if rut is not None and not (isinstance(rut, float) and pd.isna(rut)):
-                reg["rut_contraparte"] = str(rut).strip()[:20]
-        if col_folio:
-            folio = row.get(col_folio)
-            if folio is not None and not (isinstance(folio, float) and pd.isna(folio)):
-                reg["folio"] = str(folio).strip()[:50]
-        if col_neto:
-            neto = _to_decimal(row.get(col_neto))
-            if neto is not None:
-                reg["monto_neto"] = neto
-        if col_iva:
-            iva = _to_decimal(row.get(col_iva))
-            if iva is not None:
-                reg["monto_iva"] = iva
-        if col_cond:
-            cv = row.get(col_cond)
-            if cv is not None and not (isinstance(cv, float) and pd.isna(cv)):
-                reg["condicion_venta"] = str(cv).strip()[:50]
-        if col_estado:
-            es = row.get(col_estado)
-            if es is not None and not (isinstance(es, float) and pd.isna(es)):
-                reg["estado"] = str(es).strip()[:50]
-
+        for clave, valores in opcionales:
+            if valores[pos] is not None:
+                reg[clave] = valores[pos]
         out.append(reg)
 
     return out, advertencias
@@ -267,14 +343,44 @@ def leer_excel_facturas(
     hoja: Union[int, str, None] = 0,
     fila_header: int = 0,
 ) -> pd.DataFrame:
-    """Lee la primera hoja (o la indicada); fila_header índice 0-based para el encabezado."""
-    if isinstance(fuente, (str, Path)):
-        return pd.read_excel(fuente, sheet_name=hoja if hoja is not None else 0, header=fila_header, engine="openpyxl")
-    if isinstance(fuente, bytes):
-        return pd.read_excel(
-            io.BytesIO(fuente), sheet_name=hoja if hoja is not None else 0, header=fila_header, engine="openpyxl"
-        )
-    return pd.read_excel(fuente, sheet_name=hoja if hoja is not None else 0, header=fila_header, engine="openpyxl")
+    """
+    Lee la primera hoja (o la indicada); fila_header índice 0-based para el encabezado.
+    Mismo resultado que ``pd.read_excel``, leyendo las filas por lotes (openpyxl read-only).
+    """
+    return leer_excel_por_lotes(fuente, hoja=hoja, fila_header=fila_header)
+
+
+def parsear_excel_erp(
+    fuente: Union[str, Path, bytes, BinaryIO, ParsedUpload],
+    *,
+    preset: Optional[str] = None,
+    hoja: Union[int, str, None] = 0,
+    fila_header: int = 0,
+) -> ParsedUpload:
+    """
+    Lee, normaliza y detecta el mapeo una sola vez por contenido (caché por hash + opciones).
+    Si ``fuente`` ya es un ParsedUpload se devuelve tal cual.
+    """
+    if isinstance(fuente, ParsedUpload):
+        return fuente
+    datos = fuente_a_bytes(fuente)
+    clave = ("erp", hash_contenido(datos), (preset or "generico").lower(), hoja, fila_header)
+    parsed = obtener_upload_cacheado(clave)
+    if parsed is not None:
+        return parsed
+    df = normalizar_nombres_columnas(leer_excel_facturas(datos, hoja=hoja, fila_header=fila_header))
+    parsed = ParsedUpload(
+        hash_contenido=clave[1],
+        tipo="erp",
+        preset=preset,
+        hoja=hoja,
+        fila_header=fila_header,
+        modo_header=("fija", fila_header),
+        df=df,
+        mapeo=detectar_mapeo_columnas(_columnas_df_normalizadas(df), preset=preset),
+    )
+    guardar_upload_cacheado(clave, parsed)
+    return parsed
 
 
 @dataclass
@@ -289,7 +395,7 @@ class ResultadoCargaErp:
 
 def cargar_excel_cxc_cxp(
     user_id: int,
-    fuente: Union[str, Path, bytes, BinaryIO],
+    fuente: Union[str, Path, bytes, BinaryIO, ParsedUpload],
     nombre_archivo: str,
     *,
     es_cxc: bool,
@@ -304,15 +410,37 @@ def cargar_excel_cxc_cxp(
 
     es_cxc=True → tipo carga 'cxc' y facturas 'por_cobrar'.
     es_cxc=False → tipo carga 'cxp' y facturas 'por_pagar'.
+    Acepta el ParsedUpload de ``parsear_excel_erp`` / la inspección previa (no vuelve a leer el Excel);
+    si se leyó con otro preset/hoja/fila_header que los indicados, ValueError.
+    Archivos grandes (ver ``es_upload_grande``) se procesan por lotes: memoria acotada por lote.
     """
-    df_raw = leer_excel_facturas(fuente, hoja=hoja, fila_header=fila_header)
-    df = normalizar_nombres_columnas(df_raw)
-    cols = _columnas_df_normalizadas(df)
-    mapeo = detectar_mapeo_columnas(cols, preset=preset_columnas)
-
     tipo_carga = "cxc" if es_cxc else "cxp"
     tipo_factura = "por_cobrar" if es_cxc else "por_pagar"
 
+    if isinstance(fuente, ParsedUpload):
+        verificar_opciones_parsed(
+            fuente, "erp", preset=preset_columnas, hoja=hoja, modo_header=("fija", fila_header)
+        )
+    else:
+        datos = fuente_a_bytes(fuente)
+        if es_upload_grande(datos):
+            return _cargar_facturas_por_lotes(
+                user_id,
+                datos,
+                nombre_archivo,
+                tipo_carga=tipo_carga,
+                tipo_factura=tipo_factura,
+                preset_columnas=preset_columnas,
+                hoja=hoja,
+                fila_header=fila_header,
+                tipo_confianza=tipo_confianza,
+                origen=origen,
+            )
+        fuente = datos
+
+    parsed = parsear_excel_erp(fuente, preset=preset_columnas, hoja=hoja, fila_header=fila_header)
+    df, mapeo = parsed.df, parsed.mapeo
+
     registros, adv = dataframe_a_registros_factura(df, mapeo, tipo_factura=tipo_factura, tipo_confianza=tipo_confianza)
 
     carga = crud_p.crear_proyeccion_carga(
@@ -342,18 +470,82 @@ def cargar_excel_cxc_cxp(
     )
 
 
+def _cargar_facturas_por_lotes(
+    user_id: int,
+    datos: bytes,
+    nombre_archivo: str,
+    *,
+    tipo_carga: str,
+    tipo_factura: str,
+    preset_columnas: Optional[str],
+    hoja: Union[int, str, None],
+    fila_header: int,
+    tipo_confianza: str,
+    origen: str,
+) -> ResultadoCargaErp:
+    """
+    Pipeline por lotes: leer lote → normalizar → convertir → insertar, sin tener el archivo
+    completo como DataFrame. El mapeo se detecta con los encabezados (iguales en todos los lotes).
+    Si un lote falla, la carga parcial se elimina (y la vigente vuelve a ser la anterior).
+    """
+    carga = None
+    mapeo: Dict[str, str] = {}
+    advertencias: List[str] = []
+    filas_leidas = filas_validas = guardadas = 0
+
+    try:
+        for lote in iterar_lotes_excel(datos, hoja=hoja, fila_header=fila_header):
+            df = normalizar_nombres_columnas(lote)
+            df.index = pd.RangeIndex(filas_leidas, filas_leidas + len(df))
+            if carga is None:
+                mapeo = detectar_mapeo_columnas(_columnas_df_normalizadas(df), preset=preset_columnas)
+            registros, adv = dataframe_a_registros_factura(
+                df, mapeo, tipo_factura=tipo_factura, tipo_confianza=tipo_confianza
+            )
+            if carga is None:
+                carga = crud_p.crear_proyeccion_carga(
+                    user_id, tipo_carga, nombre_archivo=nombre_archivo, origen=origen, total_registros=0
+                )
+            for r in registros:
+                r["carga_id"] = carga.id
+                r["user_id"] = user_id
+            guardadas += crud_p.crear_proyeccion_facturas_bulk(registros) if registros else 0
+            filas_leidas += len(df)
+            filas_validas += len(registros)
+            advertencias.extend(adv)
+            reportar_progreso(mensaje=f"{guardadas:,} facturas guardadas")
+
+        if carga is None:
+            raise ValueError("El Excel no tiene una fila de encabezados en la posición indicada.")
+        crud_p.actualizar_proyeccion_carga(carga.id, total_registros=filas_validas)
+    except Exception:
+        if carga is not None:
+            crud_p.eliminar_proyeccion_carga(carga.id)
+        raise
+
+    return ResultadoCargaErp(
+        carga_id=carga.id,
+        facturas_guardadas=guardadas,
+        filas_leidas=filas_leidas,
+        filas_validas=filas_validas,
+        mapeo_columnas=dict(mapeo),
+        advertencias=advertencias,
+    )
+
+
 def inspeccionar_excel_erp(
-    fuente: Union[str, Path, bytes],
+    fuente: Union[str, Path, bytes, ParsedUpload],
     *,
     preset: Optional[str] = None,
     hoja: Union[int, str, None] = 0,
     fila_header: int = 0,
 ) -> Dict[str, Any]:
-    """Devuelve columnas normalizadas y mapeo detectado sin escribir en BD (útil para UI)."""
-    df_raw = leer_excel_facturas(fuente, hoja=hoja, fila_header=fila_header)
-    df = normalizar_nombres_columnas(df_raw)
-    cols = list(df.columns)
-    mapeo = detectar_mapeo_columnas(cols, preset=preset)
+    """
+    Devuelve columnas normalizadas y mapeo detectado sin escribir en BD (útil para UI).
+    ``parsed`` en el resultado se puede pasar a ``cargar_excel_cxc_cxp`` sin reparsear.
+    """
+    parsed = parsear_excel_erp(fuente, preset=preset, hoja=hoja, fila_header=fila_header)
+    df, cols, mapeo = parsed.df, parsed.columnas, parsed.mapeo
     faltantes = [k for k in ("fecha_vencimiento", "razon_social", "monto_total", "saldo") if k not in mapeo]
     return {
         "columnas": cols,
@@ -361,4 +553,5 @@ def inspeccionar_excel_erp(
         "mapeo_ok": len(faltantes) == 0,
         "faltantes": faltantes,
         "muestra_filas": min(5, len(df)),
+        "parsed": parsed,
     }
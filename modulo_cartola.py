@@ -0,0 +1,395 @@
+"""
+Lectura de cartolas bancarias (Tab1) en una sola pasada.
+El Excel se parsea una vez a una grilla cruda (``header=None``, openpyxl en modo read-only);
+la fila de encabezados se detecta en memoria y el DataFrame se arma cortando esa grilla.
+
+``leer_cartola`` deja la tabla con las columnas estándar (FECHA, DESCRIPCION, ABONOS/CARGOS/SALDO
+(CLP), COMENTARIO) sin tocar la UI, así sirve tanto en Tab1 como en la importación por lotes.
+
+Incluye una caché de cartolas ya parseadas direccionada por SHA-256 del contenido
+(memoria + disco acotado por tamaño), para no reparsear el mismo archivo en cada rerun.
+"""
+from __future__ import annotations
+
+import hashlib
+import io
+import os
+import stat
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+from modulo_clasificador import normalizar_columna
+from modulo_lectura_excel import leer_cabeza_excel, leer_excel_por_lotes
+
+FuenteExcel = Union[str, Path, bytes, BinaryIO]
+
+# Palabras que delatan la fila de encabezados de una cartola
+PALABRAS_CLAVE_ENCABEZADO = [
+    'FECHA', 'DESCRIPCION',
+    'ABONOS', 'INGRESOS', 'ENTRADAS', 'CREDITO', 'ABONO',
+    'DEPOSITOS', 'DEPOSITO', 'DEPOSIT',
+    'CARGOS', 'EGRESOS', 'SALIDAS', 'DEBITO',
+    'SALDO',
+    'CANAL', 'SUCURSAL', 'DOCTO', 'DOCUMENTO', 'GLOSA', 'DETALLE', 'FECHA OPERACION'
+]
+
+
+def leer_grilla_cartola(fuente: FuenteExcel, *, hoja: Union[int, str] = 0) -> pd.DataFrame:
+    """
+    Parsea la hoja completa una sola vez, sin encabezados ni inferencia de tipos
+    (``dtype=object``): cada celda queda tal como la entrega el lector de Excel.
+    """
+    if isinstance(fuente, (bytes, bytearray)):
+        fuente = io.BytesIO(fuente)
+    return pd.read_excel(fuente, sheet_name=hoja, header=None, dtype=object)
+
+
+def _valores_fila(fila: pd.Series) -> List[str]:
+    return [str(val).upper().strip() for val in fila.values if pd.notna(val) and str(val).strip() != '']
+
+
+def encontrar_fila_encabezados_grilla(grilla: pd.DataFrame, max_filas: int = 20) -> int:
+    """
+    Primera fila (0-indexed) entre las ``max_filas`` iniciales con al menos 2 palabras clave
+    de encabezado; 0 si no se encuentra.
+    """
+    for idx in range(min(max_filas, len(grilla))):
+        fila_str = ' '.join(_valores_fila(grilla.iloc[idx]))
+        coincidencias = sum(1 for palabra in PALABRAS_CLAVE_ENCABEZADO if palabra in fila_str)
+        if coincidencias >= 2:
+            return idx
+    return 0
+
+
+def buscar_encabezados_agresivo(grilla: pd.DataFrame, max_filas: int = 30) -> Optional[int]:
+    """
+    Búsqueda de respaldo cuando quedan columnas UNNAMED: fila con (fecha o descripción)
+    y (abonos o cargos). None si ninguna cumple.
+    """
+    for idx in range(min(max_filas, len(grilla))):
+        valores = _valores_fila(grilla.iloc[idx])
+        tiene_fecha = any('FECHA' in v for v in valores)
+        tiene_descripcion = any('DESCRIPCION' in v or 'GLOSA' in v or 'DETALLE' in v for v in valores)
+        tiene_abonos = any('ABONO' in v or 'CREDITO' in v for v in valores)
+        tiene_cargos = any('CARGO' in v or 'DEBITO' in v for v in valores)
+        if (tiene_fecha or tiene_descripcion) and (tiene_abonos or tiene_cargos):
+            return idx
+    return None
+
+
+def dataframe_desde_grilla(grilla: pd.DataFrame, fila_encabezado: int) -> pd.DataFrame:
+    """
+    Equivalente a ``pd.read_excel(..., header=fila_encabezado)`` pero sin volver a leer el archivo:
+    corta la grilla y aplica el mismo parser de texto que usa ``read_excel`` (nombres
+    ``Unnamed: i``, duplicados ``X.1`` e inferencia de tipos por columna).
+    """
+    if grilla.empty or fila_encabezado >= len(grilla):
+        return pd.DataFrame()
+    bloque = grilla.iloc[fila_encabezado:].astype(object)
+    # read_excel entrega las celdas vacías como "" al parser (→ NaN en datos, "Unnamed: i" en encabezado)
+    filas: List[List[Any]] = bloque.where(bloque.notna(), "").values.tolist()
+    return TextParser(filas, header=0).read()
+
+
+# ---------- Cartola con columnas estándar ----------
+
+# Marca en df.attrs: COMENTARIO ya contiene DESCRIPCION normalizada
+ATTR_COMENTARIO_NORMALIZADO = "comentario_normalizado"
+
+COLUMNAS_REQUERIDAS_CARTOLA = ["DESCRIPCION", "FECHA", "ABONOS (CLP)"]
+
+
+@dataclass
+class LecturaCartola:
+    """
+    Resultado de ``leer_cartola``. ``mensajes`` son pares (tipo, contenido) para mostrar en la UI
+    (tipo info / warning / success / dataframe). Si faltan columnas mínimas, ``faltantes`` no está
+    vacío y ``df`` es la tabla tal como se leyó (para depurar el formato).
+    """
+
+    df: pd.DataFrame
+    faltantes: List[str] = field(default_factory=list)
+    mensajes: List[Tuple[str, Any]] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.faltantes
+
+
+def mapear_columnas_cartola(columnas: Sequence[str]) -> Dict[str, str]:
+    """Renombres {columna del banco: columna estándar} según variantes conocidas de encabezados."""
+    mapeo_columnas: Dict[str, str] = {}
+    columnas = list(columnas)
+
+    # Buscar FECHA
+    if "FECHA" not in columnas:
+        for col in columnas:
+            if "FECHA" in col.upper() or "DATE" in col.upper():
+                mapeo_columnas[col] = "FECHA"
+                break
+    
+    # Buscar DESCRIPCION
+    if "DESCRIPCION" not in columnas:
+        for col in columnas:
+            if "DESCRIPCION" in col.upper() or "DESCRIP" in col.upper() or "DETALLE" in col.upper() or "GLOSA" in col.upper():
+                mapeo_columnas[col] = "DESCRIPCION"
+                break
+    
+    # Buscar ABONOS
+    if "ABONOS (CLP)" not in columnas:
+        for col in columnas:
+            col_upper = str(col).upper()
+            if "ABONO" in col.upper() and "CLP" in col.upper():
+                mapeo_columnas[col] = "ABONOS (CLP)"
+                break
+            elif (
+                ("ABONO" in col_upper)
+                or ("DEPOSITO" in col_upper)
+                or ("DEPOSITOS" in col_upper)
+                or ("INGRESO" in col_upper)
+                or ("ENTRADA" in col_upper)
+                or ("CREDITO" in col_upper)
+            ):
+                # Evitar columnas que claramente representan egresos/cargos.
+                if any(k in col_upper for k in ["DEBITO", "EGRESO", "EGRESOS", "CARGO", "CARGOS", "SALIDA", "SALIDAS"]):
+                    continue
+                mapeo_columnas[col] = "ABONOS (CLP)"
+                break
+    
+    # Buscar CARGOS (muchos bancos cambian encabezados: CARGOS/DEBITO/EGRESOS)
+    if "CARGOS (CLP)" not in columnas:
+        for col in columnas:
+            col_upper = col.upper()
+            # Incluye variantes con y sin "(CLP)"
+            if ("CARGO" in col_upper or "DEBITO" in col_upper or "DÉBITO" in col_upper) and "CLP" in col_upper:
+                mapeo_columnas[col] = "CARGOS (CLP)"
+                break
+            if ("CARGOS" in col_upper or "EGRESO" in col_upper or "EGRESOS" in col_upper) and ("CLP" in col_upper or True):
+                mapeo_columnas[col] = "CARGOS (CLP)"
+                break
+            if ("DEBITO" in col_upper or "DÉBITO" in col_upper) and ("CLP" in col_upper):
+                mapeo_columnas[col] = "CARGOS (CLP)"
+                break
+
+    # SALDO cartola (encabezado típico "SALDO" sin "(CLP)")
+    if "SALDO (CLP)" not in columnas:
+        for col in columnas:
+            col_upper = str(col).upper().strip()
+            if col_upper == "SALDO" or (
+                "SALDO" in col_upper
+                and "ABONO" not in col_upper
+                and "CARGO" not in col_upper
+                and "INICIO" not in col_upper
+                and "FINAL" not in col_upper
+            ):
+                mapeo_columnas[col] = "SALDO (CLP)"
+                break
+    return mapeo_columnas
+
+
+def leer_cartola(fuente: FuenteExcel) -> LecturaCartola:
+    """
+    Lee la cartola detectando la fila de encabezados (las primeras filas en una grilla; la hoja
+    completa por lotes con la fila elegida) y la deja con columnas estándar y COMENTARIO
+    normalizado, todavía sin clasificar.
+
+    Ejemplo:
+        lectura = leer_cartola(datos)
+        if lectura.ok:
+            df = lectura.df
+    """
+    mensajes: List[Tuple[str, Any]] = []
+    grilla = leer_cabeza_excel(fuente, filas=30)
+
+    fila_encabezados = encontrar_fila_encabezados_grilla(grilla)
+    df = leer_excel_por_lotes(fuente, fila_header=fila_encabezados)
+    if fila_encabezados > 0:
+        mensajes.append(("info", f"💡 Se detectaron encabezados en la fila {fila_encabezados + 1}"))
+    df.columns = df.columns.str.strip().str.upper()
+
+    # Si las columnas son UNNAMED, buscar de nuevo de forma más agresiva (misma grilla)
+    if any('UNNAMED' in str(col) for col in df.columns):
+        mensajes.append(("warning", "⚠️ Detectadas columnas sin nombre. Buscando encabezados de forma más agresiva..."))
+        idx = buscar_encabezados_agresivo(grilla, max_filas=30)
+        if idx is not None:
+            df = leer_excel_por_lotes(fuente, fila_header=idx)
+            df.columns = df.columns.str.strip().str.upper()
+            mensajes.append(("success", f"✅ Encabezados encontrados en la fila {idx + 1}"))
+        else:
+            mensajes.append(("warning", "⚠️ No se pudieron detectar los encabezados automáticamente"))
+            mensajes.append(("dataframe", grilla.head(10)))
+
+    # Limpiar filas vacías al inicio y final
+    df = df.dropna(how='all').reset_index(drop=True)
+    if "DESCRIPCIÓN" in df.columns:
+        df.rename(columns={"DESCRIPCIÓN": "DESCRIPCION"}, inplace=True)
+    mapeo_columnas = mapear_columnas_cartola(df.columns)
+    if mapeo_columnas:
+        df.rename(columns=mapeo_columnas, inplace=True)
+
+    faltantes = [col for col in COLUMNAS_REQUERIDAS_CARTOLA if col not in df.columns]
+    if faltantes:
+        return LecturaCartola(df=df, faltantes=faltantes, mensajes=mensajes)
+
+    df["DESCRIPCION"] = df["DESCRIPCION"].astype(str)
+    df["COMENTARIO"] = normalizar_columna(df["DESCRIPCION"])
+    df.attrs[ATTR_COMENTARIO_NORMALIZADO] = True
+    df["FECHA"] = pd.to_datetime(df["FECHA"], dayfirst=True, errors='coerce')
+
+    # Si no se pudo identificar CARGOS, crearla para que métricas/gráficos no fallen
+    if "CARGOS (CLP)" not in df.columns:
+        df["CARGOS (CLP)"] = 0
+
+    # Eliminar columnas sin nombre
+    df = df.loc[:, ~df.columns.str.contains("^UNNAMED")]
+    return LecturaCartola(df=df, mensajes=mensajes)
+
+
+# ---------- Caché de cartolas parseadas (por hash de contenido) ----------
+
+CACHE_CARTOLAS_DIR = Path(
+    os.getenv("FLUJO_CAJA_CACHE_DIR", str(Path(tempfile.gettempdir()) / "flujo_caja_cartolas"))
+)
+CACHE_CARTOLAS_MAX_MB = float(os.getenv("FLUJO_CAJA_CACHE_MB", "256"))
+CACHE_CARTOLAS_MAX_MEMORIA = int(os.getenv("FLUJO_CAJA_CACHE_MEMORIA", "8"))
+
+
+def hash_contenido(datos: bytes) -> str:
+    """SHA-256 (hex) del contenido subido: identifica la cartola independiente del nombre."""
+    return hashlib.sha256(datos).hexdigest()
+
+
+def _parquet_disponible() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class _CacheCartolas:
+    """
+    Dos niveles: LRU en memoria (pocas entradas) y directorio en disco acotado por tamaño total,
+    expulsando por último acceso (mtime). En disco solo Parquet (nunca pickle: el directorio
+    por defecto está en el tempdir compartido y un pickle ajeno ejecutaría código al leerlo);
+    pyarrow está en requirements.txt; si falta en el entorno, o si el DataFrame no es serializable
+    a Parquet, la entrada queda solo en memoria.
+    El disco solo se usa si el directorio es de este usuario y nadie más puede escribir en él.
+    Siempre entrega copias: quien llama puede mutar el DataFrame.
+    """
+
+    def __init__(self, directorio: Path, max_bytes_disco: int, max_memoria: int):
+        self.directorio = directorio
+        self.max_bytes_disco = max_bytes_disco
+        self.max_memoria = max_memoria
+        self._memoria: "OrderedDict[str, pd.DataFrame]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave: str) -> Optional[pd.DataFrame]:
+        with self._lock:
+            df = self._memoria.get(clave)
+            if df is not None:
+                self._memoria.move_to_end(clave)
+                return df.copy()
+        df = self._leer_disco(clave)
+        if df is not None:
+            self._guardar_memoria(clave, df)
+            return df.copy()
+        return None
+
+    def guardar(self, clave: str, df: pd.DataFrame) -> None:
+        df = df.copy()
+        self._guardar_memoria(clave, df)
+        self._escribir_disco(clave, df)
+
+    def _guardar_memoria(self, clave: str, df: pd.DataFrame) -> None:
+        with self._lock:
+            self._memoria[clave] = df
+            self._memoria.move_to_end(clave)
+            while len(self._memoria) > self.max_memoria:
+                self._memoria.popitem(last=False)
+
+    def _directorio_propio(self) -> bool:
+        """True si el directorio existe, es de este usuario y no es escribible por grupo u otros."""
+        try:
+            st = self.directorio.lstat()
+        except OSError:
+            return False
+        if not stat.S_ISDIR(st.st_mode) or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            return False
+        return not hasattr(os, "getuid") or st.st_uid == os.getuid()
+
+    def _leer_disco(self, clave: str) -> Optional[pd.DataFrame]:
+        if not _parquet_disponible() or not self._directorio_propio():
+            return None
+        ruta = self.directorio / f"{clave}.parquet"
+        if not ruta.exists():
+            return None
+        try:
+            df = pd.read_parquet(ruta)
+            os.utime(ruta)  # marca de uso para el LRU en disco
+            return df
+        except Exception:
+            # Entrada corrupta: se descarta
+            ruta.unlink(missing_ok=True)
+        return None
+
+    def _escribir_disco(self, clave: str, df: pd.DataFrame) -> None:
+        if self.max_bytes_disco <= 0 or not _parquet_disponible():
+            return
+        try:
+            self.directorio.mkdir(parents=True, exist_ok=True, mode=0o700)
+            if not self._directorio_propio():
+                return
+            tmp = self.directorio / f".{clave}.parquet.tmp"
+            try:
+                df.to_parquet(tmp, index=False)
+            except Exception:
+                # Columnas object mixtas u otro tipo que Parquet no acepta: solo en memoria
+                tmp.unlink(missing_ok=True)
+                return
+            os.replace(tmp, self.directorio / f"{clave}.parquet")
+            self._podar_disco()
+        except OSError:
+            # La caché en disco es opcional: sin permisos o sin espacio se sigue solo en memoria
+            pass
+
+    def _podar_disco(self) -> None:
+        archivos = [
+            p for p in self.directorio.iterdir()
+            if p.is_file() and p.suffix == ".parquet" and not p.name.startswith(".")
+        ]
+        archivos.sort(key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in archivos)
+        while archivos and total > self.max_bytes_disco:
+            viejo = archivos.pop(0)
+            total -= viejo.stat().st_size
+            viejo.unlink(missing_ok=True)
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._memoria.clear()
+
+
+_cache_cartolas = _CacheCartolas(
+    CACHE_CARTOLAS_DIR,
+    int(CACHE_CARTOLAS_MAX_MB * 1024 * 1024),
+    CACHE_CARTOLAS_MAX_MEMORIA,
+)
+
+
+def obtener_cartola_cacheada(hash_archivo: str) -> Optional[pd.DataFrame]:
+    """Copia del DataFrame parseado y normalizado para ese hash, o None si no está en caché."""
+    return _cache_cartolas.obtener(hash_archivo)
+
+
+def guardar_cartola_cacheada(hash_archivo: str, df: pd.DataFrame) -> None:
+    """Guarda el DataFrame parseado (antes de clasificar) bajo el hash del contenido."""
+    _cache_cartolas.guardar(hash_archivo, df)
@@ -0,0 +1,516 @@
+"""
+Motor de clasificación compilado para cartolas (Tab1).
+Construye una sola vez, a partir de la config fusionada (``fusionar_configs_clasificadores``),
+un autómata Aho-Corasick sobre todas las palabras clave y exclusiones, y clasifica columnas
+completas respetando la prioridad "primera regla que coincide gana".
+"""
+from __future__ import annotations
+
+import itertools
+import threading
+import unicodedata
+import weakref
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Mapping, Optional, Sequence, Set, Tuple, Union
+
+import pandas as pd
+
+from database import crud
+
+CLASIFICACION_DEFAULT = "NO CLASIFICADO"
+
+TIPO_EXACTO = "contiene_exacto"
+TIPO_CUALQUIERA = "contiene_cualquiera"
+
+# Marca en df.attrs: token del ClasificadorCompilado que produjo la columna CLASIFICACION
+ATTR_CLASIFICADO_CON = "clasificado_con"
+
+
+@lru_cache(maxsize=100_000)
+def _normalizar_str(texto: str) -> str:
+    texto = texto.upper().strip()
+    if texto.isascii():
+        # Sin acentos: NFD + encode ascii no cambiaría nada
+        return texto
+    return unicodedata.normalize("NFD", texto).encode("ascii", "ignore").decode("utf-8")
+
+
+def normalizar_texto(texto: Any) -> str:
+    """Igual que ``normalizar`` de la app: mayúsculas, sin espacios extremos ni acentos (memoizado)."""
+    if pd.isnull(texto):
+        return ""
+    return _normalizar_str(str(texto))
+
+
+def normalizar_columna(valores: Any, *, ya_normalizado: bool = False) -> pd.Series:
+    """
+    Versión por columna de ``normalizar_texto``: normaliza una sola vez cada valor distinto
+    (las glosas bancarias se repiten mucho) y reconstruye la columna por código.
+    Con ``ya_normalizado=True`` devuelve la entrada tal cual.
+    """
+    serie = valores if isinstance(valores, pd.Series) else pd.Series(list(valores), dtype=object)
+    if ya_normalizado:
+        return serie
+    codigos, unicos = pd.factorize(serie)
+    # El último elemento cubre los nulos (código -1 en factorize)
+    normalizados = pd.Series([_normalizar_str(str(u)) for u in unicos] + [""], dtype=object)
+    return pd.Series(normalizados.take(codigos).to_numpy(), index=serie.index, dtype=object)
+
+
+class _AutomataAhoCorasick:
+    """
+    Autómata multipatrón: en una sola pasada sobre el texto devuelve los ids de todos los
+    patrones que aparecen como subcadena (equivalente a ``patron in texto`` para cada uno).
+    """
+
+    def __init__(self, patrones: Sequence[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._salida: List[FrozenSet[int]] = [frozenset()]
+        salidas: List[set] = [set()]
+
+        for pid, patron in enumerate(patrones):
+            if not patron:
+                continue
+            nodo = 0
+            for ch in patron:
+                sig = self._goto[nodo].get(ch)
+                if sig is None:
+                    sig = len(self._goto)
+                    self._goto[nodo][ch] = sig
+                    self._goto.append({})
+                    self._fail.append(0)
+                    salidas.append(set())
+                nodo = sig
+            salidas[nodo].add(pid)
+
+        # BFS: enlaces de fallo y salidas heredadas por sufijo
+        cola: deque = deque(self._goto[0].values())
+        while cola:
+            nodo = cola.popleft()
+            for ch, hijo in self._goto[nodo].items():
+                cola.append(hijo)
+                f = self._fail[nodo]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                destino = self._goto[f].get(ch, 0)
+                self._fail[hijo] = destino if destino != hijo else 0
+                salidas[hijo] |= salidas[self._fail[hijo]]
+
+        self._salida = [frozenset(s) for s in salidas]
+
+    def buscar(self, texto: str) -> set:
+        goto = self._goto
+        fail = self._fail
+        salida = self._salida
+        encontrados: set = set()
+        nodo = 0
+        for ch in texto:
+            while nodo and ch not in goto[nodo]:
+                nodo = fail[nodo]
+            nodo = goto[nodo].get(ch, 0)
+            if salida[nodo]:
+                encontrados |= salida[nodo]
+        return encontrados
+
+
+# (nombre, tipo, ids palabras clave, ids exclusiones)
+_ReglaCompilada = Tuple[Any, str, FrozenSet[int], FrozenSet[int]]
+# (nombre, tipo, palabras clave, exclusiones): identidad de una regla para comparar versiones
+_FirmaRegla = Tuple[Any, str, FrozenSet[str], FrozenSet[str]]
+
+_tokens = itertools.count(1)
+_compilados_por_token: "weakref.WeakValueDictionary[int, ClasificadorCompilado]" = weakref.WeakValueDictionary()
+
+
+class _ListaCompilada:
+    """Reglas de una lista (abonos o cargos) en orden de prioridad, indexadas por palabra clave."""
+
+    def __init__(self, reglas: List[_ReglaCompilada]):
+        self.reglas = reglas
+        self.por_clave: Dict[int, List[int]] = {}
+        siempre: List[int] = []
+        for i, (_, tipo, claves, _) in enumerate(reglas):
+            if tipo == TIPO_EXACTO and not claves:
+                # all([]) es True: la regla aplica a cualquier texto no excluido
+                siempre.append(i)
+                continue
+            if tipo not in (TIPO_EXACTO, TIPO_CUALQUIERA):
+                continue
+            for k in claves:
+                self.por_clave.setdefault(k, []).append(i)
+        self.siempre: Tuple[int, ...] = tuple(siempre)
+
+    def primera_coincidencia(self, encontrados: set) -> Optional[int]:
+        candidatos = set(self.siempre)
+        for k in encontrados:
+            idxs = self.por_clave.get(k)
+            if idxs:
+                candidatos.update(idxs)
+        for i in sorted(candidatos):
+            _, tipo, claves, excluir = self.reglas[i]
+            if excluir and not excluir.isdisjoint(encontrados):
+                continue
+            if tipo == TIPO_EXACTO:
+                if claves <= encontrados:
+                    return i
+            elif not claves.isdisjoint(encontrados):
+                return i
+        return None
+
+
+class ClasificadorCompilado:
+    """
+    Clasificador equivalente a ``clasificar_mejorado`` pero compilado:
+    un autómata común para abonos y cargos y un índice palabra → reglas por lista.
+
+    Ejemplo:
+        clf = ClasificadorCompilado(config_clasificadores)
+        df["CLASIFICACION"] = clf.classify_series(df["COMENTARIO"], df["ABONOS (CLP)"])
+    """
+
+    def __init__(self, config_clasificadores: Optional[Mapping[str, Any]]):
+        self.config = config_clasificadores
+        self.token = next(_tokens)
+        _compilados_por_token[self.token] = self
+        cfg = config_clasificadores or {}
+        self.clasificacion_default = cfg.get("clasificacion_default", CLASIFICACION_DEFAULT)
+        clasificadores = cfg.get("clasificadores", {}) or {}
+
+        ids_patron: Dict[str, int] = {}
+
+        def _ids(palabras: Iterable[Any]) -> FrozenSet[int]:
+            out = set()
+            for p in palabras or []:
+                out.add(ids_patron.setdefault(str(p), len(ids_patron)))
+            return frozenset(out)
+
+        listas: Dict[str, List[_ReglaCompilada]] = {}
+        self.firmas: Dict[str, List[_FirmaRegla]] = {}
+        for lista_key in ("abonos", "cargos"):
+            compiladas: List[_ReglaCompilada] = []
+            firmas: List[_FirmaRegla] = []
+            for regla in clasificadores.get(lista_key, []) or []:
+                if not isinstance(regla, dict):
+                    continue
+                nombre = regla.get("nombre", self.clasificacion_default)
+                tipo = regla.get("tipo", TIPO_CUALQUIERA)
+                palabras = regla.get("palabras_clave", []) or []
+                excluir = regla.get("excluir", []) or []
+                compiladas.append((nombre, tipo, _ids(palabras), _ids(excluir)))
+                firmas.append((
+                    nombre, tipo, frozenset(str(p) for p in palabras), frozenset(str(p) for p in excluir)
+                ))
+            listas[lista_key] = compiladas
+            self.firmas[lista_key] = firmas
+
+        patrones = [""] * len(ids_patron)
+        for patron, pid in ids_patron.items():
+            patrones[pid] = patron
+        # La cadena vacía está contenida en todo texto; no pasa por el autómata
+        self._siempre_presentes = frozenset(pid for pid, p in enumerate(patrones) if p == "")
+        self._automata = _AutomataAhoCorasick(patrones)
+        self._abonos = _ListaCompilada(listas["abonos"])
+        self._cargos = _ListaCompilada(listas["cargos"])
+
+    def __getstate__(self) -> Dict[str, Any]:
+        estado = self.__dict__.copy()
+        estado.pop("token", None)
+        return estado
+
+    def __setstate__(self, estado: Dict[str, Any]) -> None:
+        # Al deserializar (p. ej. en un proceso de importación) el token del proceso de origen
+        # no identifica nada: se registra con uno local
+        self.__dict__.update(estado)
+        self.token = next(_tokens)
+        _compilados_por_token[self.token] = self
+
+    def clasificar(self, texto: Any, abono: Any = 0, *, normalizado: bool = False) -> Any:
+        """Clasifica un texto; ``abono > 0`` usa la lista de abonos, si no la de cargos."""
+        if self.config is None:
+            return CLASIFICACION_DEFAULT
+        try:
+            es_abono = bool(float(abono) > 0)
+        except (TypeError, ValueError):
+            es_abono = False
+        texto_n = texto if normalizado and isinstance(texto, str) else normalizar_texto(texto)
+        return self._clasificar_normalizado(texto_n, es_abono)
+
+    def _clasificar_normalizado(self, texto: str, es_abono: bool) -> Any:
+        encontrados = self._automata.buscar(texto)
+        if self._siempre_presentes:
+            encontrados |= self._siempre_presentes
+        lista = self._abonos if es_abono else self._cargos
+        i = lista.primera_coincidencia(encontrados)
+        if i is None:
+            return self.clasificacion_default
+        return lista.reglas[i][0]
+
+    def classify_series(self, texts: Any, abonos: Any, *, normalizado: bool = False) -> pd.Series:
+        """
+        Clasifica una columna completa de textos. ``abonos`` puede ser una Serie alineada
+        o un escalar. Los pares (texto, es_abono) repetidos se evalúan una sola vez.
+        Con ``normalizado=True`` (p. ej. la columna COMENTARIO) no se vuelve a normalizar.
+        """
+        textos = texts if isinstance(texts, pd.Series) else pd.Series(list(texts))
+        if self.config is None:
+            return pd.Series(CLASIFICACION_DEFAULT, index=textos.index, dtype=object)
+
+        es_abono = _mascara_abonos(abonos, len(textos))
+        textos = normalizar_columna(textos, ya_normalizado=normalizado)
+        memo: Dict[Tuple[Any, bool], Any] = {}
+        resultado: List[Any] = []
+        for texto, ab in zip(textos.tolist(), es_abono):
+            clave = (texto, bool(ab))
+            r = memo.get(clave)
+            if r is None and clave not in memo:
+                texto_n = texto if isinstance(texto, str) else normalizar_texto(texto)
+                r = memo[clave] = self._clasificar_normalizado(texto_n, bool(ab))
+            resultado.append(r)
+        return pd.Series(resultado, index=textos.index, dtype=object)
+
+
+def _mascara_abonos(abonos: Any, n: int) -> List[bool]:
+    """``abono > 0`` por fila (no numéricos y nulos cuentan como cargo)."""
+    if isinstance(abonos, pd.Series):
+        return pd.to_numeric(abonos, errors="coerce").gt(0).tolist()
+    try:
+        return [bool(float(abonos) > 0)] * n
+    except (TypeError, ValueError):
+        return [False] * n
+
+
+def _sin_duplicados(firmas: Sequence[_FirmaRegla]) -> List[_FirmaRegla]:
+    # Una firma repetida más abajo nunca gana: solo cuenta su primera aparición
+    vistas: Set[_FirmaRegla] = set()
+    out: List[_FirmaRegla] = []
+    for f in firmas:
+        if f not in vistas:
+            vistas.add(f)
+            out.append(f)
+    return out
+
+
+def diferencias_reglas(
+    anterior: ClasificadorCompilado, nuevo: ClasificadorCompilado
+) -> Optional[Dict[str, Tuple[List[_FirmaRegla], Set[Any]]]]:
+    """
+    Compara dos versiones compiladas. Por lista (abonos/cargos) devuelve
+    ``(reglas_nuevas_o_modificadas, nombres_de_reglas_eliminadas)``.
+    Devuelve None si hace falta una pasada completa (cambió el default, alguna config es None
+    o se reordenaron reglas que existen en ambas versiones).
+    """
+    if anterior.config is None or nuevo.config is None:
+        return None
+    if anterior.clasificacion_default != nuevo.clasificacion_default:
+        return None
+    out: Dict[str, Tuple[List[_FirmaRegla], Set[Any]]] = {}
+    for lista_key in ("abonos", "cargos"):
+        viejas = _sin_duplicados(anterior.firmas.get(lista_key, []))
+        nuevas = _sin_duplicados(nuevo.firmas.get(lista_key, []))
+        set_viejas, set_nuevas = set(viejas), set(nuevas)
+        comunes_antes = [f for f in viejas if f in set_nuevas]
+        comunes_despues = [f for f in nuevas if f in set_viejas]
+        if comunes_antes != comunes_despues:
+            return None
+        agregadas = [f for f in nuevas if f not in set_viejas]
+        eliminadas = {f[0] for f in viejas if f not in set_nuevas}
+        out[lista_key] = (agregadas, eliminadas)
+    return out
+
+
+def reclasificar_incremental(
+    df: pd.DataFrame,
+    anterior: Optional[ClasificadorCompilado],
+    nuevo: ClasificadorCompilado,
+    *,
+    normalizado: bool = False,
+    col_texto: str = "COMENTARIO",
+    col_abono: str = "ABONOS (CLP)",
+    col_clasificacion: str = "CLASIFICACION",
+) -> int:
+    """
+    Actualiza ``df[col_clasificacion]`` (in place) pasando de ``anterior`` a ``nuevo``.
+    Solo re-evalúa filas cuyo resultado puede cambiar: las que contienen alguna palabra clave de
+    una regla nueva/modificada y las que estaban asignadas a una regla eliminada.
+    Requiere que la columna actual sea el resultado de ``anterior``; si no hay ``anterior`` o
+    el cambio no es incremental, clasifica todo. Devuelve la cantidad de filas re-evaluadas.
+    """
+    abonos = df[col_abono] if col_abono in df.columns else 0
+    diff = diferencias_reglas(anterior, nuevo) if anterior is not None and col_clasificacion in df.columns else None
+    if diff is None:
+        df[col_clasificacion] = nuevo.classify_series(df[col_texto], abonos, normalizado=normalizado)
+        df.attrs[ATTR_CLASIFICADO_CON] = nuevo.token
+        return len(df)
+
+    textos = normalizar_columna(df[col_texto], ya_normalizado=normalizado)
+    es_abono = _mascara_abonos(abonos, len(df))
+    codigos, unicos = pd.factorize(textos)
+    unicos_s = pd.Series(unicos, dtype=object)
+
+    afectadas = [False] * len(df)
+    actuales = df[col_clasificacion].tolist()
+    for lista_key, lista_es_abono in (("abonos", True), ("cargos", False)):
+        agregadas, eliminadas = diff[lista_key]
+        if not agregadas and not eliminadas:
+            continue
+        todas = False
+        palabras: Set[str] = set()
+        for _, tipo, claves, _ in agregadas:
+            if tipo == TIPO_EXACTO and not claves:
+                todas = True
+            elif tipo in (TIPO_EXACTO, TIPO_CUALQUIERA):
+                palabras |= claves
+        if "" in palabras:
+            todas = True
+        hit_unicos = [todas] * len(unicos_s)
+        if not todas and palabras:
+            mascara = pd.Series(False, index=unicos_s.index)
+            for palabra in palabras:
+                mascara |= unicos_s.str.contains(palabra, regex=False, na=False)
+            hit_unicos = mascara.tolist()
+        for i, (ab, cod) in enumerate(zip(es_abono, codigos)):
+            if ab != lista_es_abono or afectadas[i]:
+                continue
+            if (cod >= 0 and hit_unicos[cod]) or (eliminadas and actuales[i] in eliminadas):
+                afectadas[i] = True
+
+    idx = [i for i, a in enumerate(afectadas) if a]
+    if idx:
+        if isinstance(df[col_clasificacion].dtype, pd.CategoricalDtype):
+            # Las clases nuevas no están entre las categorías existentes
+            df[col_clasificacion] = df[col_clasificacion].astype(object)
+        df.iloc[idx, df.columns.get_loc(col_clasificacion)] = nuevo.classify_series(
+            textos.iloc[idx], abonos.iloc[idx] if isinstance(abonos, pd.Series) else abonos, normalizado=True
+        ).to_numpy()
+    df.attrs[ATTR_CLASIFICADO_CON] = nuevo.token
+    return len(idx)
+
+
+def clasificar_dataframe(
+    df: pd.DataFrame,
+    clasificador: ClasificadorCompilado,
+    *,
+    normalizado: bool = False,
+    col_texto: str = "COMENTARIO",
+    col_abono: str = "ABONOS (CLP)",
+    col_clasificacion: str = "CLASIFICACION",
+) -> int:
+    """
+    Clasifica ``df`` in place con ``clasificador``. Si ``df.attrs`` indica que ya fue clasificado
+    con ese mismo compilado no hace nada; si fue con otro que aún está en memoria, re-evalúa
+    solo las filas afectadas por la diferencia de reglas. Devuelve las filas re-evaluadas.
+    """
+    token_previo = df.attrs.get(ATTR_CLASIFICADO_CON)
+    if token_previo == clasificador.token and col_clasificacion in df.columns:
+        return 0
+    anterior = _compilados_por_token.get(token_previo) if token_previo is not None else None
+    return reclasificar_incremental(
+        df, anterior, clasificador,
+        normalizado=normalizado, col_texto=col_texto, col_abono=col_abono, col_clasificacion=col_clasificacion,
+    )
+
+
+@dataclass(frozen=True)
+class ReglasUsuario:
+    """Config fusionada (base + BD) de un usuario y su clasificador compilado. No mutar ``config``."""
+
+    config: Optional[Dict[str, Any]]
+    compilado: ClasificadorCompilado
+    cantidad_bd: int
+
+
+class _CacheClasificadores:
+    """
+    LRU de proceso con las reglas compiladas por usuario.
+    Clave: (usuario_id, huella de clasificadores en BD, mtime de la config base).
+    Cada llamada consulta la huella (una consulta indexada) y hace un ``stat``: así se ven
+    también las reglas creadas, editadas o borradas desde otro proceso.
+    """
+
+    def __init__(self, max_entradas: int = 32, max_adhoc: int = 8):
+        self._lock = threading.Lock()
+        self._lru: "OrderedDict[Tuple[Any, ...], ReglasUsuario]" = OrderedDict()
+        # Configs editadas en sesión (no vienen de la BD): id(config) -> compilado
+        self._adhoc: "OrderedDict[int, ClasificadorCompilado]" = OrderedDict()
+        self.max_entradas = max_entradas
+        self.max_adhoc = max_adhoc
+
+    def obtener(
+        self,
+        usuario_id: int,
+        ruta_config_base: Optional[Union[str, Path]],
+        construir: Callable[[], Tuple[Optional[Dict[str, Any]], int]],
+    ) -> ReglasUsuario:
+        """
+        Devuelve las reglas del usuario; ``construir`` (lee BD + config base y fusiona) solo
+        se invoca cuando cambió la huella. Debe devolver ``(config_fusionada, cantidad_bd)``.
+        """
+        clave = (usuario_id, crud.huella_clasificadores(usuario_id), _mtime(ruta_config_base))
+        with self._lock:
+            entrada = self._lru.get(clave)
+        if entrada is None:
+            config, cantidad_bd = construir()
+            entrada = ReglasUsuario(config, ClasificadorCompilado(config), cantidad_bd)
+
+        with self._lock:
+            self._lru[clave] = entrada
+            self._lru.move_to_end(clave)
+            while len(self._lru) > self.max_entradas:
+                self._lru.popitem(last=False)
+        return entrada
+
+    def compilar(self, config: Optional[Mapping[str, Any]]) -> ClasificadorCompilado:
+        """Reutiliza el compilado si ``config`` es el mismo objeto ya compilado (por identidad)."""
+        with self._lock:
+            for entrada in self._lru.values():
+                if entrada.config is config:
+                    return entrada.compilado
+            previo = self._adhoc.get(id(config))
+            if previo is not None and previo.config is config:
+                self._adhoc.move_to_end(id(config))
+                return previo
+        compilado = ClasificadorCompilado(config)
+        with self._lock:
+            # El compilado mantiene viva la config, así id(config) no se reutiliza mientras esté aquí
+            self._adhoc[id(config)] = compilado
+            while len(self._adhoc) > self.max_adhoc:
+                self._adhoc.popitem(last=False)
+        return compilado
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._lru.clear()
+            self._adhoc.clear()
+
+
+def _mtime(ruta: Optional[Union[str, Path]]) -> Optional[float]:
+    if ruta is None:
+        return None
+    try:
+        return Path(ruta).stat().st_mtime
+    except OSError:
+        return None
+
+
+_cache_clasificadores = _CacheClasificadores()
+
+
+def obtener_reglas_usuario(
+    usuario_id: int,
+    ruta_config_base: Optional[Union[str, Path]],
+    construir: Callable[[], Tuple[Optional[Dict[str, Any]], int]],
+) -> ReglasUsuario:
+    """Reglas fusionadas y compiladas del usuario desde la caché de proceso."""
+    return _cache_clasificadores.obtener(usuario_id, ruta_config_base, construir)
+
+
+def compilar_clasificadores(config_clasificadores: Optional[Mapping[str, Any]]) -> ClasificadorCompilado:
+    """
+    Compila la config de clasificadores (formato ``fusionar_configs_clasificadores``).
+    Si la config ya fue compilada (misma instancia), devuelve el compilado en caché.
+    """
+    return _cache_clasificadores.compilar(config_clasificadores)
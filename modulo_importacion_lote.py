@@ -0,0 +1,249 @@
+"""
+Importación de varias cartolas de una vez (archivos sueltos o un ZIP).
+Leer el Excel y clasificar es CPU en Python puro, así que cada archivo se procesa en un
+ProcessPoolExecutor compartido por todas las importaciones del proceso (se crea al primer uso
+y acota los workers en total, no por trabajo). El clasificador compilado viaja una sola vez a
+cada worker: las tareas lo nombran por su token y el worker lo guarda; la primera tanda lo lleva
+(una tarea por worker) y, si un worker igual no lo tiene, esa tarea se reenvía con él. Hay a lo
+sumo un archivo en curso por worker. Vuelven los DataFrames ya clasificados. El guardado queda
+en el proceso principal con
+el camino en bloque de guardar_transacciones_dataframe (una transacción por archivo).
+"""
+from __future__ import annotations
+
+import io
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass
+from pathlib import PurePosixPath
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from database.crud import guardar_transacciones_dataframe, obtener_archivo_por_hash
+from modulo_cartola import hash_contenido, leer_cartola
+from modulo_clasificador import ATTR_CLASIFICADO_CON, CLASIFICACION_DEFAULT, ClasificadorCompilado, clasificar_dataframe
+from modulo_jobs import reportar_progreso
+
+
+def _cpus_disponibles() -> int:
+    """CPUs que puede usar este proceso (respeta afinidad / cgroups), no las de la máquina."""
+    try:
+        return len(os.sched_getaffinity(0)) or 1
+    except AttributeError:  # sched_getaffinity no existe fuera de Linux
+        return os.cpu_count() or 1
+
+
+# Workers del pool compartido: es el tope para todas las importaciones simultáneas juntas
+IMPORTACION_WORKERS = int(os.getenv("FLUJO_CAJA_IMPORTACION_WORKERS", str(min(2, _cpus_disponibles()))))
+EXTENSIONES_CARTOLA = (".xlsx", ".xls")
+
+
+@dataclass
+class ResultadoImportacionArchivo:
+    nombre_archivo: str
+    estado: str  # guardado / duplicado / formato / error
+    transacciones: int = 0
+    sin_clasificar: int = 0
+    archivo_id: Optional[int] = None
+    detalle: str = ""
+
+
+def expandir_archivos(archivos: Iterable[Tuple[str, bytes]]) -> List[Tuple[str, bytes]]:
+    """(nombre, contenido) de cada cartola; los ZIP se abren y aportan sus Excel (sin carpetas ocultas)."""
+    out: List[Tuple[str, bytes]] = []
+    for nombre, datos in archivos:
+        if not nombre.lower().endswith(".zip"):
+            out.append((nombre, datos))
+            continue
+        with zipfile.ZipFile(io.BytesIO(datos)) as zf:
+            for info in zf.infolist():
+                ruta = PurePosixPath(info.filename)
+                if info.is_dir() or any(p.startswith((".", "__MACOSX")) for p in ruta.parts):
+                    continue
+                if ruta.suffix.lower() in EXTENSIONES_CARTOLA:
+                    out.append((ruta.name, zf.read(info)))
+    return out
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+# Tareas enviadas al pool actual con cada clasificador (token): pasado el tamaño del pool se asume
+# que todos los workers lo tienen; si alguno no, la tarea vuelve y se reenvía con él
+_envios_clasificador: Dict[int, int] = {}
+
+
+def _obtener_pool() -> ProcessPoolExecutor:
+    """Pool de procesos del módulo, creado al primer uso y compartido entre importaciones."""
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                # spawn y no fork: el proceso de Streamlit tiene hilos y conexiones de BD abiertas
+                _pool = ProcessPoolExecutor(
+                    max_workers=max(1, IMPORTACION_WORKERS),
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                _envios_clasificador.clear()
+    return _pool
+
+
+def _descartar_pool(pool: ProcessPoolExecutor) -> None:
+    """Un worker murió (BrokenProcessPool): el próximo uso crea un pool nuevo."""
+    global _pool
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _leer_y_clasificar(
+    datos: bytes, clasificador: ClasificadorCompilado
+) -> Tuple[Optional[pd.DataFrame], List[str]]:
+    """DataFrame clasificado, o (None, columnas faltantes) si el archivo no es una cartola."""
+    lectura = leer_cartola(datos)
+    if not lectura.ok:
+        return None, lectura.faltantes
+    df = lectura.df
+    clasificar_dataframe(df, clasificador, normalizado=True)
+    return df, []
+
+
+# Clasificadores recibidos por el proceso worker, por token del proceso principal (LRU chico)
+CLASIFICADORES_POR_WORKER = 4
+_clasificadores_worker: "OrderedDict[int, ClasificadorCompilado]" = OrderedDict()
+
+
+class _ClasificadorNoCargado(Exception):
+    """El worker no tiene ese clasificador: hay que reenviar la tarea con él."""
+
+
+def _leer_y_clasificar_en_worker(
+    datos: bytes, token: int, clasificador: Optional[ClasificadorCompilado] = None
+) -> Tuple[Optional[pd.DataFrame], List[str]]:
+    clf = _clasificadores_worker.get(token)
+    if clf is None:
+        if clasificador is None:
+            raise _ClasificadorNoCargado(token)
+        clf = _clasificadores_worker[token] = clasificador
+        while len(_clasificadores_worker) > CLASIFICADORES_POR_WORKER:
+            _clasificadores_worker.popitem(last=False)
+    _clasificadores_worker.move_to_end(token)
+    return _leer_y_clasificar(datos, clf)
+
+
+def importar_cartolas(
+    usuario_id: int,
+    archivos: Iterable[Tuple[str, bytes]],
+    clasificador: ClasificadorCompilado,
+    *,
+    max_workers: Optional[int] = None,
+    al_avanzar: Optional[Callable[[int, int, ResultadoImportacionArchivo], None]] = None,
+) -> List[ResultadoImportacionArchivo]:
+    """
+    Lee, clasifica y guarda varias cartolas. Las ya guardadas (mismo SHA-256) o repetidas en el
+    lote se omiten. Retorna un resultado por archivo, en el orden de entrada;
+    ``al_avanzar(hechos, total, resultado)`` se llama al terminar cada uno.
+
+    Ejemplo:
+        resultados = importar_cartolas(1, [("enero.xlsx", datos)], compilar_clasificadores(config))
+    """
+    archivos = expandir_archivos(archivos)
+    total = len(archivos)
+    resultados: Dict[int, ResultadoImportacionArchivo] = {}
+
+    def _registrar(i: int, resultado: ResultadoImportacionArchivo) -> None:
+        resultados[i] = resultado
+        if al_avanzar:
+            al_avanzar(len(resultados), total, resultado)
+
+    pendientes: List[Tuple[int, str, bytes, str]] = []
+    hashes_lote = set()
+    for i, (nombre, datos) in enumerate(archivos):
+        h = hash_contenido(datos)
+        existente = obtener_archivo_por_hash(usuario_id, h)
+        if existente is not None or h in hashes_lote:
+            detalle = f"Ya guardada como {existente.nombre_archivo}" if existente else "Repetida en el lote"
+            _registrar(i, ResultadoImportacionArchivo(nombre, "duplicado", detalle=detalle))
+            continue
+        hashes_lote.add(h)
+        pendientes.append((i, nombre, datos, h))
+
+    def _guardar(i: int, nombre: str, h: str, df: Optional[pd.DataFrame], faltantes: List[str]) -> None:
+        if df is None:
+            _registrar(i, ResultadoImportacionArchivo(
+                nombre, "formato", detalle=f"Faltan columnas: {', '.join(faltantes)}"
+            ))
+            return
+        # El token de clasificación es del proceso worker; aquí no identifica nada
+        df.attrs.pop(ATTR_CLASIFICADO_CON, None)
+        total_guardadas, archivo_id = guardar_transacciones_dataframe(
+            df, usuario_id=usuario_id, nombre_archivo=nombre, hash_contenido=h
+        )
+        sin_clasificar = int(df["CLASIFICACION"].isin([None, "", CLASIFICACION_DEFAULT]).sum())
+        _registrar(i, ResultadoImportacionArchivo(
+            nombre, "guardado", transacciones=total_guardadas, sin_clasificar=sin_clasificar, archivo_id=archivo_id
+        ))
+
+    def _guardar_seguro(i: int, nombre: str, h: str, leer: Callable[[], Tuple[Optional[pd.DataFrame], List[str]]]) -> None:
+        try:
+            df, faltantes = leer()
+            _guardar(i, nombre, h, df, faltantes)
+        except Exception as ex:
+            _registrar(i, ResultadoImportacionArchivo(nombre, "error", detalle=str(ex) or type(ex).__name__))
+
+    workers = min(max_workers or IMPORTACION_WORKERS, len(pendientes))
+    if workers <= 1:
+        for i, nombre, datos, h in pendientes:
+            _guardar_seguro(i, nombre, h, lambda d=datos: _leer_y_clasificar(d, clasificador))
+    else:
+        pool = _obtener_pool()
+        tamano_pool = max(1, IMPORTACION_WORKERS)
+        token = clasificador.token
+        cola = list(pendientes)
+        futuros: Dict[Future, Tuple[int, str, str, bytes]] = {}
+
+        def _enviar(i: int, nombre: str, datos: bytes, h: str, con_clasificador: bool) -> None:
+            if con_clasificador:
+                _envios_clasificador[token] = _envios_clasificador.get(token, 0) + 1
+                futuro = pool.submit(_leer_y_clasificar_en_worker, datos, token, clasificador)
+            else:
+                futuro = pool.submit(_leer_y_clasificar_en_worker, datos, token)
+            futuros[futuro] = (i, nombre, h, datos)
+
+        while cola or futuros:
+            while cola and len(futuros) < workers:
+                i, nombre, datos, h = cola.pop(0)
+                _enviar(i, nombre, datos, h, _envios_clasificador.get(token, 0) < tamano_pool)
+            hechos, _ = wait(list(futuros), return_when=FIRST_COMPLETED)
+            for futuro in hechos:
+                i, nombre, h, datos = futuros.pop(futuro)
+                ex = futuro.exception()
+                if isinstance(ex, _ClasificadorNoCargado):
+                    # Ese worker aún no lo tiene: la misma tarea, ahora con el clasificador
+                    _enviar(i, nombre, datos, h, True)
+                    continue
+                if isinstance(ex, BrokenProcessPool):
+                    _descartar_pool(pool)
+                    for j, nombre_j, _, _ in cola:
+                        _registrar(j, ResultadoImportacionArchivo(nombre_j, "error", detalle=type(ex).__name__))
+                    cola.clear()
+                _guardar_seguro(i, nombre, h, futuro.result)
+
+    return [resultados[i] for i in sorted(resultados)]
+
+
+def tarea_importar_cartolas(
+    usuario_id: int, archivos: List[Tuple[str, bytes]], clasificador: ClasificadorCompilado
+) -> Dict[str, Any]:
+    """importar_cartolas como trabajo en segundo plano (ver modulo_jobs), con avance por archivo."""
+    def _avance(hechos: int, total: int, resultado: ResultadoImportacionArchivo) -> None:
+        reportar_progreso(hechos / total if total else 1.0, f"{hechos}/{total} · {resultado.nombre_archivo}")
+
+    resultados = importar_cartolas(usuario_id, archivos, clasificador, al_avanzar=_avance)
+    return {"archivos": [asdict(r) for r in resultados]}
@@ -0,0 +1,180 @@
+"""
+Cola de trabajos en segundo plano dentro del proceso de Streamlit.
+Las operaciones largas (generar snapshot, cargar Excel de CxC/CxP/remuneraciones, guardar
+una cartola) se envían a un pool de hilos acotado y quedan registradas en la tabla ``jobs``;
+el script no se bloquea y el avance se consulta en cada rerun (``render_estado_job``).
+
+El pool es de hilos y no de procesos: las tareas pasan casi todo el tiempo en la BD y en
+pandas (que libera el GIL), y así comparten las cachés del proceso. El límite de hilos
+(FLUJO_CAJA_JOBS_WORKERS) y de trabajos activos por usuario evita que varios usuarios
+a la vez saturen la CPU.
+"""
+from __future__ import annotations
+
+import json
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from database import crud
+from database.crud import ESTADOS_JOB_ACTIVOS
+
+JOBS_WORKERS = int(os.getenv("FLUJO_CAJA_JOBS_WORKERS", "2"))
+JOBS_POR_USUARIO = int(os.getenv("FLUJO_CAJA_JOBS_POR_USUARIO", "3"))
+# Cada cuántos segundos la UI vuelve a consultar un trabajo en curso
+INTERVALO_SONDEO_S = float(os.getenv("FLUJO_CAJA_JOBS_SONDEO_S", "2"))
+# Trabajos activos de otro host: se dan por perdidos pasadas estas horas (no se puede ver su pid)
+HORAS_JOB_HUERFANO = float(os.getenv("FLUJO_CAJA_JOBS_HORAS_HUERFANO", "12"))
+
+# Identifica al proceso dueño de los trabajos que encola (varias réplicas comparten la tabla)
+PROCESO_ACTUAL = f"{socket.gethostname()}:{os.getpid()}"
+
+_pool: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+_job_actual: ContextVar[Optional[int]] = ContextVar("_job_actual", default=None)
+
+
+def _proceso_terminado(proceso: Optional[str], creado_en: Optional[datetime]) -> bool:
+    """True si el proceso "host:pid" ya no existe (en este host se pregunta al SO por el pid)."""
+    if proceso is None:
+        return True  # trabajos de antes de registrar el proceso
+    host, _, pid = proceso.rpartition(":")
+    if host != socket.gethostname():
+        return creado_en is not None and datetime.now() - creado_en > timedelta(hours=HORAS_JOB_HUERFANO)
+    if proceso == PROCESO_ACTUAL:
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except (PermissionError, ValueError):
+        return False
+    return False
+
+
+def _obtener_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                # Los activos de procesos que ya no existen no los va a terminar nadie
+                muertos = [p for p, creado in crud.listar_procesos_jobs_activos() if _proceso_terminado(p, creado)]
+                crud.marcar_jobs_interrumpidos(muertos)
+                _pool = ThreadPoolExecutor(max_workers=max(1, JOBS_WORKERS), thread_name_prefix="flujo-caja-job")
+    return _pool
+
+
+def reportar_progreso(progreso: Optional[float] = None, mensaje: Optional[str] = None) -> None:
+    """
+    Avance del trabajo en ejecución (0..1 y/o texto). Fuera de un trabajo no hace nada,
+    así las funciones de carga pueden llamarlo siempre.
+    """
+    job_id = _job_actual.get()
+    if job_id is None:
+        return
+    crud.actualizar_job(
+        job_id,
+        progreso=None if progreso is None else min(max(float(progreso), 0.0), 1.0),
+        mensaje=None if mensaje is None else str(mensaje)[:255],
+    )
+
+
+def _ejecutar(job_id: int, funcion: Callable[..., Dict[str, Any]], args: tuple, kwargs: dict) -> None:
+    token = _job_actual.set(job_id)
+    crud.actualizar_job(job_id, estado="en_curso", iniciado_en=datetime.now())
+    try:
+        resultado = funcion(*args, **kwargs)
+        crud.actualizar_job(
+            job_id,
+            estado="completado",
+            progreso=1.0,
+            resultado=json.dumps(resultado or {}, default=str),
+            terminado_en=datetime.now(),
+        )
+    except Exception as ex:
+        crud.actualizar_job(job_id, estado="error", error=str(ex) or type(ex).__name__, terminado_en=datetime.now())
+    finally:
+        _job_actual.reset(token)
+
+
+def enviar_job(
+    usuario_id: int,
+    tipo: str,
+    funcion: Callable[..., Dict[str, Any]],
+    *args: Any,
+    descripcion: Optional[str] = None,
+    huella: Optional[str] = None,
+    **kwargs: Any,
+) -> int:
+    """
+    Registra el trabajo y lo encola; retorna el id para consultarlo en reruns siguientes.
+    ``funcion(*args, **kwargs)`` debe retornar un dict serializable a JSON (p. ej. {"carga_id": 12}).
+    ``huella`` identifica el contenido enviado (p. ej. el SHA-256 del archivo): si ya hay un
+    trabajo activo del mismo tipo con la misma huella se retorna ese id (doble clic); si la
+    huella es otra (o no hay), ValueError: ese tipo ya está en curso.
+
+    Ejemplo:
+        job_id = enviar_job(user_id, "snapshot", _tarea_snapshot, user_id, 90, huella=h)
+        st.session_state["job_snapshot"] = job_id
+    """
+    pool = _obtener_pool()
+    activos = crud.listar_jobs_activos(usuario_id)
+    for job in activos:
+        if job.tipo == tipo:
+            if huella is not None and job.huella == huella:
+                return job.id
+            raise ValueError("Ya hay un trabajo en curso de este tipo; espera a que termine.")
+    if len(activos) >= JOBS_POR_USUARIO:
+        raise ValueError(f"Ya hay {len(activos)} trabajos en curso; espera a que terminen.")
+    job = crud.crear_job(usuario_id, tipo, descripcion=descripcion, huella=huella, proceso=PROCESO_ACTUAL)
+    pool.submit(_ejecutar, job.id, funcion, args, kwargs)
+    return job.id
+
+
+def resultado_job(job: Any) -> Dict[str, Any]:
+    """Resultado (dict) de un trabajo completado."""
+    return json.loads(job.resultado) if job is not None and job.resultado else {}
+
+
+def render_estado_job(
+    clave: str,
+    usuario_id: int,
+    titulo: str,
+    al_terminar: Callable[[Dict[str, Any]], None],
+) -> None:
+    """
+    Muestra el trabajo guardado en ``st.session_state[clave]``. Mientras está activo, un
+    fragmento con st.status se refresca solo cada INTERVALO_SONDEO_S segundos; al terminar
+    relanza el script y, en ese rerun, llama una vez ``al_terminar(resultado)`` (o muestra el error).
+    """
+    import streamlit as st
+
+    job_id = st.session_state.get(clave)
+    if job_id is None:
+        return
+    job = crud.obtener_job(job_id, usuario_id=usuario_id)
+    if job is None:
+        st.session_state.pop(clave, None)
+        return
+    if job.estado not in ESTADOS_JOB_ACTIVOS:
+        st.session_state.pop(clave, None)
+        if job.estado == "completado":
+            al_terminar(resultado_job(job))
+        else:
+            st.error(f"{titulo}: {job.error or 'el trabajo falló'}")
+        return
+
+    @st.fragment(run_every=INTERVALO_SONDEO_S)
+    def _sondeo() -> None:
+        actual = crud.obtener_job(job_id, usuario_id=usuario_id)
+        if actual is None or actual.estado not in ESTADOS_JOB_ACTIVOS:
+            st.rerun()
+        with st.status(titulo, state="running", expanded=True):
+            texto = actual.mensaje or ("En cola…" if actual.estado == "pendiente" else "Procesando…")
+            st.progress(float(actual.progreso or 0.0), text=texto)
+
+    _sondeo()
@@ -0,0 +1,206 @@
+"""
+Lectura de Excel por lotes con openpyxl en modo read-only (streaming).
+``pd.read_excel`` materializa la hoja completa como listas de celdas antes de armar el
+DataFrame; aquí las filas se recorren una vez y se entregan en lotes (por defecto 5.000),
+así la memoria máxima depende del tamaño del lote y no del archivo.
+
+Las celdas se convierten igual que el lector openpyxl de pandas (vacías → "", enteros
+guardados como float → int), las filas se rellenan hasta la fila más ancha de la hoja
+(también las anteriores al encabezado) y cada lote pasa por el mismo parser de texto, de modo
+que ``leer_excel_por_lotes`` entrega lo mismo que ``pd.read_excel(..., header=n)``, incluidas
+las columnas "Unnamed: i" y el ValueError si la fila de encabezado está fuera de la hoja.
+``leer_excel_por_lotes`` igual arma el resultado completo: acota la memoria del parseo, no la
+del DataFrame final. Archivos .xls (no zip) no se pueden leer en streaming y caen a ``pd.read_excel``.
+"""
+from __future__ import annotations
+
+import io
+import os
+from pathlib import Path
+from typing import Any, BinaryIO, Iterator, List, Optional, Union
+
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+FuenteExcel = Union[str, Path, bytes, BinaryIO]
+
+TAMANO_LOTE_EXCEL = int(os.getenv("FLUJO_CAJA_LOTE_EXCEL", "5000"))
+
+
+def _abrir(fuente: FuenteExcel) -> Union[str, Path, BinaryIO]:
+    if isinstance(fuente, (bytes, bytearray)):
+        return io.BytesIO(fuente)
+    return fuente
+
+
+def es_xlsx(fuente: FuenteExcel) -> bool:
+    """True si el contenido es un libro OOXML (zip), legible por openpyxl en modo read-only."""
+    if isinstance(fuente, (bytes, bytearray)):
+        return bytes(fuente[:2]) == b"PK"
+    if isinstance(fuente, (str, Path)):
+        with open(fuente, "rb") as f:
+            return f.read(2) == b"PK"
+    pos = fuente.tell()
+    firma = fuente.read(2)
+    fuente.seek(pos)
+    return firma == b"PK"
+
+
+def _convertir_celda(valor: Any) -> Any:
+    # Igual que pandas (OpenpyxlReader._convert_cell) con values_only
+    if valor is None:
+        return ""
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    return valor
+
+
+def iterar_filas_excel(fuente: FuenteExcel, *, hoja: Union[int, str, None] = 0) -> Iterator[List[Any]]:
+    """
+    Filas de la hoja como listas de valores, sin celdas vacías al final de cada fila.
+    Las filas vacías intermedias se entregan como []; las del final de la hoja se omiten.
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(_abrir(fuente), read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb.worksheets[hoja or 0] if not isinstance(hoja, str) else wb[hoja]
+        vacias_pendientes = 0
+        for fila in ws.iter_rows(values_only=True):
+            valores = [_convertir_celda(v) for v in fila]
+            while valores and valores[-1] == "":
+                valores.pop()
+            if not valores:
+                vacias_pendientes += 1
+                continue
+            for _ in range(vacias_pendientes):
+                yield []
+            vacias_pendientes = 0
+            yield valores
+    finally:
+        wb.close()
+
+
+def leer_cabeza_excel(fuente: FuenteExcel, *, hoja: Union[int, str, None] = 0, filas: int = 30) -> pd.DataFrame:
+    """
+    Primeras ``filas`` filas como grilla cruda (como ``read_excel(header=None, dtype=object)``),
+    para detectar la fila de encabezados sin leer el resto del archivo.
+    """
+    if not es_xlsx(fuente):
+        return pd.read_excel(_abrir(fuente), sheet_name=hoja or 0, header=None, dtype=object, nrows=filas)
+    cabeza: List[List[Any]] = []
+    for valores in iterar_filas_excel(fuente, hoja=hoja):
+        cabeza.append(valores)
+        if len(cabeza) >= filas:
+            break
+    if not cabeza:
+        return pd.DataFrame()
+    ancho = max(len(v) for v in cabeza)
+    return TextParser([v + [""] * (ancho - len(v)) for v in cabeza], header=None, dtype=object).read()
+
+
+def _lote_a_dataframe(
+    encabezado: List[Any], filas: List[List[Any]], ancho_minimo: int, inferir_tipos: bool
+) -> pd.DataFrame:
+    # Al menos una columna: un encabezado vacío con filas vacías debajo sigue contando filas
+    ancho = max([ancho_minimo, len(encabezado), 1] + [len(f) for f in filas])
+    datos = [encabezado + [""] * (ancho - len(encabezado))]
+    datos.extend(f + [""] * (ancho - len(f)) for f in filas)
+    if not inferir_tipos:
+        # Celdas sin convertir: el parser con dtype=object igualaría True y 1 dentro de una columna
+        columnas = TextParser(datos[:1], header=0, skip_blank_lines=False).read().columns
+        return pd.DataFrame(datos[1:], columns=columnas, dtype=object)
+    # Mismas opciones que read_excel: las filas vacías se conservan como filas de NaN
+    return TextParser(datos, header=0, skip_blank_lines=False).read()
+
+
+def iterar_lotes_excel(
+    fuente: FuenteExcel,
+    *,
+    hoja: Union[int, str, None] = 0,
+    fila_header: int = 0,
+    tamano_lote: Optional[int] = None,
+    inferir_tipos: bool = True,
+) -> Iterator[pd.DataFrame]:
+    """
+    DataFrames de hasta ``tamano_lote`` filas, con los mismos nombres de columna que
+    ``read_excel(header=fila_header)``. Cada lote llega hasta la fila más ancha leída hasta él,
+    así que un lote posterior puede traer columnas "Unnamed: i" extra al final (el último las
+    trae todas). Con ``inferir_tipos`` los tipos se infieren por lote (una columna mixta puede
+    salir numérica en un lote y object en otro); sin él, las celdas quedan sin convertir
+    (object, vacías como "") para inferir los tipos después.
+    ValueError si la hoja no llega a ``fila_header``, como read_excel.
+
+    Ejemplo:
+        for lote in iterar_lotes_excel(data, fila_header=2):
+            procesar(lote)
+    """
+    tamano = tamano_lote or TAMANO_LOTE_EXCEL
+    if not es_xlsx(fuente):
+        df = pd.read_excel(
+            _abrir(fuente), sheet_name=hoja or 0, header=fila_header, dtype=None if inferir_tipos else object
+        )
+        for inicio in range(0, len(df), tamano):
+            yield df.iloc[inicio:inicio + tamano]
+        return
+
+    encabezado: Optional[List[Any]] = None
+    lote: List[List[Any]] = []
+    ancho = 0  # fila más ancha leída, incluidas las anteriores al encabezado (read_excel rellena a todas)
+    lineas = 0
+    for n, valores in enumerate(iterar_filas_excel(fuente, hoja=hoja)):
+        lineas = n + 1
+        ancho = max(ancho, len(valores))
+        if n < fila_header:
+            continue
+        if encabezado is None:
+            encabezado = valores
+            continue
+        lote.append(valores)
+        if len(lote) >= tamano:
+            yield _lote_a_dataframe(encabezado, lote, ancho, inferir_tipos)
+            lote = []
+    if lineas == 0:
+        return  # hoja vacía: read_excel entrega un DataFrame vacío
+    if encabezado is None:
+        raise ValueError(f"fila_header={fila_header} está fuera de la hoja (solo {lineas} filas)")
+    yield _lote_a_dataframe(encabezado, lote, ancho, inferir_tipos)
+
+
+def _inferir_tipos_columna(valores: pd.Series) -> pd.Series:
+    # Misma inferencia que read_excel aplica a la columna completa (números, fechas, booleanos)
+    if valores.empty:
+        return valores
+    return (
+        TextParser([[v] for v in valores.tolist()], header=None, skip_blank_lines=False)
+        .read()[0]
+        .set_axis(valores.index)
+    )
+
+
+def leer_excel_por_lotes(
+    fuente: FuenteExcel,
+    *,
+    hoja: Union[int, str, None] = 0,
+    fila_header: int = 0,
+    tamano_lote: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Equivalente a ``pd.read_excel(..., header=fila_header)``: las filas se leen por lotes
+    (sin guardar la hoja completa como listas de celdas) y los tipos se infieren al final,
+    columna por columna, sobre la columna completa. El DataFrame resultante sí es completo.
+    """
+    partes = list(
+        iterar_lotes_excel(fuente, hoja=hoja, fila_header=fila_header, tamano_lote=tamano_lote, inferir_tipos=False)
+    )
+    if not partes:
+        return pd.DataFrame()
+    # El último lote tiene todas las columnas; en los anteriores las que faltan son celdas vacías
+    if len(partes) > 1:
+        df = pd.concat(partes, ignore_index=True).reindex(columns=partes[-1].columns).fillna("")
+    else:
+        df = partes[0]
+    del partes
+    for i in range(df.shape[1]):
+        df.isetitem(i, _inferir_tipos_columna(df.iloc[:, i]))
+    return df
@@ -4,7 +4,6 @@ Persistencia: proyeccion_cargas (tipo remuneraciones) + proyeccion_remuneracione
 """
 from __future__ import annotations
 
-import io
 import re
 import unicodedata
 from dataclasses import dataclass, field
@@ -16,7 +15,17 @@ from typing import Any, BinaryIO, Dict, List, Mapping, Optional, Sequence, Tuple
 import pandas as pd
 
 from database import crud_proyeccion as crud_p
-from modulo_carga_erp import leer_excel_facturas, normalizar_nombres_columnas
+from modulo_carga_erp import normalizar_nombres_columnas
+from modulo_cartola import dataframe_desde_grilla, hash_contenido
+from modulo_lectura_excel import leer_cabeza_excel, leer_excel_por_lotes
+from modulo_uploads import (
+    ParsedUpload,
+    fuente_a_bytes,
+    guardar_upload_cacheado,
+    modo_header,
+    obtener_upload_cacheado,
+    verificar_opciones_parsed,
+)
 
 
 def _norm_text(s: str) -> str:
@@ -307,17 +316,6 @@ def detectar_mapeo_remuneraciones(
     return mapping
 
 
-def _remuneraciones_fuente_a_bytes(fuente: Union[str, Path, bytes, BinaryIO]) -> bytes:
-    if isinstance(fuente, bytes):
-        return fuente
-    if isinstance(fuente, (str, Path)):
-        return Path(fuente).read_bytes()
-    chunk = fuente.read()
-    if not isinstance(chunk, bytes):
-        return bytes(chunk)
-    return chunk
-
-
 def _remuneraciones_headers_look_reasonable(df_raw: pd.DataFrame) -> bool:
     good = 0
     for c in df_raw.columns:
@@ -369,23 +367,20 @@ def encontrar_mejor_encabezado_remuneraciones(
 ) -> tuple[int, pd.DataFrame, Dict[str, str]]:
     """
     Muchos Excel traen título o filas vacías antes del encabezado real.
-    Prueba header=0..max_fila y elige el mapeo con mejor puntuación.
+    Prueba header=0..max_fila sobre las primeras filas (leídas una vez) y elige el mapeo con
+    mejor puntuación; luego lee el libro completo por lotes con ese encabezado.
     """
     best_fh: Optional[int] = None
-    best_df: Optional[pd.DataFrame] = None
-    best_mapeo: Dict[str, str] = {}
     best_key: Tuple[int, int] = (-1, -1)
 
+    try:
+        cabeza = leer_cabeza_excel(fuente_bytes, hoja=hoja, filas=max(1, max_fila) + 1)
+    except Exception:
+        cabeza = pd.DataFrame()
+
+    # El puntaje depende solo de los encabezados: basta la cabeza de la hoja
     for fh in range(max(1, max_fila)):
-        try:
-            df_raw = pd.read_excel(
-                io.BytesIO(fuente_bytes),
-                sheet_name=hoja if hoja is not None else 0,
-                header=fh,
-                engine="openpyxl",
-            )
-        except Exception:
-            continue
+        df_raw = dataframe_desde_grilla(cabeza, fh)
         if df_raw is None or df_raw.shape[1] < 2:
             continue
         if not _remuneraciones_headers_look_reasonable(df_raw):
@@ -398,14 +393,14 @@ def encontrar_mejor_encabezado_remuneraciones(
         if key > best_key:
             best_key = key
             best_fh = fh
-            best_df = df
-            best_mapeo = mapeo
 
-    if best_df is None or best_fh is None:
+    if best_fh is None:
         raise ValueError(
             "No se encontró una fila de encabezados útil en las primeras filas del Excel. "
             "Revise que la primera hoja tenga columnas con nombres (no solo «Unnamed»)."
         )
+    best_df = preparar_df_remuneraciones_columnas(leer_excel_por_lotes(fuente_bytes, hoja=hoja, fila_header=best_fh))
+    best_mapeo = detectar_mapeo_remuneraciones(list(best_df.columns), preset=preset)
     return best_fh, best_df, best_mapeo
 
 
@@ -571,6 +566,49 @@ def dataframe_a_registros_remuneracion(
     return out, advertencias
 
 
+def parsear_excel_remuneraciones(
+    fuente: Union[str, Path, bytes, BinaryIO, ParsedUpload],
+    *,
+    preset: Optional[str] = None,
+    hoja: Union[int, str, None] = 0,
+    fila_header: int = 0,
+    auto_fila_header: bool = True,
+    max_fila_header: int = 15,
+) -> ParsedUpload:
+    """
+    Lee el libro una vez, elige la fila de encabezado (o usa ``fila_header``), normaliza columnas
+    y detecta el mapeo. Caché por hash del contenido + opciones; un ParsedUpload se devuelve tal cual.
+    """
+    if isinstance(fuente, ParsedUpload):
+        return fuente
+    raw = fuente_a_bytes(fuente)
+    modo = modo_header(auto_fila_header, fila_header, max_fila_header)
+    clave = ("remuneraciones", hash_contenido(raw), (preset or "generico").lower(), hoja, modo)
+    parsed = obtener_upload_cacheado(clave)
+    if parsed is not None:
+        return parsed
+    if auto_fila_header:
+        fh_usada, df, mapeo = encontrar_mejor_encabezado_remuneraciones(
+            raw, preset=preset, hoja=hoja, max_fila=max_fila_header
+        )
+    else:
+        fh_usada = fila_header
+        df = preparar_df_remuneraciones_columnas(leer_excel_por_lotes(raw, hoja=hoja, fila_header=fila_header))
+        mapeo = detectar_mapeo_remuneraciones(list(df.columns), preset=preset)
+    parsed = ParsedUpload(
+        hash_contenido=clave[1],
+        tipo="remuneraciones",
+        preset=preset,
+        hoja=hoja,
+        fila_header=fh_usada,
+        modo_header=modo,
+        df=df,
+        mapeo=mapeo,
+    )
+    guardar_upload_cacheado(clave, parsed)
+    return parsed
+
+
 @dataclass
 class ResultadoCargaRemuneraciones:
     carga_id: int
@@ -582,7 +620,7 @@ class ResultadoCargaRemuneraciones:
 
 
 def inspeccionar_excel_remuneraciones(
-    fuente: Union[str, Path, bytes],
+    fuente: Union[str, Path, bytes, ParsedUpload],
     *,
     preset: Optional[str] = None,
     hoja: Union[int, str, None] = 0,
@@ -590,18 +628,15 @@ def inspeccionar_excel_remuneraciones(
     auto_fila_header: bool = True,
     max_fila_header: int = 15,
 ) -> Dict[str, Any]:
-    fh_usada = fila_header
-    if auto_fila_header:
-        raw = _remuneraciones_fuente_a_bytes(fuente)
-        fh_usada, df, mapeo = encontrar_mejor_encabezado_remuneraciones(
-            raw, preset=preset, hoja=hoja, max_fila=max_fila_header
-        )
-        cols = list(df.columns)
-    else:
-        df_raw = leer_excel_facturas(fuente, hoja=hoja, fila_header=fila_header)
-        df = preparar_df_remuneraciones_columnas(df_raw)
-        cols = list(df.columns)
-        mapeo = detectar_mapeo_remuneraciones(cols, preset=preset)
+    parsed = parsear_excel_remuneraciones(
+        fuente,
+        preset=preset,
+        hoja=hoja,
+        fila_header=fila_header,
+        auto_fila_header=auto_fila_header,
+        max_fila_header=max_fila_header,
+    )
+    df, cols, mapeo = parsed.df, parsed.columnas, parsed.mapeo
     necesita_mes = "mes_aplicacion" not in mapeo
     faltantes: List[str] = []
     if "empleado" not in mapeo:
@@ -617,12 +652,14 @@ def inspeccionar_excel_remuneraciones(
         "mapeo_ok": "empleado" in mapeo and ("monto_liquido" in mapeo or "monto_bruto" in mapeo),
         "faltantes": faltantes,
         "muestra_filas": min(5, len(df)),
+        "fila_header": parsed.fila_header,
+        "parsed": parsed,
     }
 
 
 def cargar_excel_remuneraciones(
     user_id: int,
-    fuente: Union[str, Path, bytes, BinaryIO],
+    fuente: Union[str, Path, bytes, BinaryIO, ParsedUpload],
     nombre_archivo: str,
     *,
     preset_columnas: Optional[str] = None,
@@ -635,18 +672,23 @@ def cargar_excel_remuneraciones(
     max_fila_header: int = 15,
     origen: str = "upload_excel",
 ) -> ResultadoCargaRemuneraciones:
-    if auto_fila_header:
-        raw = _remuneraciones_fuente_a_bytes(fuente)
-        _fh, df, mapeo = encontrar_mejor_encabezado_remuneraciones(
-            raw,
+    if isinstance(fuente, ParsedUpload):
+        verificar_opciones_parsed(
+            fuente,
+            "remuneraciones",
             preset=preset_columnas,
             hoja=hoja,
-            max_fila=max_fila_header,
+            modo_header=modo_header(auto_fila_header, fila_header, max_fila_header),
         )
-    else:
-        df_raw = leer_excel_facturas(fuente, hoja=hoja, fila_header=fila_header)
-        df = preparar_df_remuneraciones_columnas(df_raw)
-        mapeo = detectar_mapeo_remuneraciones(list(df.columns), preset=preset_columnas)
+    parsed = parsear_excel_remuneraciones(
+        fuente,
+        preset=preset_columnas,
+        hoja=hoja,
+        fila_header=fila_header,
+        auto_fila_header=auto_fila_header,
+        max_fila_header=max_fila_header,
+    )
+    df, mapeo = parsed.df, parsed.mapeo
 
     if mes_aplicacion_default is not None and primer_dia_mes:
         mes_aplicacion_default = date(mes_aplicacion_default.year, mes_aplicacion_default.month, 1)
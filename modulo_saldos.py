@@ -0,0 +1,121 @@
+"""
+Motor único de "saldo cartola" (saldo corrido al cierre) para Tab 1 y Tab 2.
+Orden cronológico real: fecha ascendente y, dentro del mismo día, orden original descendente
+(las cartolas suelen listar arriba el último movimiento del día). El saldo informado por el banco
+actúa como ancla; entre anclas se propaga saldo + abonos − cargos de forma vectorizada.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import pandas as pd
+
+
+@dataclass
+class ResultadoSaldoCartola:
+    """Saldo al cierre, su fecha y la serie de saldo corrido (en orden cronológico, índice original)."""
+
+    saldo_cierre: Optional[float]
+    fecha_cierre: Optional[pd.Timestamp]
+    saldo_corrido: pd.Series
+    hay_saldo_real: bool
+    neto: float
+
+
+def serie_numerica(valores: Any) -> pd.Series:
+    """
+    Convierte una columna de montos a float. Acepta números y textos con formato
+    1.234.567,89 / 1,234,567.89 / $ 1.500; lo no interpretable queda NaN.
+    """
+    serie = valores if isinstance(valores, pd.Series) else pd.Series(valores)
+    if pd.api.types.is_numeric_dtype(serie.dtype) and not pd.api.types.is_bool_dtype(serie.dtype):
+        return serie.astype("float64")
+    directo = pd.to_numeric(serie, errors="coerce")
+    pendientes = directo.isna() & serie.notna()
+    if not pendientes.any():
+        return directo.astype("float64")
+    texto = serie[pendientes].astype(str).str.strip().str.replace("$", "", regex=False).str.replace(" ", "", regex=False)
+    coma = texto.str.rfind(",")
+    punto = texto.str.rfind(".")
+    ambos = (coma >= 0) & (punto >= 0)
+    decimal_coma = (ambos & (coma > punto)) | ((coma >= 0) & (punto < 0))
+    miles_coma = ambos & (coma < punto)
+    texto = texto.where(~decimal_coma, texto.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+    texto = texto.where(~miles_coma, texto.str.replace(",", "", regex=False))
+    directo = directo.astype("float64")
+    directo[pendientes] = pd.to_numeric(texto, errors="coerce").astype("float64")
+    return directo
+
+
+def calcular_saldo_cartola(
+    fechas: Any,
+    abonos: Any,
+    cargos: Any,
+    saldos: Any = None,
+    orden: Any = None,
+) -> ResultadoSaldoCartola:
+    """
+    Calcula el saldo corrido de una cartola sin recorrer filas en Python.
+
+    - ``orden``: orden original de las filas (índice del Excel o id en BD); por defecto la posición.
+    - Filas sin fecha se descartan.
+    - Antes del primer saldo informado, el saldo corrido es el acumulado de abonos − cargos.
+
+    Ejemplo:
+        r = calcular_saldo_cartola(df["FECHA"], df["ABONOS (CLP)"], df["CARGOS (CLP)"], df["SALDO (CLP)"])
+        if r.hay_saldo_real:
+            print(r.saldo_cierre, r.fecha_cierre)
+    """
+    fechas_s = fechas if isinstance(fechas, pd.Series) else pd.Series(fechas)
+    idx = fechas_s.index
+    n = len(fechas_s)
+
+    def _alinear(valores: Any) -> pd.Series:
+        if valores is None:
+            return pd.Series([None] * n, index=idx, dtype=object)
+        s = valores if isinstance(valores, pd.Series) else pd.Series(valores, index=idx)
+        return s.set_axis(idx) if not s.index.equals(idx) else s
+
+    tabla = pd.DataFrame(
+        {
+            "fecha": pd.to_datetime(fechas_s, errors="coerce"),
+            "orden": _alinear(orden) if orden is not None else pd.Series(range(n), index=idx),
+            "neto": serie_numerica(_alinear(abonos)).fillna(0.0) - serie_numerica(_alinear(cargos)).fillna(0.0),
+            "saldo": serie_numerica(_alinear(saldos)),
+        },
+        index=idx,
+    )
+    tabla = tabla[tabla["fecha"].notna()]
+    if tabla.empty:
+        return ResultadoSaldoCartola(None, None, pd.Series(dtype="float64"), False, 0.0)
+
+    tabla = tabla.sort_values(by=["fecha", "orden"], ascending=[True, False], kind="mergesort")
+    ancla = tabla["saldo"].notna()
+    grupo = ancla.cumsum()
+    # En la fila ancla manda el saldo del banco; su propio neto no se suma
+    neto_post = tabla["neto"].where(~ancla, 0.0)
+    base = tabla["saldo"].where(ancla).ffill().fillna(0.0)
+    saldo_corrido = base + neto_post.groupby(grupo).cumsum()
+
+    return ResultadoSaldoCartola(
+        saldo_cierre=float(saldo_corrido.iloc[-1]),
+        fecha_cierre=tabla["fecha"].iloc[-1],
+        saldo_corrido=saldo_corrido,
+        hay_saldo_real=bool(ancla.any()),
+        neto=float(tabla["neto"].sum()),
+    )
+
+
+def saldo_cartola_desde_df(df: pd.DataFrame, orden: Any = None) -> ResultadoSaldoCartola:
+    """Atajo para DataFrames con columnas FECHA, ABONOS (CLP), CARGOS (CLP), SALDO (CLP)."""
+    def _col(nombre: str) -> Optional[pd.Series]:
+        return df[nombre] if nombre in df.columns else None
+
+    return calcular_saldo_cartola(
+        df["FECHA"],
+        _col("ABONOS (CLP)"),
+        _col("CARGOS (CLP)"),
+        _col("SALDO (CLP)"),
+        orden=orden if orden is not None else pd.Series(df.index, index=df.index),
+    )
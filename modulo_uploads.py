@@ -0,0 +1,141 @@
+"""
+Excel subidos en Proyección (CxC/CxP ERP y libro de remuneraciones) parseados una sola vez.
+``ParsedUpload`` guarda el DataFrame normalizado, el mapeo detectado y la fila de encabezado;
+inspeccionar y cargar lo aceptan en lugar de los bytes, y una caché acotada (por hash del
+contenido y opciones de lectura) evita reparsear el mismo archivo entre reruns de Streamlit.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import BinaryIO, Dict, Hashable, Optional, Tuple, Union
+
+import pandas as pd
+
+CACHE_UPLOADS_MAX = int(os.getenv("FLUJO_CAJA_CACHE_UPLOADS", "8"))
+# Sobre este tamaño el Excel se procesa por lotes (streaming) y no se guarda entero en caché
+UPLOAD_STREAMING_MB = float(os.getenv("FLUJO_CAJA_STREAMING_MB", "8"))
+
+
+@dataclass(frozen=True)
+class ParsedUpload:
+    """
+    Resultado de leer y normalizar un Excel subido. El DataFrame se comparte entre
+    inspección y carga: tratarlo como solo lectura.
+
+    Ejemplo:
+        parsed = parsear_excel_erp(data)
+        info = inspeccionar_excel_erp(parsed)
+        if info["mapeo_ok"]:
+            cargar_excel_cxc_cxp(user_id, parsed, nombre, es_cxc=True)
+    """
+
+    hash_contenido: str
+    tipo: str  # "erp" | "remuneraciones"
+    preset: Optional[str]
+    hoja: Union[int, str, None]
+    fila_header: int
+    modo_header: Tuple[str, int]  # ("auto", max_fila_header) | ("fija", fila_header); ver modo_header()
+    df: pd.DataFrame = field(repr=False)
+    mapeo: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def filas_leidas(self) -> int:
+        return len(self.df)
+
+    @property
+    def columnas(self) -> list:
+        return list(self.df.columns)
+
+
+def modo_header(auto_fila_header: bool, fila_header: int, max_fila_header: int) -> Tuple[str, int]:
+    """Cómo se elige el encabezado: ("auto", max_fila_header) o ("fija", fila_header)."""
+    return ("auto", max_fila_header) if auto_fila_header else ("fija", fila_header)
+
+
+def verificar_opciones_parsed(
+    parsed: ParsedUpload,
+    tipo: str,
+    *,
+    preset: Optional[str],
+    hoja: Union[int, str, None],
+    modo_header: Tuple[str, int],
+) -> None:
+    """
+    ValueError si ``parsed`` se leyó con otras opciones que las pedidas a la carga: el
+    ParsedUpload no se vuelve a leer, así que las opciones distintas se ignorarían en silencio.
+    El encabezado se compara por modo: un parseo con fila fija no sirve para una carga con
+    detección automática (ni con otro máximo de búsqueda), y viceversa.
+    """
+    distintas = []
+    if parsed.tipo != tipo:
+        distintas.append(f"tipo={parsed.tipo!r} (se pidió {tipo!r})")
+    if (parsed.preset or "generico").lower() != (preset or "generico").lower():
+        distintas.append(f"preset={parsed.preset!r} (se pidió {preset!r})")
+    if parsed.hoja != hoja:
+        distintas.append(f"hoja={parsed.hoja!r} (se pidió {hoja!r})")
+    if tuple(parsed.modo_header) != tuple(modo_header):
+        distintas.append(f"encabezado={parsed.modo_header!r} (se pidió {tuple(modo_header)!r})")
+    if distintas:
+        raise ValueError("El archivo ya parseado se leyó con otras opciones: " + ", ".join(distintas))
+
+
+def fuente_a_bytes(fuente: Union[str, Path, bytes, BinaryIO]) -> bytes:
+    """Contenido completo del archivo (ruta, bytes o archivo abierto), para hashear y parsear."""
+    if isinstance(fuente, (bytes, bytearray)):
+        return bytes(fuente)
+    if isinstance(fuente, (str, Path)):
+        return Path(fuente).read_bytes()
+    chunk = fuente.read()
+    if not isinstance(chunk, bytes):
+        return bytes(chunk)
+    return chunk
+
+
+def es_upload_grande(datos: bytes) -> bool:
+    """True si conviene procesar el archivo por lotes en vez de parsearlo completo en memoria."""
+    return len(datos) > UPLOAD_STREAMING_MB * 1024 * 1024
+
+
+class _CacheUploads:
+    """LRU en memoria, acotada por cantidad de entradas."""
+
+    def __init__(self, max_entradas: int):
+        self.max_entradas = max_entradas
+        self._entradas: "OrderedDict[Tuple[Hashable, ...], ParsedUpload]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave: Tuple[Hashable, ...]) -> Optional[ParsedUpload]:
+        with self._lock:
+            parsed = self._entradas.get(clave)
+            if parsed is not None:
+                self._entradas.move_to_end(clave)
+            return parsed
+
+    def guardar(self, clave: Tuple[Hashable, ...], parsed: ParsedUpload) -> None:
+        if self.max_entradas <= 0:
+            return
+        with self._lock:
+            self._entradas[clave] = parsed
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+
+
+_cache_uploads = _CacheUploads(CACHE_UPLOADS_MAX)
+
+
+def obtener_upload_cacheado(clave: Tuple[Hashable, ...]) -> Optional[ParsedUpload]:
+    """ParsedUpload ya parseado para esa clave (hash + opciones de lectura), o None."""
+    return _cache_uploads.obtener(clave)
+
+
+def guardar_upload_cacheado(clave: Tuple[Hashable, ...], parsed: ParsedUpload) -> None:
+    _cache_uploads.guardar(clave, parsed)
@@ -9,7 +9,7 @@ from dataclasses import dataclass
 from datetime import date, timedelta
 from decimal import Decimal
 from types import SimpleNamespace
-from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
 
 import pandas as pd
 import streamlit as st
@@ -22,7 +22,9 @@ except Exception:
 from database.connection import get_db
 from database.crud import (
     obtener_archivos,
+    obtener_movimientos_saldo_dataframe,
     obtener_rango_fechas_transacciones,
+    obtener_resumen_archivo,
     obtener_transacciones,
 )
 from database.models import (
@@ -31,11 +33,14 @@ from database.models import (
     ProyeccionImportacion,
     ProyeccionLinea,
     ProyeccionSnapshot,
-    Transaccion,
     Usuario,
 )
-from modulo_carga_erp import cargar_excel_cxc_cxp
-from modulo_remuneraciones import cargar_excel_remuneraciones
+from modulo_carga_erp import cargar_excel_cxc_cxp, inspeccionar_excel_erp
+from modulo_cartola import hash_contenido
+from modulo_remuneraciones import cargar_excel_remuneraciones, inspeccionar_excel_remuneraciones
+from modulo_jobs import enviar_job, render_estado_job, reportar_progreso
+from modulo_uploads import es_upload_grande
+from modulo_saldos import saldo_cartola_desde_df
 
 UMBRAL_CONFIANZA_BAJA = 0.40
 
@@ -109,14 +114,29 @@ def _iter_months_in_range(inicio: date, fin: date) -> Iterable[Tuple[int, int]]:
             m += 1
 
 
-def _mapa_categorias_codigo_a_id() -> Dict[str, int]:
+def _montos_diarios_mensuales(inicio: date, fin: date, monto_mes: Decimal) -> List[Tuple[date, Decimal]]:
+    """
+    Reparte `monto_mes` día a día entre `inicio` y `fin` (ambos incluidos): cada día recibe
+    monto_mes / días de su mes. Una división por mes y un rango de fechas, no un cálculo por día.
+    """
+    if inicio > fin:
+        return []
+    diario_por_mes = {
+        (y, m): monto_mes / Decimal(calendar.monthrange(y, m)[1])
+        for y, m in _iter_months_in_range(inicio, fin)
+    }
+    return [(d, diario_por_mes[(d.year, d.month)]) for d in pd.date_range(inicio, fin, freq="D").date]
+
+
+def _mapa_categorias_codigo_a_id(categorias: Optional[Iterable[Any]] = None) -> Dict[str, int]:
     """
     Un codigo por fila. Si en BD hay duplicados del mismo `codigo` (p. ej. re-seeds),
     se usa el **menor id** para comportamiento estable (evita que el último Arbitrario pise el id correcto).
+    `categorias`: filas ya leídas (p. ej. SnapshotInputs.categorias); si no, las activas del registro.
     """
     out: Dict[str, int] = {}
     filas = sorted(
-        crud_p.listar_categorias_financieras(),
+        crud_p.registro_categorias().activas if categorias is None else categorias,
         key=lambda c: (c.id or 0),
     )
     for c in filas:
@@ -129,8 +149,57 @@ def _mapa_categorias_codigo_a_id() -> Dict[str, int]:
 
 
 def _ultima_carga_id(user_id: int, tipo: str) -> Optional[int]:
-    L = crud_p.listar_proyeccion_cargas(user_id, tipo=tipo, limite=1)
-    return L[0].id if L else None
+    return crud_p.obtener_carga_actual_id(user_id, tipo)
+
+
+def _inspeccionar_upload(archivo: Any, inspeccionar: Callable[[bytes], Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Parsea el Excel subido una vez (caché por hash del contenido) y muestra el mapeo detectado.
+    El ``parsed`` del resultado se pasa a la carga para no volver a leer el archivo.
+    """
+    datos = archivo.getvalue()
+    if es_upload_grande(datos):
+        # Sin vista previa: la carga lo procesa por lotes para no tenerlo entero en memoria
+        st.caption(f"Archivo grande ({len(datos) / 1024 / 1024:,.0f} MB): se procesará por lotes.")
+        return None
+    try:
+        info = inspeccionar(datos)
+    except Exception as ex:
+        st.warning(f"No se pudo leer el Excel: {ex}")
+        return None
+    if info["mapeo_ok"]:
+        st.caption(f"{len(info['mapeo'])} columnas reconocidas · {info['parsed'].filas_leidas:,} filas")
+    else:
+        st.warning(f"Columnas no reconocidas: {', '.join(info['faltantes'])}")
+    return info
+
+
+def _tarea_carga_erp(user_id: int, fuente: Any, nombre_archivo: str, es_cxc: bool) -> Dict[str, Any]:
+    """Carga CxC/CxP como trabajo en segundo plano (ver modulo_jobs)."""
+    r = cargar_excel_cxc_cxp(user_id, fuente, nombre_archivo, es_cxc=es_cxc)
+    return {"carga_id": r.carga_id, "guardadas": r.facturas_guardadas, "advertencias": r.advertencias[:50]}
+
+
+def _tarea_carga_remuneraciones(
+    user_id: int, fuente: Any, nombre_archivo: str, mes_aplicacion_default: date
+) -> Dict[str, Any]:
+    r = cargar_excel_remuneraciones(user_id, fuente, nombre_archivo, mes_aplicacion_default=mes_aplicacion_default)
+    return {"carga_id": r.carga_id, "guardadas": r.filas_guardadas, "advertencias": r.advertencias[:50]}
+
+
+def _tarea_snapshot(user_id: int, periodo_dias: int, etiqueta: Optional[str], notas: Optional[str]) -> Dict[str, Any]:
+    reportar_progreso(0.05, "Calculando proyección…")
+    snap = generar_snapshot(user_id, periodo_dias, etiqueta=etiqueta, notas=notas)
+    return {"snapshot_id": snap.id, "version": snap.version}
+
+
+def _mostrar_resultado_carga(resultado: Dict[str, Any], mensaje: str) -> None:
+    st.success(f"{mensaje.format(resultado.get('guardadas', 0))} (carga #{resultado.get('carga_id')}).")
+    advertencias = resultado.get("advertencias") or []
+    if advertencias:
+        with st.expander("Advertencias parser"):
+            for a in advertencias:
+                st.caption(a)
 
 
 def _facturas_ultimas_cargas(user_id: int) -> List[ProyeccionFactura]:
@@ -246,100 +315,44 @@ def _obtener_saldo_cartola_real(user_id: int, archivo_id: Optional[int] = None)
     """
     Saldo al cierre según cartola: fecha ascendente; mismo día id descendente (carga típica más reciente
     arriba). Propagación si falta saldo en la última línea. Sin columna saldo, equivale al neto del extracto.
+    Con archivo_id se lee del resumen por archivo que se materializa al guardar la cartola.
     """
-    try:
-        trans = obtener_transacciones(user_id=user_id, archivo_id=archivo_id)
-    except Exception:
-        return Decimal(0)
-    if not trans and archivo_id is not None:
-        # Fallback defensivo: si la cartola seleccionada no trae movimientos en esta vista,
-        # usar movimientos del usuario para no forzar saldo 0.
-        try:
-            trans = obtener_transacciones(user_id=user_id, archivo_id=None)
-        except Exception:
-            return Decimal(0)
-    if not trans and archivo_id is not None:
-        # Fallback extra: resolver por archivo_id directo, por si el user_id de sesión difiere.
-        try:
-            db = next(get_db())
-            trans = (
-                db.query(Transaccion)
-                .filter(Transaccion.archivo_id == int(archivo_id))
-                .order_by(Transaccion.id.asc())
-                .all()
-            )
-            db.close()
-        except Exception:
-            return Decimal(0)
-    if not trans:
-        # Último fallback: usar la última cartola con movimientos en BD para evitar mostrar 0.
-        # Esto cubre casos donde la sesión no trae user_id/archivo_id consistentes.
+    def _saldo_resumen(aid: Optional[int], uid: int) -> Optional[Decimal]:
+        # Resumen materializado por archivo (resumen_archivos): lectura O(1).
+        if aid is None:
+            return None
         try:
-            db = next(get_db())
-            ult = (
-                db.query(Transaccion.archivo_id)
-                .filter(Transaccion.archivo_id.isnot(None))
-                .order_by(Transaccion.id.desc())
-                .first()
-            )
-            if ult and ult[0] is not None:
-                trans = (
-                    db.query(Transaccion)
-                    .filter(Transaccion.archivo_id == int(ult[0]))
-                    .order_by(Transaccion.id.asc())
-                    .all()
-                )
-            db.close()
+            resumen = obtener_resumen_archivo(int(aid))
         except Exception:
-            return Decimal(0)
-    def _dec_loose(x: Any) -> Decimal:
-        if x is None:
-            return Decimal(0)
-        if isinstance(x, Decimal):
-            return x
-        if isinstance(x, (int, float)):
-            return Decimal(str(x))
-        s = str(x).strip().replace("$", "").replace(" ", "")
-        if not s:
-            return Decimal(0)
-        # Normaliza formatos como 1.234.567,89 o 1,234,567.89
-        if "," in s and "." in s:
-            if s.rfind(",") > s.rfind("."):
-                s = s.replace(".", "").replace(",", ".")
-            else:
-                s = s.replace(",", "")
-        elif "," in s:
-            s = s.replace(",", ".")
+            return None
+        if resumen is None or resumen.saldo_cierre is None:
+            return None
+        if resumen.usuario_id != uid:
+            return None
+        return Decimal(resumen.saldo_cierre)
+
+    def _saldo_usuario(uid: int) -> Optional[Decimal]:
+        # Movimientos de todas las cartolas del usuario (sin resumen por archivo).
         try:
-            return Decimal(s)
+            movs = obtener_movimientos_saldo_dataframe(usuario_id=uid, archivo_id=None)
         except Exception:
-            return Decimal(0)
-
-    trans_list = list(trans)
-    trans_list.sort(
-        key=lambda t: (
-            getattr(t, "fecha", None) or date.min,
-            -int(getattr(t, "id", None) or 0),
-        )
-    )
-
-    running: Optional[Decimal] = None
-    saldo_calculado = Decimal(0)
-    for t in trans_list:
-        ab = _dec_loose(getattr(t, "abono", None))
-        cg = _dec_loose(getattr(t, "cargo", None))
-        saldo_calculado += ab - cg
-        raw_saldo = getattr(t, "saldo", None)
-        if raw_saldo is not None:
-            running = _dec_loose(raw_saldo)
-        elif running is not None:
-            running = running + ab - cg
-        else:
-            running = ab - cg
-
-    if running is not None:
-        return running
-    return saldo_calculado
+            return None
+        if movs.empty:
+            return None
+        resultado = saldo_cartola_desde_df(movs, orden=movs["ID"])
+        if resultado.saldo_cierre is None:
+            return None
+        return Decimal(str(round(resultado.saldo_cierre, 2)))
+
+    if archivo_id is not None:
+        saldo = _saldo_resumen(archivo_id, user_id)
+        if saldo is not None:
+            return saldo
+    # Sin archivo_id, o fallback defensivo si la cartola seleccionada no trae movimientos
+    # en esta vista: usar movimientos del usuario para no forzar saldo 0.
+    # Nunca se lee la cartola de otro usuario: sin movimientos propios el saldo es 0.
+    saldo = _saldo_usuario(user_id)
+    return saldo if saldo is not None else Decimal(0)
 
 
 def _resolver_archivo_tab1_activo(user_id: int) -> Optional[int]:
@@ -361,19 +374,20 @@ def _resolver_archivo_tab1_activo(user_id: int) -> Optional[int]:
     # Fallback por nombre de archivo cargado en Tab 1.
     nombre_bd = st.session_state.get("archivo_cargado_bd")
     if nombre_bd:
+        db = next(get_db())
         try:
-            db = next(get_db())
             row = (
                 db.query(ArchivoCargado.id)
                 .filter(ArchivoCargado.nombre_archivo == str(nombre_bd))
                 .order_by(ArchivoCargado.id.desc())
                 .first()
             )
-            db.close()
             if row and row[0]:
                 return int(row[0])
         except Exception:
             pass
+        finally:
+            db.close()
 
     try:
         archivos = obtener_archivos(user_id) or []
@@ -418,20 +432,17 @@ def _construir_lineas_snapshot(
     periodo_fin: date,
     cats: Mapping[str, int],
     slots_iva_ppm: set[Tuple[date, int]],
+    insumos: Optional[crud_p.SnapshotInputs] = None,
 ) -> List[LineaEspecificacion]:
     lineas: List[LineaEspecificacion] = []
 
-    cxc_id = _ultima_carga_id(user_id, "cxc")
-    cxp_id = _ultima_carga_id(user_id, "cxp")
-    rem_id = _ultima_carga_id(user_id, "remuneraciones")
+    if insumos is None:
+        insumos = crud_p.cargar_insumos_snapshot(user_id)
+    rem_id = insumos.carga_rem_id
 
-    facturas_cxc: List[ProyeccionFactura] = (
-        crud_p.listar_proyeccion_facturas_por_carga(cxc_id) if cxc_id else []
-    )
-    facturas_cxp: List[ProyeccionFactura] = (
-        crud_p.listar_proyeccion_facturas_por_carga(cxp_id) if cxp_id else []
-    )
-    params = crud_p.obtener_proyeccion_parametros_usuario(user_id)
+    facturas_cxc = insumos.facturas_cxc
+    facturas_cxp = insumos.facturas_cxp
+    params = insumos.parametros
     def _pct_0_1(v: Decimal) -> Decimal:
         if v < 0:
             return Decimal(0)
@@ -508,16 +519,16 @@ def _construir_lineas_snapshot(
         )
 
     if rem_id:
-        par_rem = crud_p.obtener_o_crear_proyeccion_parametros_usuario(user_id)
-        dia_rem_raw = par_rem.dia_pago_remuneraciones
-        dia_imp_raw = par_rem.dia_pago_imposiciones
-        dia_trib_raw = par_rem.dia_pago_impuestos
+        # Sin fila de parámetros rigen los defaults del modelo (30 / 10 / 12)
+        dia_rem_raw = params.dia_pago_remuneraciones if params else None
+        dia_imp_raw = params.dia_pago_imposiciones if params else None
+        dia_trib_raw = params.dia_pago_impuestos if params else None
         dia_rem_def = int(dia_rem_raw) if dia_rem_raw is not None else 30
         dia_imp_def = int(dia_imp_raw) if dia_imp_raw is not None else 10
         dia_trib_def = int(dia_trib_raw) if dia_trib_raw is not None else 12
         cid_ret = cats.get("RETENCION")
         cid_iu_nom = cats.get("IU_NOMINA") or cid_ret
-        for r in crud_p.listar_proyeccion_remuneraciones_carga(rem_id):
+        for r in insumos.remuneraciones:
             dbase = r.mes_aplicacion
             dia_r = r.dia_pago or dia_rem_def
             dia_i = dia_imp_def
@@ -614,9 +625,9 @@ def _construir_lineas_snapshot(
                         )
                     )
 
-    egresos = crud_p.listar_proyeccion_egresos_parametricos(user_id)
+    egresos = insumos.egresos
     id_a_codigo: Dict[int, str] = {}
-    for c in crud_p.listar_categorias_financieras():
+    for c in insumos.categorias:
         id_a_codigo[c.id] = c.codigo
 
     for e in egresos:
@@ -669,7 +680,7 @@ def _construir_lineas_snapshot(
     # Créditos/pasivos bancarios parametrizados por usuario.
     cid_credito = cats.get("CREDITO_BANCARIO")
     if cid_credito:
-        for cr in crud_p.listar_proyeccion_creditos_bancarios(user_id, solo_activos=True):
+        for cr in insumos.creditos_activos:
             cuota = _dec(cr.monto_cuota)
             cuotas = int(cr.cuotas_pendientes or 0)
             if cuota <= 0 or cuotas <= 0:
@@ -695,7 +706,7 @@ def _construir_lineas_snapshot(
                     )
                 y, m = _next_month_year_month(y, m)
 
-    for imp in crud_p.listar_proyeccion_importaciones(user_id):
+    for imp in insumos.importaciones:
         if not _importacion_activa(imp):
             continue
         if imp.monto_cif_clp and imp.fecha_pago_proveedor:
@@ -764,22 +775,18 @@ def _construir_lineas_snapshot(
         # Distribuye contado en TODO el horizonte futuro visible de la proyección
         # (no solo en el primer mes del snapshot).
         inicio_contado = max(periodo_inicio, date.today())
-        fd = inicio_contado
-        while fd <= periodo_fin:
-            dias_mes_fd = calendar.monthrange(fd.year, fd.month)[1]
-            monto_diario = ingresos_contado / Decimal(dias_mes_fd)
-            lineas.append(
-                LineaEspecificacion(
-                    fd,
-                    cats["CLIENTES"],
-                    "Ventas contado esperadas (supuesto cliente)",
-                    monto_diario,
-                    "manual",
-                    "parametrico",
-                    None,
-                )
+        lineas.extend(
+            LineaEspecificacion(
+                fd,
+                cats["CLIENTES"],
+                "Ventas contado esperadas (supuesto cliente)",
+                monto_diario,
+                "manual",
+                "parametrico",
+                None,
             )
-            fd = fd + timedelta(days=1)
+            for fd, monto_diario in _montos_diarios_mensuales(inicio_contado, periodo_fin, ingresos_contado)
+        )
 
     # Compras contado esperadas del mes (supuesto manual cliente).
     compra_global = (
@@ -796,22 +803,18 @@ def _construir_lineas_snapshot(
     if compra_global > 0 and pct_compra_contado > 0:
         egresos_contado = compra_global * pct_compra_contado
         inicio_compra = max(periodo_inicio, date.today())
-        fd = inicio_compra
-        while fd <= periodo_fin:
-            dias_mes_fd = calendar.monthrange(fd.year, fd.month)[1]
-            monto_diario = egresos_contado / Decimal(dias_mes_fd)
-            lineas.append(
-                LineaEspecificacion(
-                    fd,
-                    cats["PROV_NACIONAL"],
-                    "Compras contado esperadas (supuesto cliente)",
-                    -abs(monto_diario),
-                    "manual",
-                    "parametrico",
-                    None,
-                )
+        lineas.extend(
+            LineaEspecificacion(
+                fd,
+                cats["PROV_NACIONAL"],
+                "Compras contado esperadas (supuesto cliente)",
+                -abs(monto_diario),
+                "manual",
+                "parametrico",
+                None,
             )
-            fd = fd + timedelta(days=1)
+            for fd, monto_diario in _montos_diarios_mensuales(inicio_compra, periodo_fin, egresos_contado)
+        )
 
     # Recuperación de clientes morosos (sobre CxC vencidos a fecha de análisis).
     pct_recup_morosos = (
@@ -833,22 +836,18 @@ def _construir_lineas_snapshot(
         recup_morosos = base_morosos * pct_recup_morosos
         if recup_morosos > 0:
             inicio_recup = max(periodo_inicio, fecha_analisis)
-            fd = inicio_recup
-            while fd <= periodo_fin:
-                dias_mes_fd = calendar.monthrange(fd.year, fd.month)[1]
-                monto_diario = recup_morosos / Decimal(dias_mes_fd)
-                lineas.append(
-                    LineaEspecificacion(
-                        fd,
-                        cats["CLIENTES"],
-                        "Recuperación CxC morosos (supuesto cliente)",
-                        monto_diario,
-                        "manual",
-                        "parametrico",
-                        None,
-                    )
+            lineas.extend(
+                LineaEspecificacion(
+                    fd,
+                    cats["CLIENTES"],
+                    "Recuperación CxC morosos (supuesto cliente)",
+                    monto_diario,
+                    "manual",
+                    "parametrico",
+                    None,
                 )
-                fd = fd + timedelta(days=1)
+                for fd, monto_diario in _montos_diarios_mensuales(inicio_recup, periodo_fin, recup_morosos)
+            )
 
     dia_imp = int(params.dia_pago_impuestos) if params else 12
     tasa_ppm = _dec(params.tasa_ppm) if params and params.tasa_ppm is not None else Decimal(0)
@@ -915,21 +914,17 @@ def generar_snapshot(
     if periodo_dias not in (30, 60, 90):
         periodo_dias = min(max(30, periodo_dias), 90)
 
-    # PostgreSQL / deploy nuevo: asegura categorías (p. ej. CREDITO_BANCARIO activo).
-    crud_p.seed_categorias_financieras()
+    # Todos los insumos en una sola sesión; el motor ya no consulta la BD.
+    insumos = crud_p.cargar_insumos_snapshot(user_id)
 
     fecha_proyeccion = date.today()
     # Para que "Vencidos/Por vencer/Todos" sea consistente con Excel, el snapshot
     # debe incluir también los vencidos más antiguos que existan en la ultima carga.
-    facts_latest = _facturas_ultimas_cargas(user_id)
-    venc_min = None
-    for f in facts_latest:
-        if f.fecha_vencimiento is not None:
-            venc_min = f.fecha_vencimiento if venc_min is None else min(venc_min, f.fecha_vencimiento)
+    venc_min = insumos.vencimiento_minimo
     periodo_inicio = venc_min if (venc_min is not None and venc_min < fecha_proyeccion) else fecha_proyeccion
     periodo_fin = fecha_proyeccion + timedelta(days=periodo_dias)
 
-    cats = _mapa_categorias_codigo_a_id()
+    cats = _mapa_categorias_codigo_a_id(insumos.categorias)
     for req in (
         "CLIENTES",
         "PROV_NACIONAL",
@@ -943,19 +938,18 @@ def generar_snapshot(
     ):
         if req not in cats:
             raise ValueError(
-                f"Falta categoría financiera '{req}'. Ejecute seed_categorias_financieras o revise la BD."
+                f"Falta categoría financiera '{req}'. Ejecute init_db (migraciones) o seed_categorias_financieras."
             )
 
-    creditos_activos = crud_p.listar_proyeccion_creditos_bancarios(user_id, solo_activos=True)
-    if creditos_activos and cats.get("CREDITO_BANCARIO") is None:
+    if insumos.creditos_activos and cats.get("CREDITO_BANCARIO") is None:
         raise ValueError(
             "Hay créditos bancarios activos en tu cuenta pero falta la categoría financiera "
             "`CREDITO_BANCARIO` (debe existir y estar activa). "
-            "En servidor: ejecute `seed_categorias_financieras` / init_db y evite códigos duplicados en `categorias_financieras`."
+            "En servidor: ejecute init_db / init_db_render.py (migraciones) y evite códigos duplicados en `categorias_financieras`."
         )
 
     slots_iva_ppm: set[Tuple[date, int]] = set()
-    especs = _construir_lineas_snapshot(user_id, periodo_inicio, periodo_fin, cats, slots_iva_ppm)
+    especs = _construir_lineas_snapshot(user_id, periodo_inicio, periodo_fin, cats, slots_iva_ppm, insumos)
 
     snap = crud_p.crear_proyeccion_snapshot(
         user_id,
@@ -970,7 +964,6 @@ def generar_snapshot(
     for e in especs:
         bulk.append(
             {
-                "snapshot_id": snap.id,
                 "fecha_impacto": e.fecha_impacto,
                 "categoria_id": e.categoria_id,
                 "descripcion": e.descripcion,
@@ -980,8 +973,7 @@ def generar_snapshot(
                 "referencia_id": e.referencia_id,
             }
         )
-    if bulk:
-        crud_p.crear_proyeccion_lineas_bulk(bulk)
+    crud_p.guardar_lineas_snapshot(snap.id, bulk)
 
     return crud_p.obtener_proyeccion_snapshot(snap.id)
 
@@ -1343,8 +1335,8 @@ def render_proyeccion(usuario: Optional[Usuario]) -> None:
                 "❌ No hay categoría **CREDITO_BANCARIO** activa: las cuotas de crédito **no** se agregan al snapshot. "
                 "Pulse «Sincronizar categorías maestras» arriba."
             )
-        cat_hon = crud_p.obtener_categoria_por_codigo("HONORARIOS")
-        cat_ret = crud_p.obtener_categoria_por_codigo("RETENCION")
+        cat_hon = crud_p.categoria_por_codigo("HONORARIOS")
+        cat_ret = crud_p.categoria_por_codigo("RETENCION")
         st.markdown(
             f"- **HONORARIOS** → `id {cat_hon.id if cat_hon else '—'}` · "
             f"**RETENCION** → `id {cat_ret.id if cat_ret else '—'}`"
@@ -1364,7 +1356,7 @@ def render_proyeccion(usuario: Optional[Usuario]) -> None:
         hr_rows = [e for e in eggs if id_h is not None and id_r is not None and e.categoria_id in (id_h, id_r)]
         st.markdown(f"- Egresos paramétricos honorarios/retención: **{len(hr_rows)}** filas")
         for e in hr_rows[-10:]:
-            cx = crud_p.obtener_categoria_por_id(e.categoria_id)
+            cx = crud_p.categoria_por_id(e.categoria_id)
             cod = (cx.codigo if cx else "?")
             st.caption(
                 f"  · id {e.id} **{cod}** · ${float(_dec(e.monto_estimado) or 0):,.0f} · "
@@ -1607,8 +1599,8 @@ def render_proyeccion(usuario: Optional[Usuario]) -> None:
             "El **impuesto único del libro de remuneraciones** se mapea desde el Excel y va a «Impuesto único nómina» "
             "con el día **pago impuestos (IVA/SII)** de parámetros (junto a IVA/PPM)."
         )
-        cat_h = crud_p.obtener_categoria_por_codigo("HONORARIOS")
-        cat_r = crud_p.obtener_categoria_por_codigo("RETENCION")
+        cat_h = crud_p.categoria_por_codigo("HONORARIOS")
+        cat_r = crud_p.categoria_por_codigo("RETENCION")
         if not cat_h or not cat_r:
             st.error("No se encontraron categorías HONORARIOS/RETENCION en `categorias_financieras`.")
         else:
@@ -1716,7 +1708,7 @@ def render_proyeccion(usuario: Optional[Usuario]) -> None:
             for e in eg:
                 if e.categoria_id not in target_ids:
                     continue
-                c = crud_p.obtener_categoria_por_id(e.categoria_id)
+                c = crud_p.categoria_por_id(e.categoria_id)
                 rows_hr.append(
                     {
                         "id": e.id,
@@ -1916,19 +1908,19 @@ def render_proyeccion(usuario: Optional[Usuario]) -> None:
             key="up_cxc",
             label_visibility="collapsed",
         )
+        insp_cxc = _inspeccionar_upload(up_cxc, inspeccionar_excel_erp) if up_cxc else None
         if up_cxc and st.button("Procesar Facturas por Cobrar", key="btn_cxc"):
             try:
-                data = up_cxc.getvalue()
-                r = cargar_excel_cxc_cxp(
-                    user_id, data, up_cxc.name, es_cxc=True,
+                fuente = insp_cxc["parsed"] if insp_cxc else up_cxc.getvalue()
+                st.session_state["job_cxc"] = enviar_job(
+                    user_id, "carga_cxc", _tarea_carga_erp, user_id, fuente, up_cxc.name, True,
+                    descripcion=up_cxc.name, huella=hash_contenido(up_cxc.getvalue()),
                 )
-                st.success(f"Cargadas {r.facturas_guardadas} facturas (carga #{r.carga_id}).")
-                if r.advertencias:
-                    with st.expander("Advertencias parser"):
-                        for a in r.advertencias[:50]:
-                            st.caption(a)
             except Exception as ex:
                 st.error(str(ex))
+        render_estado_job(
+            "job_cxc", user_id, "Procesando Facturas por Cobrar", lambda res: _mostrar_resultado_carga(res, "Cargadas {} facturas")
+        )
         st.markdown("</div>", unsafe_allow_html=True)
     with c2:
         st.markdown(
@@ -1942,19 +1934,19 @@ def render_proyeccion(usuario: Optional[Usuario]) -> None:
             key="up_cxp",
             label_visibility="collapsed",
         )
+        insp_cxp = _inspeccionar_upload(up_cxp, inspeccionar_excel_erp) if up_cxp else None
         if up_cxp and st.button("Procesar Facturas por Pagar", key="btn_cxp"):
             try:
-                data = up_cxp.getvalue()
-                r = cargar_excel_cxc_cxp(
-                    user_id, data, up_cxp.name, es_cxc=False,
+                fuente = insp_cxp["parsed"] if insp_cxp else up_cxp.getvalue()
+                st.session_state["job_cxp"] = enviar_job(
+                    user_id, "carga_cxp", _tarea_carga_erp, user_id, fuente, up_cxp.name, False,
+                    descripcion=up_cxp.name, huella=hash_contenido(up_cxp.getvalue()),
                 )
-                st.success(f"Cargadas {r.facturas_guardadas} facturas (carga #{r.carga_id}).")
-                if r.advertencias:
-                    with st.expander("Advertencias parser"):
-                        for a in r.advertencias[:50]:
-                            st.caption(a)
             except Exception as ex:
                 st.error(str(ex))
+        render_estado_job(
+            "job_cxp", user_id, "Procesando Facturas por Pagar", lambda res: _mostrar_resultado_carga(res, "Cargadas {} facturas")
+        )
         st.markdown("</div>", unsafe_allow_html=True)
     with c3:
         st.markdown(
@@ -1969,22 +1961,19 @@ def render_proyeccion(usuario: Optional[Usuario]) -> None:
             label_visibility="collapsed",
         )
         mes_def = st.date_input("Mes aplicación (si el Excel no trae periodo)", value=date.today().replace(day=1), key="mes_rem")
+        insp_rem = _inspeccionar_upload(up_rem, inspeccionar_excel_remuneraciones) if up_rem else None
         if up_rem and st.button("Procesar remuneraciones", key="btn_rem"):
             try:
-                data = up_rem.getvalue()
-                r = cargar_excel_remuneraciones(
-                    user_id,
-                    data,
-                    up_rem.name,
-                    mes_aplicacion_default=mes_def,
+                fuente = insp_rem["parsed"] if insp_rem else up_rem.getvalue()
+                st.session_state["job_rem"] = enviar_job(
+                    user_id, "carga_remuneraciones", _tarea_carga_remuneraciones, user_id, fuente, up_rem.name, mes_def,
+                    descripcion=up_rem.name, huella=hash_contenido(up_rem.getvalue() + str(mes_def).encode()),
                 )
-                st.success(f"Guardadas {r.filas_guardadas} filas (carga #{r.carga_id}).")
-                if r.advertencias:
-                    with st.expander("Advertencias parser"):
-                        for a in r.advertencias[:50]:
-                            st.caption(a)
             except Exception as ex:
                 st.error(str(ex))
+        render_estado_job(
+            "job_rem", user_id, "Procesando remuneraciones", lambda res: _mostrar_resultado_carga(res, "Guardadas {} filas")
+        )
         st.markdown("</div>", unsafe_allow_html=True)
 
     st.markdown(
@@ -2129,13 +2118,19 @@ def render_proyeccion(usuario: Optional[Usuario]) -> None:
         st.markdown("</div>", unsafe_allow_html=True)
     if generar_click:
         try:
-            snap = generar_snapshot(user_id, psel, etiqueta=etiqueta or None, notas=notas or None)
-            st.success(f"Proyección guardada v{snap.version} creada (id {snap.id}).")
-            st.session_state["ultimo_snapshot_proy"] = snap.id
-            st.rerun()
+            st.session_state["job_snapshot"] = enviar_job(
+                user_id, "snapshot", _tarea_snapshot, user_id, psel, etiqueta or None, notas or None,
+                descripcion=f"Proyección {psel} días", huella=hash_contenido(f"{psel}|{etiqueta}|{notas}".encode()),
+            )
         except Exception as ex:
             st.error(str(ex))
 
+    def _al_terminar_snapshot(res: Dict[str, Any]) -> None:
+        st.session_state["ultimo_snapshot_proy"] = res.get("snapshot_id")
+        st.success(f"Proyección guardada v{res.get('version')} creada (id {res.get('snapshot_id')}).")
+
+    render_estado_job("job_snapshot", user_id, "Generando proyección", _al_terminar_snapshot)
+
     snaps = crud_p.listar_proyeccion_snapshots(user_id, limite=80)
     if not snaps:
         st.info("No hay proyecciones guardadas. Genere una después de cargar Facturas por Cobrar/Pagar o datos mínimos.")
@@ -2153,8 +2148,10 @@ def render_proyeccion(usuario: Optional[Usuario]) -> None:
         st.caption("Paso 2: selecciona proyección activa y define el período visible.")
         choice = st.selectbox("Proyección activa", options=list(opts.keys()), index=default_idx)
         sid = opts[choice]
-        snap = crud_p.obtener_proyeccion_snapshot(sid)
-        lineas = crud_p.listar_proyeccion_lineas_snapshot(sid) if snap else []
+        # Snapshot inmutable: cabecera y líneas salen del LRU del proceso (sin BD al cambiar filtros).
+        snap_cache = crud_p.obtener_snapshot_cacheado(sid)
+        snap = snap_cache.snapshot if snap_cache else None
+        lineas = list(snap_cache.lineas) if snap_cache else []
 
         if not snap:
             st.warning("No se pudo cargar la proyección seleccionada.")
@@ -2197,7 +2194,7 @@ def render_proyeccion(usuario: Optional[Usuario]) -> None:
         )
         incluir_arrastre_cxp = bool(st.session_state.get(f"toggle_arrastre_cxp_user_{user_id}", False))
         if incluir_arrastre_cxp and cxp_vencido_no_pagado > 0:
-            cat_prov_nac = crud_p.obtener_categoria_por_codigo("PROV_NACIONAL")
+            cat_prov_nac = crud_p.categoria_por_codigo("PROV_NACIONAL")
             if cat_prov_nac:
                 lineas_escenario.append(
                     SimpleNamespace(
@@ -2290,6 +2287,9 @@ def render_proyeccion(usuario: Optional[Usuario]) -> None:
                 if fmin_snap <= l.fecha_impacto <= fmax_snap and _aplica_estado(l.fecha_impacto)
             ]
         # Proyección y visualización trabajan solo con eventos futuros (desde hoy).
+        # Clave de los agregados cacheados por snapshot: período visible + escenario (arrastre CXP).
+        arrastre_escenario = tuple(float(_dec(l.monto)) for l in lineas_escenario[len(lineas):])
+        clave_vista = (fecha_desde_sel, fecha_hasta_sel, fecha_analisis, arrastre_escenario)
     incluir_arrastre_cxp_ui = st.toggle(
         "Incluir arrastre de CXP vencidos no pagados (día 1)",
         value=bool(st.session_state.get(f"toggle_arrastre_cxp_user_{user_id}", False)),
@@ -2359,7 +2359,7 @@ def render_proyeccion(usuario: Optional[Usuario]) -> None:
         _m = _dec(_l.monto)
         _cid = int(_l.categoria_id)
         if _cid not in _cat_cache_cxc:
-            _c = crud_p.obtener_categoria_por_id(_cid)
+            _c = crud_p.categoria_por_id(_cid)
             _cat_cache_cxc[_cid] = ((_c.codigo if _c else "") or "").strip().upper()
         if _cat_cache_cxc[_cid] == "CLIENTES":
             total_cxc_proy += _m
@@ -2456,7 +2456,9 @@ def render_proyeccion(usuario: Optional[Usuario]) -> None:
     s2.metric("Saldo final proyectado (inicial + flujo neto)", f"${(saldo_cartola_real + float(saldo_neto_periodo)):,.0f}")
 
     if lineas_filtradas:
-        fechas, montos, doms = _agregacion_diaria_waterfall(lineas_filtradas)
+        fechas, montos, doms = crud_p.derivado_snapshot(
+            sid, ("waterfall",) + clave_vista, lambda: _agregacion_diaria_waterfall(lineas_filtradas)
+        )
         if fechas:
             with st.expander("Evolución diaria del flujo (visual opcional)", expanded=False):
                 vista_graf = st.radio(
@@ -2474,15 +2476,6 @@ def render_proyeccion(usuario: Optional[Usuario]) -> None:
                 else:
                     st.plotly_chart(_fig_waterfall(fechas, montos, doms), use_container_width=True)
 
-        cats_ids = {l.categoria_id for l in lineas_filtradas}
-        id_nombre: Dict[int, str] = {}
-        id_codigo: Dict[int, str] = {}
-        for cid in cats_ids:
-            c = crud_p.obtener_categoria_por_id(cid)
-            if c:
-                id_nombre[cid] = c.nombre
-                id_codigo[cid] = c.codigo
-
         def _concepto_desde_linea(categoria_codigo: str, categoria_nombre: str) -> str:
             cod = (categoria_codigo or "").strip().upper()
             if cod == "CLIENTES":
@@ -2517,7 +2510,6 @@ def render_proyeccion(usuario: Optional[Usuario]) -> None:
                 return "📥 CxC — Pago Clientes"
             return "📤 Categoría personalizada (cliente)"
 
-        rows = []
         concepto_alias = {
             "📥 CxC — Pago Clientes": "📥 Facturas por Cobrar — Clientes",
             "📤 Proveedores Nacionales": "📤 Facturas por Pagar — Proveedores Nacionales",
@@ -2527,23 +2519,43 @@ def render_proyeccion(usuario: Optional[Usuario]) -> None:
             "upload_excel": "Carga Excel",
             "parametrico": "Cálculo automático",
         }
-        for l in sorted(lineas_filtradas, key=lambda x: (x.fecha_impacto, x.id)):
-            codigo = id_codigo.get(l.categoria_id, "")
-            nombre = id_nombre.get(l.categoria_id, str(l.categoria_id))
-            concepto_raw = _concepto_desde_linea(codigo, nombre)
-            rows.append(
-                {
-                    "fecha": l.fecha_impacto,
-                    "concepto": concepto_raw,
-                    "concepto_ui": concepto_alias.get(concepto_raw, concepto_raw),
-                    "categoría": nombre,
-                    "descripción": l.descripcion,
-                    "monto": float(_dec(l.monto)),
-                    "confianza": l.tipo_confianza,
-                    "origen": origen_alias.get((l.origen or "").strip().lower(), l.origen),
-                }
-            )
-        df_det = pd.DataFrame(rows)
+
+        def _detalle_lineas() -> Tuple[pd.DataFrame, Dict[int, str], Dict[int, str]]:
+            cats_ids = {l.categoria_id for l in lineas_filtradas}
+            id_nombre: Dict[int, str] = {}
+            id_codigo: Dict[int, str] = {}
+            for cid in cats_ids:
+                c = crud_p.categoria_por_id(cid)
+                if c:
+                    id_nombre[cid] = c.nombre
+                    id_codigo[cid] = c.codigo
+
+            rows = []
+            for l in sorted(lineas_filtradas, key=lambda x: (x.fecha_impacto, x.id or 0)):
+                codigo = id_codigo.get(l.categoria_id, "")
+                nombre = id_nombre.get(l.categoria_id, str(l.categoria_id))
+                concepto_raw = _concepto_desde_linea(codigo, nombre)
+                rows.append(
+                    {
+                        "fecha": l.fecha_impacto,
+                        "concepto": concepto_raw,
+                        "concepto_ui": concepto_alias.get(concepto_raw, concepto_raw),
+                        "categoría": nombre,
+                        "descripción": l.descripcion,
+                        "monto": float(_dec(l.monto)),
+                        "confianza": l.tipo_confianza,
+                        "origen": origen_alias.get((l.origen or "").strip().lower(), l.origen),
+                    }
+                )
+            return pd.DataFrame(rows), id_nombre, id_codigo
+
+        # Nombres/códigos de categoría salen del registro: su versión invalida el derivado si cambian
+        _df_det, _id_nombre, _id_codigo = crud_p.derivado_snapshot(
+            sid, ("detalle", crud_p.registro_categorias().version) + clave_vista, _detalle_lineas
+        )
+        df_det = _df_det.copy()
+        id_nombre = dict(_id_nombre)
+        id_codigo = dict(_id_codigo)
         mapeo_tab1 = crud_p.obtener_mapeo_conceptos_tab1_dict(user_id)
         df_det["categoría_tab1_mapeada"] = df_det["concepto"].map(mapeo_tab1).fillna("")
 
@@ -2758,24 +2770,35 @@ def render_proyeccion(usuario: Optional[Usuario]) -> None:
                     net = _dec(getattr(t, "abono", None)) - _dec(getattr(t, "cargo", None))
                     neto_por_categoria[cat] = neto_por_categoria.get(cat, Decimal(0)) + net
 
-                lineas_comp = [
-                    l
-                    for l in lineas_escenario
-                    if comp_desde <= l.fecha_impacto <= comp_hasta and _aplica_estado(l.fecha_impacto)
-                ]
-                cats_comp = {l.categoria_id for l in lineas_comp}
-                for cid in cats_comp:
-                    if cid not in id_nombre:
-                        c = crud_p.obtener_categoria_por_id(cid)
-                        if c:
-                            id_nombre[cid] = c.nombre
-                            id_codigo[cid] = c.codigo
-                for l in lineas_comp:
-                    codigo = id_codigo.get(l.categoria_id, "")
-                    nombre = id_nombre.get(l.categoria_id, str(l.categoria_id))
-                    concepto_raw = _concepto_desde_linea(codigo, nombre)
-                    prev = Decimal(str(proyectado_por_concepto.get(concepto_raw, 0)))
-                    proyectado_por_concepto[concepto_raw] = float(prev + _dec(l.monto))
+                def _proyectado_comparativo() -> Dict[str, float]:
+                    proyectado: Dict[str, float] = {}
+                    lineas_comp = [
+                        l
+                        for l in lineas_escenario
+                        if comp_desde <= l.fecha_impacto <= comp_hasta and _aplica_estado(l.fecha_impacto)
+                    ]
+                    cats_comp = {l.categoria_id for l in lineas_comp}
+                    for cid in cats_comp:
+                        if cid not in id_nombre:
+                            c = crud_p.categoria_por_id(cid)
+                            if c:
+                                id_nombre[cid] = c.nombre
+                                id_codigo[cid] = c.codigo
+                    for l in lineas_comp:
+                        codigo = id_codigo.get(l.categoria_id, "")
+                        nombre = id_nombre.get(l.categoria_id, str(l.categoria_id))
+                        concepto_raw = _concepto_desde_linea(codigo, nombre)
+                        prev = Decimal(str(proyectado.get(concepto_raw, 0)))
+                        proyectado[concepto_raw] = float(prev + _dec(l.monto))
+                    return proyectado
+
+                proyectado_por_concepto = dict(
+                    crud_p.derivado_snapshot(
+                        sid,
+                        ("comparativo", crud_p.registro_categorias().version, comp_desde, comp_hasta) + clave_vista,
+                        _proyectado_comparativo,
+                    )
+                )
 
             filas_comp = []
             conceptos_validos: List[str] = [